@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Time `deploy` against the fake engine, phase by phase.
+
+    python benchmarks/deploy.py --nodes 3,10,50 --default-latency 0.005
+
+Each size gets a new fake swarm, and is deployed twice: once from scratch,
+then again with nothing to change. The API calls made in each phase are counted.
+"""
+
+from collections import Counter
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+from typing import Dict, List
+
+import click
+
+import docker_static_cluster
+from docker_static_cluster import cluster, compose_cache, prepull, stackdeploy
+from fake_engine import FakeEngine, parse_latency, serve
+from translation import to_toml
+
+_stack_name = "bench"
+
+
+def deploy_config(hostnames: List[str], base_url: str, services: int) -> dict:
+    return {
+        "swarm": {"task_history_retention_limit": 10, "snapshot_interval": 5000},
+        "plugins": {
+            "bench-plugin": {
+                "image": "example/bench-plugin:latest",
+                "settings": {"DEBUG": "1"},
+            }
+        },
+        "nodes": {
+            hostname: {
+                "Spec": {"Role": "manager" if i < 3 else "worker"},
+                "remote_docker_conf": {"base_url": f"{base_url}/node/{hostname}"},
+            }
+            for i, hostname in enumerate(hostnames)
+        },
+        "stacks": {
+            _stack_name: {
+                "networks": {"backend": {"driver": "overlay"}},
+                "services": {
+                    f"service{i}": {
+                        "image": f"registry.example.com/service{i}:latest",
+                        "environment": {"INDEX": str(i)},
+                        "networks": ["backend"],
+                        "deploy": {"replicas": 1 + i % 3},
+                    }
+                    for i in range(services)
+                },
+            }
+        },
+    }
+
+
+class PhaseTimer:
+    """
+    Wraps the functions deploy calls for each phase, to time them and count the
+    API calls made while they run.
+
+    Phases called from inside another phase (propagate_plugins calls
+    plugins_update) count toward the outer one.
+    """
+
+    def __init__(self, engine: FakeEngine):
+        self.engine = engine
+        self.active = False
+        self.phases: Dict[str, dict] = {}
+
+    def wrap(self, phase: str, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if self.active:
+                return fn(*args, **kwargs)
+            self.active = True
+            calls_before = Counter(self.engine.calls)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                calls = Counter(self.engine.calls)
+                calls.subtract(calls_before)
+                result = self.phases.setdefault(phase, {"seconds": 0, "calls": {}})
+                result["seconds"] += seconds
+                for endpoint, count in calls.items():
+                    if count:
+                        result["calls"][endpoint] = (
+                            result["calls"].get(endpoint, 0) + count
+                        )
+                self.active = False
+
+        return wrapper
+
+    @contextlib.contextmanager
+    def patched(self):
+        patches = [
+            (docker_static_cluster, "_resolve", "translate"),
+            (cluster, "plugins_update", "plugins"),
+            (docker_static_cluster.swarm_update, "callback", "swarm"),
+            (cluster, "update_nodes", "nodes"),
+            (cluster, "propagate_plugins", "propagate"),
+            (prepull, "prepull_images", "prepull"),
+            (stackdeploy, "plan_stack", "stack plan"),
+            (stackdeploy, "resolve_images", "stack plan"),
+            (stackdeploy, "changed_services", "stack plan"),
+            (stackdeploy, "deploy_stack", "stack deploy"),
+            (stackdeploy, "force_update_services", "force update"),
+        ]
+        originals = [getattr(obj, name) for obj, name, _ in patches]
+        for (obj, name, phase), original in zip(patches, originals):
+            setattr(obj, name, self.wrap(phase, original))
+        try:
+            yield
+        finally:
+            for (obj, name, _), original in zip(patches, originals):
+                setattr(obj, name, original)
+
+
+def run_deploy(
+    engine: FakeEngine,
+    base_url: str,
+    config_path: str,
+    compose_path: str,
+    extra_args: List[str],
+    verbose: bool,
+) -> dict:
+    timer = PhaseTimer(engine)
+    engine.calls.clear()
+    args = [
+        "--no-cache",
+        "deploy",
+        "--file",
+        config_path,
+        "--compose-file",
+        compose_path,
+        "--stack-engine",
+        "native",
+        *extra_args,
+        _stack_name,
+    ]
+    output = io.StringIO()
+    os.environ["DOCKER_HOST"] = base_url
+    start = time.perf_counter()
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(output)
+    with timer.patched(), quiet:
+        docker_static_cluster.main.main(args, standalone_mode=False)
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": round(seconds, 6),
+        "calls": sum(engine.calls.values()),
+        "phases": {
+            phase: {
+                "seconds": round(result["seconds"], 6),
+                "calls": dict(sorted(result["calls"].items())),
+            }
+            for phase, result in timer.phases.items()
+        },
+    }
+
+
+@click.command()
+@click.option("--nodes", default="3,10,50", help="Comma separated node counts")
+@click.option("--services", type=click.IntRange(min=1), default=10)
+@click.option(
+    "--latency",
+    multiple=True,
+    help='Seconds the fake engine sleeps on an endpoint, like "GET /nodes=0.05"',
+)
+@click.option("--default-latency", type=float, default=0.002)
+@click.option(
+    "--deploy-arg",
+    "deploy_args",
+    multiple=True,
+    help="Passed through to deploy, like --deploy-arg=--diff",
+)
+@click.option("--verbose", is_flag=True, help="Show deploy's output")
+@click.option(
+    "--output",
+    type=click.File("w"),
+    default=None,
+    help="Write the results as JSON",
+)
+def main(
+    nodes: str,
+    services: int,
+    latency,
+    default_latency: float,
+    deploy_args,
+    verbose: bool,
+    output,
+):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for node_count in (int(count) for count in nodes.split(",")):
+            hostnames = [f"node{i}" for i in range(node_count)]
+            engine = FakeEngine(hostnames, 3, parse_latency(latency), default_latency)
+            server, base_url = serve(engine)
+            try:
+                config_path = os.path.join(directory, f"deploy-{node_count}.toml")
+                with open(config_path, "w") as f:
+                    f.write(to_toml(deploy_config(hostnames, base_url, services)))
+                compose_path = os.path.join(directory, f"compose-{node_count}.yaml")
+                for run in ("first", "again"):
+                    result = run_deploy(
+                        engine,
+                        base_url,
+                        config_path,
+                        compose_path,
+                        list(deploy_args),
+                        verbose,
+                    )
+                    result.update({"nodes": node_count, "run": run})
+                    results.append(result)
+                    click.echo(
+                        f"{node_count:>5} nodes {run:<5}"
+                        f" {result['seconds']:>8.3f}s {result['calls']:>6} calls",
+                        err=True,
+                    )
+                    for phase, phase_result in result["phases"].items():
+                        click.echo(
+                            f"      {phase:<14} {phase_result['seconds']:>8.3f}s"
+                            f" {sum(phase_result['calls'].values()):>6} calls",
+                            err=True,
+                        )
+            finally:
+                server.shutdown()
+                server.server_close()
+    if output:
+        json.dump(
+            {
+                "tool_version": compose_cache._tool_version(),
+                "python": platform.python_version(),
+                "services": services,
+                "default_latency": default_latency,
+                "latency": parse_latency(latency),
+                "deploy_args": list(deploy_args),
+                "results": results,
+            },
+            output,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+    main()
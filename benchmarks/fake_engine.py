@@ -0,0 +1,727 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+A stand-in Docker Engine API, just enough of one for `deploy`.
+
+It keeps the swarm, nodes, plugins, networks, configs, secrets and services in
+memory, and can sleep before answering to act like a real daemon. Each node's
+own daemon (for remote_docker_conf) is served under `/node/<hostname>`, so one
+server stands in for the whole swarm.
+
+    python benchmarks/fake_engine.py --nodes 5 --latency "GET /nodes=0.05"
+"""
+
+from collections import Counter, deque
+from datetime import datetime, timezone
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import queue
+import re
+import socketserver
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import uuid
+
+import click
+
+api_version = "1.45"
+
+_version_prefix = re.compile(r"^/v[0-9.]+(?=/)")
+_node_prefix = re.compile(r"^/node/([^/]+)(?=/)")
+
+
+def _split_target(target: str) -> Tuple[str, str, Dict[str, str]]:
+    """The node, the API path and the query"""
+    url = urlsplit(target)
+    host_match = _node_prefix.match(url.path)
+    host = host_match.group(1) if host_match else ""
+    path = _version_prefix.sub("", _node_prefix.sub("", url.path))
+    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+    return host, path, query
+
+
+class FakeError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _new_id() -> str:
+    # the same length as swarm object IDs
+    return uuid.uuid4().hex[:25]
+
+
+def _matches(obj: dict, filters: Dict[str, List[str]]) -> bool:
+    labels = obj.get("Spec", {}).get("Labels") or {}
+    for label in filters.get("label", []):
+        key, _, value = label.partition("=")
+        if key not in labels or (value and labels[key] != value):
+            return False
+    names = filters.get("name")
+    if names and not any(
+        name in obj.get("Spec", obj).get("Name", "") for name in names
+    ):
+        return False
+    return True
+
+
+def _normalize_spec(spec: dict) -> dict:
+    """docker-py sends the service mode in lower case, the engine doesn't"""
+    mode = spec.get("Mode")
+    if mode:
+        spec["Mode"] = {key[:1].upper() + key[1:]: value for key, value in mode.items()}
+    return spec
+
+
+class FakeEngine:
+    """
+    The state of the fake swarm, and the routes that work on it.
+
+    latency maps endpoints (like `POST /nodes/{id}/update`) to seconds to sleep,
+    anything else sleeps default_latency. Every request is counted by endpoint
+    in calls.
+    """
+
+    def __init__(
+        self,
+        hostnames: List[str],
+        managers: int = 3,
+        latency: Optional[Dict[str, float]] = None,
+        default_latency: float = 0,
+        reschedule_delay: float = 0,
+    ):
+        self.latency = latency or {}
+        self.default_latency = default_latency
+        self.reschedule_delay = reschedule_delay
+        # when the tasks last had to move, see list_tasks
+        self.scheduled_at = time.monotonic()
+        self.calls: Counter = Counter()
+        self.lock = threading.Lock()
+        self.subscribers: List[queue.Queue] = []
+        # like the engine, only the latest events are kept for since and until
+        self.events: deque = deque(maxlen=256)
+        self.daemon_id = str(uuid.uuid4())
+        self._index = 0
+        self.swarm = {
+            "ID": _new_id(),
+            "Version": {"Index": self._next_index()},
+            "CreatedAt": _now(),
+            "UpdatedAt": _now(),
+            "Spec": {
+                "Name": "default",
+                "Orchestration": {"TaskHistoryRetentionLimit": 5},
+                "Raft": {
+                    "SnapshotInterval": 10000,
+                    "KeepOldSnapshots": 0,
+                    "LogEntriesForSlowFollowers": 500,
+                    "ElectionTick": 10,
+                    "HeartbeatTick": 1,
+                },
+                "Dispatcher": {"HeartbeatPeriod": 5000000000},
+                "CAConfig": {"NodeCertExpiry": 7776000000000000},
+            },
+            "JoinTokens": {"Worker": "SWMTKN-worker", "Manager": "SWMTKN-manager"},
+        }
+        self.nodes: Dict[str, dict] = {}
+        for i, hostname in enumerate(hostnames):
+            node_id = _new_id()
+            self.nodes[node_id] = {
+                "ID": node_id,
+                "Version": {"Index": self._next_index()},
+                "Description": {"Hostname": hostname},
+                "Spec": {
+                    "Role": "manager" if i < managers else "worker",
+                    "Availability": "active",
+                    "Labels": {},
+                },
+                "Status": {"State": "ready", "Addr": f"10.0.0.{i + 1}"},
+            }
+            if i < managers:
+                self.nodes[node_id]["ManagerStatus"] = {
+                    "Leader": i == 0,
+                    "Reachability": "reachable",
+                    "Addr": f"10.0.0.{i + 1}:2377",
+                }
+        # plugins are per daemon, the rest is swarm wide
+        self.plugins: Dict[str, Dict[str, dict]] = {
+            hostname: {} for hostname in [""] + hostnames
+        }
+        self.networks: Dict[str, dict] = {}
+        self.configs: Dict[str, dict] = {}
+        self.secrets: Dict[str, dict] = {}
+        self.services: Dict[str, dict] = {}
+        # images are per daemon too, the registry has one digest per reference
+        self.images: Dict[str, Dict[str, dict]] = {
+            hostname: {} for hostname in [""] + hostnames
+        }
+        self.registry: Dict[str, str] = {}
+
+        self.routes: List[Tuple[str, re.Pattern, str, Callable]] = []
+        for method, path, handler in (
+            ("GET", "/_ping", lambda host, query, body: "OK"),
+            ("GET", "/version", self.get_version),
+            ("GET", "/info", self.get_info),
+            ("GET", "/swarm", lambda host, query, body: self.swarm),
+            ("POST", "/swarm/update", self.update_swarm),
+            ("GET", "/nodes", self.list_nodes),
+            ("GET", "/nodes/{id}", self.get_node),
+            ("POST", "/nodes/{id}/update", self.update_node),
+            ("DELETE", "/nodes/{id}", self.remove_node),
+            ("GET", "/plugins", self.list_plugins),
+            ("GET", "/plugins/privileges", lambda host, query, body: []),
+            ("POST", "/plugins/pull", self.pull_plugin),
+            ("GET", "/plugins/{id}/json", self.get_plugin),
+            ("POST", "/plugins/{id}/set", self.configure_plugin),
+            ("POST", "/plugins/{id}/enable", self.enable_plugin),
+            ("DELETE", "/plugins/{id}", self.remove_plugin),
+            ("GET", "/networks", self.list_networks),
+            ("POST", "/networks/create", self.create_network),
+            ("GET", "/networks/{id}", self.get_network),
+            ("GET", "/configs", self.lister(self.configs)),
+            ("POST", "/configs/create", self.creator(self.configs)),
+            ("GET", "/configs/{id}", self.getter(self.configs)),
+            ("DELETE", "/configs/{id}", self.remover(self.configs)),
+            ("GET", "/secrets", self.lister(self.secrets)),
+            ("POST", "/secrets/create", self.creator(self.secrets)),
+            ("GET", "/secrets/{id}", self.getter(self.secrets)),
+            ("DELETE", "/secrets/{id}", self.remover(self.secrets)),
+            ("GET", "/services", self.lister(self.services)),
+            ("POST", "/services/create", self.create_service),
+            ("GET", "/services/{id}", self.getter(self.services)),
+            ("POST", "/services/{id}/update", self.update_service),
+            ("GET", "/tasks", self.list_tasks),
+            ("GET", "/distribution/{id}/json", self.inspect_distribution),
+            ("GET", "/images/json", self.list_images),
+            ("GET", "/images/{id}/json", self.get_image),
+            ("POST", "/images/create", self.pull_image),
+        ):
+            pattern = re.compile(
+                "^" + re.escape(path).replace(r"\{id\}", "(?P<id>.+?)") + "$"
+            )
+            self.routes.append((method, pattern, f"{method} {path}", handler))
+
+    def publish(self, event_type: str, action: str, object_id: str, name: str):
+        """Send an event to every /events stream"""
+        event = {
+            "Type": event_type,
+            "Action": action,
+            "Actor": {"ID": object_id, "Attributes": {"name": name}},
+            "scope": "swarm",
+            "time": int(time.time()),
+            "timeNano": time.time_ns(),
+        }
+        self.events.append(event)
+        for subscriber in list(self.subscribers):
+            subscriber.put(event)
+
+    def set_node_state(self, hostname: str, state: str):
+        """Act like a node went down or came back"""
+        with self.lock:
+            node = self.get_node("", {"id": hostname}, None)
+            node["Status"]["State"] = state
+            node["Version"]["Index"] = self._next_index()
+            self.scheduled_at = time.monotonic()
+        self.publish("node", "update", node["ID"], hostname)
+
+    def restart(self):
+        """Act like the daemon restarted, it forgets its events and rejoins"""
+        with self.lock:
+            self.events.clear()
+            node = next(iter(self.nodes.values()))
+            node["Version"]["Index"] = self._next_index()
+            node["UpdatedAt"] = _now()
+
+    def _next_index(self) -> int:
+        self._index += 1
+        return self._index
+
+    def handle(
+        self, method: str, target: str, body: Optional[bytes]
+    ) -> Tuple[int, object]:
+        host, path, query = _split_target(target)
+        for route_method, pattern, endpoint, handler in self.routes:
+            match = pattern.match(path)
+            if route_method != method or not match:
+                continue
+            with self.lock:
+                self.calls[endpoint] += 1
+            time.sleep(self.latency.get(endpoint, self.default_latency))
+            if "id" in match.groupdict():
+                query["id"] = match.group("id")
+            parsed = json.loads(body) if body else None
+            try:
+                with self.lock:
+                    return 200, handler(host, query, parsed)
+            except FakeError as e:
+                return e.status, {"message": str(e)}
+        with self.lock:
+            self.calls[f"{method} (unknown)"] += 1
+        return 404, {"message": f"page not found: {method} {path}"}
+
+    # generic collections
+
+    def _find(self, collection: Dict[str, dict], key: str) -> dict:
+        if key in collection:
+            return collection[key]
+        for obj in collection.values():
+            if obj.get("Spec", obj).get("Name") == key:
+                return obj
+        raise FakeError(404, f"{key} not found")
+
+    def lister(self, collection: Dict[str, dict]) -> Callable:
+        def list_objects(host, query, body):
+            filters = json.loads(query.get("filters", "{}"))
+            return [obj for obj in collection.values() if _matches(obj, filters)]
+
+        return list_objects
+
+    def getter(self, collection: Dict[str, dict]) -> Callable:
+        return lambda host, query, body: self._find(collection, query["id"])
+
+    def creator(self, collection: Dict[str, dict]) -> Callable:
+        def create_object(host, query, body):
+            if any(obj["Spec"]["Name"] == body["Name"] for obj in collection.values()):
+                raise FakeError(409, f"{body['Name']} already exists")
+            object_id = _new_id()
+            collection[object_id] = {
+                "ID": object_id,
+                "Version": {"Index": self._next_index()},
+                "CreatedAt": _now(),
+                "UpdatedAt": _now(),
+                "Spec": body,
+            }
+            return {"ID": object_id}
+
+        return create_object
+
+    def remover(self, collection: Dict[str, dict]) -> Callable:
+        def remove_object(host, query, body):
+            obj = self._find(collection, query["id"])
+            del collection[obj["ID"]]
+
+        return remove_object
+
+    def _check_version(self, obj: dict, query: dict):
+        if int(query.get("version", -1)) != obj["Version"]["Index"]:
+            raise FakeError(500, "update out of sequence")
+        obj["Version"]["Index"] = self._next_index()
+        obj["UpdatedAt"] = _now()
+
+    # endpoints
+
+    def get_version(self, host, query, body):
+        return {
+            "ApiVersion": api_version,
+            "MinAPIVersion": "1.24",
+            "Version": "fake",
+            "Os": "linux",
+            "Arch": "amd64",
+        }
+
+    def get_info(self, host, query, body):
+        # the first node is the one being talked to
+        node_id = next(iter(self.nodes))
+        return {
+            "ID": self.daemon_id,
+            "Name": self.nodes[node_id]["Description"]["Hostname"],
+            "SystemTime": datetime.now(timezone.utc).strftime(
+                "%Y-%m-%dT%H:%M:%S.%f000Z"
+            ),
+            "Swarm": {
+                "NodeID": node_id,
+                "LocalNodeState": "active",
+                "ControlAvailable": True,
+            },
+        }
+
+    def update_swarm(self, host, query, body):
+        self._check_version(self.swarm, query)
+        self.swarm["Spec"] = body
+
+    def list_nodes(self, host, query, body):
+        return list(self.nodes.values())
+
+    def get_node(self, host, query, body):
+        for node in self.nodes.values():
+            if query["id"] in (node["ID"], node["Description"]["Hostname"]):
+                return node
+        raise FakeError(404, f"node {query['id']} not found")
+
+    def update_node(self, host, query, body):
+        node = self.get_node(host, query, body)
+        self._check_version(node, query)
+        node["Spec"] = body
+        self.scheduled_at = time.monotonic()
+        self.publish("node", "update", node["ID"], node["Description"]["Hostname"])
+
+    def remove_node(self, host, query, body):
+        node = self.nodes.pop(self.get_node(host, query, body)["ID"])
+        self.publish("node", "remove", node["ID"], node["Description"]["Hostname"])
+
+    def list_plugins(self, host, query, body):
+        return list(self.plugins[host].values())
+
+    def pull_plugin(self, host, query, body):
+        name = query.get("name") or query["remote"]
+        if ":" not in name:
+            name += ":latest"
+        self.plugins[host][name] = {
+            "Id": _new_id(),
+            "Name": name,
+            "Enabled": False,
+            "PluginReference": query["remote"],
+            "Settings": {"Env": [], "Args": [], "Devices": [], "Mounts": []},
+            "Config": {},
+        }
+        self._publish_plugin(host, "pull", self.plugins[host][name])
+        # normally a stream of progress messages
+        return {"status": "Download complete"}
+
+    def get_plugin(self, host, query, body):
+        name = query["id"]
+        plugins = self.plugins[host]
+        for key in (name, f"{name}:latest"):
+            if key in plugins:
+                return plugins[key]
+        for plugin in plugins.values():
+            if plugin["Id"] == name:
+                return plugin
+        raise FakeError(404, f"plugin {name} not found")
+
+    def configure_plugin(self, host, query, body):
+        plugin = self.get_plugin(host, query, body)
+        env = dict(item.split("=", 1) for item in plugin["Settings"]["Env"])
+        env.update(item.split("=", 1) for item in body)
+        plugin["Settings"]["Env"] = [f"{key}={value}" for key, value in env.items()]
+        self._publish_plugin(host, "set", plugin)
+
+    def enable_plugin(self, host, query, body):
+        plugin = self.get_plugin(host, query, body)
+        plugin["Enabled"] = True
+        self._publish_plugin(host, "enable", plugin)
+
+    def remove_plugin(self, host, query, body):
+        plugin = self.get_plugin(host, query, body)
+        del self.plugins[host][plugin["Name"]]
+        self._publish_plugin(host, "remove", plugin)
+
+    def _publish_plugin(self, host: str, action: str, plugin: dict):
+        # only the local daemon's plugins show up on its events
+        if not host:
+            self.publish("plugin", action, plugin["Id"], plugin["Name"])
+
+    def list_networks(self, host, query, body):
+        filters = json.loads(query.get("filters", "{}"))
+        return [
+            network
+            for network in self.networks.values()
+            if not filters.get("scope") or network["Scope"] in filters["scope"]
+        ]
+
+    def create_network(self, host, query, body):
+        network_id = _new_id()
+        self.networks[network_id] = {
+            "Id": network_id,
+            "Name": body["Name"],
+            "Scope": body.get("Scope", "swarm"),
+            "Driver": body.get("Driver"),
+            "Labels": body.get("Labels") or {},
+        }
+        return {"Id": network_id}
+
+    def get_network(self, host, query, body):
+        for network in self.networks.values():
+            if query["id"] in (network["Id"], network["Name"]):
+                return network
+        raise FakeError(404, f"network {query['id']} not found")
+
+    def create_service(self, host, query, body):
+        result = self.creator(self.services)(host, query, _normalize_spec(body))
+        self.services[result["ID"]]["Endpoint"] = {"Spec": {}}
+        self.scheduled_at = time.monotonic()
+        self.publish("service", "create", result["ID"], body["Name"])
+        return result
+
+    def update_service(self, host, query, body):
+        service = self._find(self.services, query["id"])
+        self._check_version(service, query)
+        service["PreviousSpec"] = service["Spec"]
+        service["Spec"] = _normalize_spec(body)
+        # tasks aren't simulated, so every update finishes right away
+        service["UpdateStatus"] = {
+            "State": "completed",
+            "StartedAt": _now(),
+            "CompletedAt": _now(),
+        }
+        self.scheduled_at = time.monotonic()
+        self.publish("service", "update", service["ID"], body["Name"])
+        return {"Warnings": []}
+
+    def registry_digest(self, reference: str) -> str:
+        """What the registry has for reference, set it to act like a push"""
+        if "@" in reference:
+            return reference.rsplit("@", 1)[-1]
+        if ":" not in reference.rsplit("/", 1)[-1]:
+            reference += ":latest"
+        if reference not in self.registry:
+            self.registry[reference] = (
+                "sha256:" + hashlib.sha256(reference.encode()).hexdigest()
+            )
+        return self.registry[reference]
+
+    def inspect_distribution(self, host, query, body):
+        return {
+            "Descriptor": {
+                "mediaType": "application/vnd.oci.image.index.v1+json",
+                "digest": self.registry_digest(query["id"]),
+                "size": 1024,
+            },
+            "Platforms": [{"architecture": "amd64", "os": "linux"}],
+        }
+
+    def list_images(self, host, query, body):
+        return list(self.images[host].values())
+
+    def get_image(self, host, query, body):
+        if query["id"] not in self.images[host]:
+            raise FakeError(404, f"No such image: {query['id']}")
+        return self.images[host][query["id"]]
+
+    def pull_image(self, host, query, body):
+        tag = query.get("tag") or "latest"
+        # the tag can be a digest too
+        separator = "@" if tag.startswith("sha256:") else ":"
+        reference = f"{query['fromImage']}{separator}{tag}"
+        digest = self.registry_digest(reference)
+        self.images[host][reference] = {
+            "Id": "sha256:" + hashlib.sha256(digest.encode()).hexdigest(),
+            "RepoTags": [] if separator == "@" else [reference],
+            "RepoDigests": [f"{query['fromImage']}@{digest}"],
+        }
+        # normally a stream of progress messages
+        return {"status": f"Digest: {digest}"}
+
+    def list_tasks(self, host, query, body):
+        """
+        Tasks spread over the active, ready nodes, worked out on every call.
+
+        Until reschedule_delay has passed since anything changed, tasks are
+        still starting.
+        """
+        filters = json.loads(query.get("filters", "{}"))
+        eligible = [
+            node
+            for node in self.nodes.values()
+            if node["Spec"].get("Availability") == "active"
+            and node["Status"]["State"] == "ready"
+        ]
+        settled = time.monotonic() - self.scheduled_at >= self.reschedule_delay
+        tasks = []
+        for i, service in enumerate(self.services.values()):
+            mode = service["Spec"].get("Mode") or {"Replicated": {"Replicas": 1}}
+            if "Global" in mode:
+                placed = [(slot, node) for slot, node in enumerate(eligible)]
+            elif "Replicated" in mode and eligible:
+                placed = [
+                    (slot, eligible[(i + slot) % len(eligible)])
+                    for slot in range(mode["Replicated"].get("Replicas", 1))
+                ]
+            else:
+                placed = []
+            for slot, node in placed:
+                tasks.append(
+                    {
+                        "ID": f"{service['ID'][:12]}{node['ID'][:12]}{slot}",
+                        "ServiceID": service["ID"],
+                        "NodeID": node["ID"],
+                        "Slot": slot + 1,
+                        "DesiredState": "running",
+                        "Status": {"State": "running" if settled else "starting"},
+                    }
+                )
+        for key, field in (("service", "ServiceID"), ("node", "NodeID")):
+            if key in filters:
+                tasks = [task for task in tasks if task[field] in filters[key]]
+        if "desired-state" in filters and "running" not in filters["desired-state"]:
+            tasks = []
+        return tasks
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self):
+        _, path, query = _split_target(self.path)
+        if self.command == "GET" and path == "/events":
+            filters = json.loads(query.get("filters", "{}"))
+            if "until" in query:
+                self._replay_events(
+                    float(query.get("since", 0)), float(query["until"]), filters
+                )
+            else:
+                self._stream_events(filters)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else None
+        status, result = self.server.engine.handle(self.command, self.path, body)
+        data = (
+            result.encode() if isinstance(result, str) else json.dumps(result).encode()
+        )
+        self.send_response(status)
+        self.send_header(
+            "Content-Type",
+            "text/plain" if isinstance(result, str) else "application/json",
+        )
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_DELETE = _respond
+
+    def _replay_events(self, since: float, until: float, filters: Dict[str, List[str]]):
+        """The logged events between since and until, then the end of the stream"""
+        engine = self.server.engine
+        with engine.lock:
+            engine.calls["GET /events"] += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in list(engine.events):
+            if not since <= event["timeNano"] / 1e9 <= until:
+                continue
+            if filters.get("type") and event["Type"] not in filters["type"]:
+                continue
+            data = json.dumps(event).encode() + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _stream_events(self, filters: Dict[str, List[str]]):
+        engine = self.server.engine
+        with engine.lock:
+            engine.calls["GET /events"] += 1
+        subscriber: queue.Queue = queue.Queue()
+        engine.subscribers.append(subscriber)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            while True:
+                try:
+                    event = subscriber.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if filters.get("type") and event["Type"] not in filters["type"]:
+                    continue
+                data = json.dumps(event).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+        except OSError:
+            # the client went away
+            pass
+        finally:
+            engine.subscribers.remove(subscriber)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _TCPHandler(_Handler):
+    # headers and body are written separately, don't let them wait on each other
+    disable_nagle_algorithm = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler wants a (host, port)
+        return request, ("local", 0)
+
+
+def serve(engine: FakeEngine, unix_socket: Optional[str] = None):
+    """
+    Serve the engine on a thread.
+
+    Returns the server and the base URL for docker.DockerClient. Stop it with
+    server.shutdown().
+    """
+    if unix_socket:
+        server = _UnixServer(unix_socket, _Handler)
+        base_url = f"unix://{os.path.abspath(unix_socket)}"
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _TCPHandler)
+        server.daemon_threads = True
+        base_url = f"tcp://127.0.0.1:{server.server_address[1]}"
+    server.engine = engine
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url
+
+
+def parse_latency(values) -> Dict[str, float]:
+    latency = {}
+    for value in values:
+        endpoint, _, seconds = value.rpartition("=")
+        latency[endpoint] = float(seconds)
+    return latency
+
+
+@click.command()
+@click.option("--nodes", type=click.IntRange(min=1), default=3)
+@click.option("--managers", type=click.IntRange(min=1), default=3)
+@click.option(
+    "--latency",
+    multiple=True,
+    help='Seconds to sleep on an endpoint, like "POST /nodes/{id}/update=0.1"',
+)
+@click.option("--default-latency", type=float, default=0)
+@click.option(
+    "--reschedule-delay",
+    type=float,
+    default=0,
+    help="Seconds tasks take to start again after a node or service changes",
+)
+@click.option("--unix-socket", type=click.Path(), default=None)
+def main(
+    nodes: int,
+    managers: int,
+    latency,
+    default_latency: float,
+    reschedule_delay: float,
+    unix_socket,
+):
+    engine = FakeEngine(
+        [f"node{i}" for i in range(nodes)],
+        managers,
+        parse_latency(latency),
+        default_latency,
+        reschedule_delay,
+    )
+    server, base_url = serve(engine, unix_socket)
+    click.echo(f"export DOCKER_HOST={base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        for endpoint, count in sorted(engine.calls.items()):
+            click.echo(f"{count:>6} {endpoint}", err=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Time each translation stage on synthetic configs.
+
+    python benchmarks/translation.py --sizes 10,100,1000 --output bench.json
+
+Every size scales the nodes, services, volumes and jq_pools of a single stack,
+in both TOML and YAML. The JSON output is stable, so it can be diffed between
+releases.
+"""
+
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, TypeVar
+
+import click
+import yaml
+
+from docker_static_cluster import compose_cache
+from docker_static_cluster.cantgetno import (
+    compile_jq,
+    satisfy_config,
+    satisfy_jq_pools,
+)
+from docker_static_cluster.schemas import dump_compose, injest_config
+
+T = TypeVar("T")
+
+_stack_name = "bench"
+
+
+def synthetic_config(size: int, pools: int) -> dict:
+    nodes = {
+        f"node{i}": {"Spec": {"Role": "manager" if i < 3 else "worker"}}
+        for i in range(size)
+    }
+    services = {
+        f"service{i}": {
+            "image": f"registry.example.com/service{i}:latest",
+            "environment": {"INDEX": str(i)},
+            "volumes": [f"volume{i}:/data"],
+            "deploy": {"replicas": 1 + i % 3},
+        }
+        for i in range(size)
+    }
+    volumes = {f"volume{i}": {"driver": "local"} for i in range(size)}
+    jq_pools = {
+        f"pool{i}": {
+            "services": (
+                '{("generated-" + $pool): {image: "busybox",'
+                " deploy: {replicas: (.nodes | length)}}}"
+            ),
+            "volumes": '{("generated-" + $pool): {driver: "local"}}',
+        }
+        for i in range(pools)
+    }
+    return {
+        "swarm": {"task_history_retention_limit": 5},
+        "nodes": nodes,
+        "stacks": {
+            _stack_name: {
+                "services": services,
+                "volumes": volumes,
+                "jq_pools": jq_pools,
+            }
+        },
+    }
+
+
+def _toml_value(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, str):
+        return json.dumps(value)
+    if isinstance(value, list):
+        return "[" + ", ".join(_toml_value(v) for v in value) + "]"
+    if isinstance(value, dict):
+        return (
+            "{"
+            + ", ".join(f"{json.dumps(k)} = {_toml_value(v)}" for k, v in value.items())
+            + "}"
+        )
+    raise TypeError(type(value))
+
+
+def to_toml(d: dict, path: tuple = ()) -> str:
+    """Just enough TOML for synthetic_config, since there's no TOML writer here"""
+    lines = []
+    tables = {}
+    for key, value in d.items():
+        if (
+            isinstance(value, dict)
+            and value
+            and all(isinstance(v, dict) for v in value.values())
+        ):
+            tables[key] = value
+        else:
+            lines.append(f"{json.dumps(key)} = {_toml_value(value)}")
+    if lines and path:
+        lines.insert(0, "[" + ".".join(json.dumps(k) for k in path) + "]")
+    text = "\n".join(lines) + "\n" if lines else ""
+    for key, value in tables.items():
+        text += to_toml(value, path + (key,))
+    return text
+
+
+def _seconds(fn: Callable[[], T]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _peak(fn: Callable[[], T]) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def _best(fn: Callable[[], T], repeat: int, setup=lambda: None) -> tuple[float, int]:
+    """
+    Fastest of `repeat` runs, and the peak memory of one more. `setup` isn't
+    measured.
+    """
+
+    def cold_arg():
+        # cold, like a fresh process would be
+        compile_jq.cache_clear()
+        return setup()
+
+    best = None
+    for _ in range(repeat):
+        arg = cold_arg()
+        seconds = _seconds(lambda: fn(arg))
+        if best is None or seconds < best:
+            best = seconds
+    # NOTE: tracemalloc slows allocations down a lot, so it can't be on while
+    #  timing
+    arg = cold_arg()
+    return best, _peak(lambda: fn(arg))
+
+
+def bench(path: str, size: int, entities: int, repeat: int) -> List[Dict]:
+    def injest(_=None):
+        with open(path, "rb") as f:
+            return injest_config(f)
+
+    def dump(stack):
+        stream = io.StringIO()
+        dump_compose(stack, stream)
+        return stream.getvalue()
+
+    stack = satisfy_config(injest(), _stack_name)[4]
+    stages = {
+        "injest_config": _best(injest, repeat),
+        "satisfy_jq_pools": _best(
+            lambda config: satisfy_jq_pools(config, _stack_name), repeat, injest
+        ),
+        # satisfy_config changes the config, so it needs a new one each time
+        "satisfy_config": _best(
+            lambda config: satisfy_config(config, _stack_name), repeat, injest
+        ),
+        "dump_compose": _best(dump, repeat, lambda: stack),
+    }
+    return [
+        {
+            "format": os.path.splitext(path)[1][1:],
+            "size": size,
+            "stage": stage,
+            "seconds": round(seconds, 6),
+            "entities": entities,
+            "entities_per_second": round(entities / seconds, 1) if seconds else None,
+            "peak_bytes": peak,
+        }
+        for stage, (seconds, peak) in stages.items()
+    ]
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default="10,100,1000",
+    help="Comma separated sizes, up to 10000",
+)
+@click.option(
+    "--max-pools",
+    type=int,
+    default=None,
+    help="Cap the number of jq_pools, which is otherwise the size",
+)
+@click.option("--repeat", type=click.IntRange(min=1), default=3)
+@click.option(
+    "--output",
+    type=click.File("w"),
+    default=None,
+    help="Write the results as JSON",
+)
+def main(sizes: str, max_pools, repeat: int, output):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in (int(size) for size in sizes.split(",")):
+            pools = size if max_pools is None else min(size, max_pools)
+            config_d = synthetic_config(size, pools)
+            # nodes, services and volumes, plus what the pools generate
+            entities = size * 3 + pools * 2
+            for extension, text in (
+                ("toml", to_toml(config_d)),
+                ("yaml", yaml.safe_dump(config_d)),
+            ):
+                path = os.path.join(directory, f"bench-{size}.{extension}")
+                with open(path, "w") as f:
+                    f.write(text)
+                for result in bench(path, size, entities, repeat):
+                    results.append(result)
+                    click.echo(
+                        f"{result['format']:<5} {size:>6} {result['stage']:<17}"
+                        f" {result['seconds']:>10.4f}s"
+                        f" {result['entities_per_second'] or 0:>12.1f}/s"
+                        f" {result['peak_bytes'] / 2**20:>9.1f}MiB",
+                        err=True,
+                    )
+    if output:
+        json.dump(
+            {
+                "tool_version": compose_cache._tool_version(),
+                "python": platform.python_version(),
+                "platform": sys.platform,
+                "libyaml": yaml.__with_libyaml__,
+                "repeat": repeat,
+                "results": results,
+            },
+            output,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+    main()
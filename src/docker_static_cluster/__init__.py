@@ -5,8 +5,11 @@
 #
 # SPDX-License-Identifier: MIT
 
+from __future__ import annotations
+
+import io
 import os
-from typing import Dict, List, TextIO, Optional
+from typing import TYPE_CHECKING, Callable, Dict, List, TextIO, Optional, Tuple
 import json
 import subprocess
 import shlex
@@ -14,23 +17,22 @@ import sys
 import traceback
 
 import click
-import yaml
-import docker
-import docker.errors
-
-from .schemas import (
-    ConfigNode,
-    ConfigNodeRMSpec,
-    ConfigNodeSpec,
-    ConfigNodes,
-    ConfigPlugins,
-    ConfigServices,
-    ConfigStack,
-    ConfigSwarm,
-    injest_config,
-    Config,
-)
-from .cantgetno import satisfy_config
+
+from . import tracing
+
+# NOTE: docker, yaml, jq and pydantic are slow to import, so they're only
+#  imported by the commands that use them. This keeps --help, completion and
+#  the light commands fast.
+if TYPE_CHECKING:
+    from .inventory import NodeInventory
+    from .plan import Change, LiveState
+    from .schemas import (
+        Config,
+        ConfigNodes,
+        ConfigPlugins,
+        ConfigStack,
+        ConfigSwarm,
+    )
 
 debug = True
 
@@ -41,15 +43,189 @@ debug = True
 def run_cmd(args: List[str], check=True, **kwargs):
     click.echo(f"\n$ {shlex.join(args)}\n")
     try:
-        return subprocess.run(args, check=check, **kwargs)
+        with tracing.span(shlex.join(args), "subprocess"):
+            return subprocess.run(args, check=check, **kwargs)
     except subprocess.CalledProcessError as e:
         sys.exit(e.returncode)
 
 
+def run_cmd_echoed(args: List[str], echo: Callable[[str], None], **kwargs):
+    """
+    Like run_cmd, but for alongside other work: the output goes through echo a
+    line at a time, and failing raises a ClickException rather than exiting.
+    """
+    echo(f"\n$ {shlex.join(args)}\n")
+    with tracing.span(shlex.join(args), "subprocess"):
+        with subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            **kwargs,
+        ) as process:
+            assert process.stdout
+            for line in process.stdout:
+                echo(line.rstrip("\n"))
+    if process.returncode:
+        raise click.ClickException(
+            f"{shlex.join(args)} exited with {process.returncode}"
+        )
+
+
+_resolved_meta_key = "docker_static_cluster.resolved"
+_injested_meta_key = "docker_static_cluster.injested"
+_use_cache_meta_key = "docker_static_cluster.use_cache"
+_pool_outputs_meta_key = "docker_static_cluster.pool_outputs"
+_jq_workers_meta_key = "docker_static_cluster.jq_workers"
+# the swarm as deploy --diff inspected it, so swarm update needn't again
+_live_swarm_meta_key = "docker_static_cluster.live_swarm"
+
+
+def _injest(infile: TextIO) -> Config:
+    """
+    The parsed config file, before any jq_pools ran.
+
+    Kept like _resolve, so resolving several stacks parses the file once.
+    """
+    injested = click.get_current_context().meta.setdefault(_injested_meta_key, {})
+    if infile.name not in injested:
+        from .schemas import injest_config
+
+        with tracing.span("injest config", "config"):
+            if infile.seekable():
+                infile.seek(0)
+            injested[infile.name] = injest_config(infile)
+            if infile.seekable():
+                infile.seek(0)
+    return injested[infile.name]
+
+
+def _resolve(
+    infile: TextIO, stack_name: str
+) -> Tuple[Tuple[Config, ConfigNodes, ConfigSwarm, ConfigPlugins, ConfigStack], str]:
+    ctx = click.get_current_context()
+    resolved = ctx.meta.setdefault(_resolved_meta_key, {})
+    key = (infile.name, stack_name)
+    if key in resolved:
+        return resolved[key]
+
+    from . import compose_cache
+    from .cantgetno import pools_are_deterministic, satisfy_config, split_config
+    from .schemas import Config, ConfigStacks, dump_compose
+
+    entry_key = None
+    use_cache = ctx.meta.get(_use_cache_meta_key, True)
+    if use_cache and infile.seekable():
+        with tracing.span("load cached config", "config"):
+            infile.seek(0)
+            entry_key = compose_cache.cache_key(infile.read(), stack_name)
+            infile.seek(0)
+            entry = compose_cache.load(entry_key)
+            if entry:
+                config = Config.model_validate_json(entry["config"])
+                resolved[key] = split_config(config, stack_name), entry["compose"]
+                return resolved[key]
+
+    injested = _injest(infile)
+    # NOTE: the key is only the file, so a stack whose pools use env, $ENV or
+    #  now can't be cached whole, their results could differ next time. Since
+    #  none are stored, none are loaded either.
+    if entry_key and not pools_are_deterministic(injested.stacks[stack_name]):
+        entry_key = None
+    # satisfying a stack replaces it in config.stacks, other stacks should still
+    #  see the config as it was written
+    config = injested.model_copy(
+        update={"stacks": ConfigStacks(dict(injested.stacks.items()))}
+    )
+    pool_outputs = None
+    if use_cache:
+        # kept in memory too, for watch
+        all_pool_outputs = ctx.meta.setdefault(_pool_outputs_meta_key, {})
+        pool_outputs_key = compose_cache.pool_outputs_key(infile.name, stack_name)
+        if pool_outputs_key not in all_pool_outputs:
+            all_pool_outputs[pool_outputs_key] = compose_cache.load_pool_outputs(
+                pool_outputs_key
+            )
+        pool_outputs = all_pool_outputs[pool_outputs_key]
+    with tracing.span("satisfy config", "config"):
+        parts = satisfy_config(
+            config, stack_name, pool_outputs, ctx.meta.get(_jq_workers_meta_key, 1)
+        )
+    if pool_outputs is not None:
+        compose_cache.store_pool_outputs(pool_outputs_key, pool_outputs)
+    with tracing.span("dump compose", "config"):
+        compose_stream = io.StringIO()
+        dump_compose(parts[4], compose_stream)
+        compose = compose_stream.getvalue()
+    if entry_key:
+        compose_cache.store(
+            entry_key, {"config": parts[0].model_dump_json(), "compose": compose}
+        )
+    resolved[key] = parts, compose
+    return resolved[key]
+
+
+def resolve_config(
+    infile: TextIO, stack_name: str
+) -> tuple[Config, ConfigNodes, ConfigSwarm, ConfigPlugins, ConfigStack]:
+    """
+    Injest and satisfy the config file.
+
+    The result is kept in the click context meta, which is shared by every
+    context in this process, so commands calling each other (like `deploy`
+    does) only translate the config once. It's also kept in the on-disk
+    compose_cache, so later runs on the same file skip translation entirely.
+    """
+    return _resolve(infile, stack_name)[0]
+
+
+def resolve_compose(infile: TextIO, stack_name: str) -> str:
+    """The compose file for the stack, see resolve_config"""
+    return _resolve(infile, stack_name)[1]
+
+
 @click.group()
 @click.version_option()
-def main():
-    pass
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Don't use or update the caches of resolved config files and swarm state",
+)
+@click.option(
+    "--trace",
+    type=click.File("w", lazy=True),
+    help="Write a Chrome trace of where the time went, for ui.perfetto.dev",
+)
+@click.option(
+    "--jq-workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Processes to run jq_pools in, pools that use $stack still run in order",
+)
+@click.pass_context
+def main(ctx, no_cache: bool, trace: Optional[TextIO], jq_workers: int):
+    sys.excepthook = handle_ecxeption
+    ctx.meta[_use_cache_meta_key] = not no_cache
+    ctx.meta[_jq_workers_meta_key] = jq_workers
+    if trace:
+        tracing.enable()
+        ctx.call_on_close(lambda: _write_trace(trace))
+    ctx.call_on_close(_close_clients)
+
+
+def _close_clients():
+    # only if a command made any, importing it would import docker
+    if f"{__name__}.clients" in sys.modules:
+        sys.modules[f"{__name__}.clients"].close_all()
+
+
+def _write_trace(trace: TextIO):
+    # also runs when the command failed, that's when it's most useful
+    tracing.write(trace)
+    trace.close()
+    click.echo(f"\nTrace written to {trace.name}, top spans:", err=True)
+    for line in tracing.summary():
+        click.echo(line, err=True)
 
 
 _infile_option = click.option(
@@ -81,30 +257,151 @@ _as_remote_node_option = click.option(
 )
 
 
+_all_stacks_option = click.option(
+    "--all",
+    "all_stacks",
+    is_flag=True,
+    help="Every stack in the config file, instead of the STACK_NAMES given",
+)
+
+
+def _stack_names(
+    infile: TextIO, stack_names: Tuple[str, ...], all_stacks: bool
+) -> List[str]:
+    if all_stacks:
+        if stack_names:
+            raise click.UsageError("Give either STACK_NAMES or --all, not both")
+        stack_names = tuple(_injest(infile).stacks.keys())
+        if not stack_names:
+            raise click.UsageError(f"{infile.name} has no stacks")
+    if not stack_names:
+        raise click.UsageError("Give at least one STACK_NAME, or --all")
+    return list(dict.fromkeys(stack_names))
+
+
+def _stack_compose_file(
+    compose_file: TextIO, stack_name: str, stack_names: List[str]
+) -> TextIO:
+    """compose.yaml for one stack, compose.<stack_name>.yaml for several"""
+    if len(stack_names) == 1:
+        return compose_file
+    root, ext = os.path.splitext(compose_file.name)
+    return click.utils.LazyFile(f"{root}.{stack_name}{ext}", "w")
+
+
 @main.command()
-@click.argument("stack_name", type=str)
+@click.argument("stack_names", nargs=-1, type=str)
+@_all_stacks_option
 @_infile_option
 @_composefile_option
 def generate_compose(
-    stack_name: str, infile: TextIO, compose_file: TextIO
-) -> tuple[Config, ConfigNodes, ConfigSwarm, ConfigPlugins, ConfigStack]:
-    """Generate a compose file for use with `docker stack`"""
-    config = injest_config(infile)
-    config, nodes, swarm, plugins, stack = satisfy_config(config, stack_name)
-    stack_d = stack.model_dump()
-    for key in ("jq_pools",):
-        stack_d.pop(key)
-    yaml.dump(stack_d, compose_file)
-    return config, nodes, swarm, plugins, stack
+    stack_names: Tuple[str, ...],
+    all_stacks: bool,
+    infile: TextIO,
+    compose_file: TextIO,
+) -> Dict[str, Tuple[Config, ConfigNodes, ConfigSwarm, ConfigPlugins, ConfigStack]]:
+    """
+    Generate a compose file for use with `docker stack`
+
+    With more than one stack, each gets its own compose file, named after the
+    stack (like compose.web.yaml).
+    """
+    resolved = {}
+    all_stack_names = _stack_names(infile, stack_names, all_stacks)
+    for stack_name in all_stack_names:
+        stack_compose_file = _stack_compose_file(
+            compose_file, stack_name, all_stack_names
+        )
+        compose = resolve_compose(infile, stack_name)
+        try:
+            with open(stack_compose_file.name) as f:
+                unchanged = f.read() == compose
+        except OSError:
+            unchanged = False
+        if unchanged:
+            # NOTE: compose_file is lazy, so not writing leaves the mtime alone
+            click.echo(f"{stack_compose_file.name} is unchanged", err=True)
+        else:
+            stack_compose_file.write(compose)
+        if stack_compose_file is not compose_file:
+            stack_compose_file.close_intelligently()
+        resolved[stack_name] = resolve_config(infile, stack_name)
+    return resolved
 
 
 @main.command()
 @click.argument("output", type=click.File("w"))
 def generate_compose_schema(output: TextIO):
     """Generate the schema file for the config"""
+    from .schemas import Config
+
     json.dump(Config.model_json_schema(), output)
 
 
+def _plan_changes(
+    live: LiveState,
+    nodes_settings: ConfigNodes,
+    swarm_settings: ConfigSwarm,
+    stacks_settings: Dict[str, ConfigStack],
+) -> List[Change]:
+    """Everything but plugins, since those are planned on each node"""
+    from .plan import plan_nodes, plan_services, plan_swarm
+
+    changes = []
+    if swarm_settings:
+        changes.extend(plan_swarm(live, swarm_settings))
+    changes.extend(plan_nodes(live, nodes_settings))
+    for stack_name, stack_settings in stacks_settings.items():
+        changes.extend(plan_services(live, stack_name, stack_settings))
+    return changes
+
+
+def _echo_changes(changes: List[Change]):
+    for change in changes:
+        click.echo(change)
+    if not changes:
+        click.echo("No changes.")
+
+
+def _remote_docker_env(node_name: str, nodes_settings: ConfigNodes) -> Dict[str, str]:
+    """DOCKER_HOST for the docker CLI to talk to a node like its client does"""
+    node_settings = nodes_settings.get(node_name)
+    remote_docker_conf = node_settings and node_settings.remote_docker_conf
+    if not remote_docker_conf or not remote_docker_conf.base_url:
+        raise click.ClickException(f"remote node {node_name} has no base_url")
+    if remote_docker_conf.tls:
+        raise click.ClickException(
+            f"docker-sdp can't use the tls settings of remote node {node_name},"
+            " try --stack-engine native"
+        )
+    return {"DOCKER_HOST": remote_docker_conf.base_url}
+
+
+@main.command("plan")
+@click.argument("stack_names", nargs=-1, type=str)
+@_all_stacks_option
+@_infile_option
+def show_plan(
+    stack_names: Tuple[str, ...], all_stacks: bool, infile: TextIO
+) -> List[Change]:
+    """Show what deploy --diff would change"""
+    from .clients import get_client
+    from .plan import fetch_live_state, plan_plugins
+
+    stacks = {
+        stack_name: resolve_config(infile, stack_name)[4]
+        for stack_name in _stack_names(infile, stack_names, all_stacks)
+    }
+    config, nodes, swarm, plugins, _ = resolve_config(infile, next(iter(stacks)))
+
+    use_cache = click.get_current_context().meta.get(_use_cache_meta_key, True)
+    live = fetch_live_state(get_client(), use_cache)
+    changes = _plan_changes(live, nodes, swarm, stacks)
+    changes.extend(plan_plugins(live.plugins, plugins))
+    _echo_changes(changes)
+    return changes
+
+
 @main.command()
 @_infile_option
 @_composefile_option
@@ -115,7 +412,54 @@ def generate_compose_schema(output: TextIO):
 @click.option("--skip-propagate-config", is_flag=True)
 @click.option("--skip-stack-deploy", is_flag=True)
 @click.option("--force-service-update", is_flag=True)
-@click.argument("stack_name", type=str)
+@click.option(
+    "--force-only-changed",
+    is_flag=True,
+    help="Only force update services whose spec, configs or secrets changed",
+)
+@click.option("--service-concurrency", type=click.IntRange(min=1), default=4)
+@click.option(
+    "--force-update-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Seconds to wait on each service's forced update",
+)
+@click.option(
+    "--diff",
+    is_flag=True,
+    help="Compare against the live swarm and only apply what changed",
+)
+@click.option(
+    "--stack-engine",
+    type=click.Choice(["auto", "native", "docker-sdp"]),
+    default="auto",
+    help="auto uses native unless the stack needs something only docker-sdp can do",
+)
+@click.option("--node-concurrency", type=click.IntRange(min=1), default=4)
+@click.option("--propagate-concurrency", type=click.IntRange(min=1), default=4)
+@click.option(
+    "--propagate-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Seconds to wait on each node while propagating config",
+)
+@click.option(
+    "--stack-concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    help="How many stacks are deployed at once",
+)
+@click.option(
+    "--prepull",
+    is_flag=True,
+    help="Pull the stacks' images on the nodes that may run them, before deploying",
+)
+@click.option(
+    "--prepull-concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    help="How many nodes pull at once",
+)
+@_all_stacks_option
+@click.argument("stack_names", nargs=-1, type=str)
 @click.pass_context
 def deploy(
     ctx,
@@ -128,113 +472,357 @@ def deploy(
     skip_propagate_config: bool,
     skip_stack_deploy: bool,
     force_service_update: bool,
-    stack_name: str,
+    force_only_changed: bool,
+    service_concurrency: int,
+    force_update_timeout: Optional[float],
+    diff: bool,
+    stack_engine: str,
+    node_concurrency: int,
+    propagate_concurrency: int,
+    propagate_timeout: Optional[float],
+    stack_concurrency: int,
+    prepull: bool,
+    prepull_concurrency: int,
+    all_stacks: bool,
+    stack_names: Tuple[str, ...],
 ):
-    """Deploy the config file."""
-    config, nodes_settings, swarm_settings, plugins_settings, _ = ctx.invoke(
+    """
+    Deploy the config file.
+
+    The swarm, nodes and plugins are updated once, then each stack is deployed,
+    up to --stack-concurrency of them at once. With --prepull, the nodes pull
+    every stack's images before any of them are deployed.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from .clients import get_client, node_client
+    from .cluster import plugins_update, propagate_plugins, update_nodes
+    from .inventory import NodeInventory
+    from .plan import fetch_live_state
+    from .prepull import prepull_images
+    from .schemas import Config, ConfigNodes, ConfigPlugins, ConfigSwarm
+    from .stackdeploy import (
+        UnsupportedComposeError,
+        changed_services,
+        deploy_stack,
+        force_update_services,
+        plan_stack,
+        resolve_images,
+    )
+
+    resolved = ctx.invoke(
         generate_compose,
-        stack_name=stack_name,
+        stack_names=stack_names,
+        all_stacks=all_stacks,
         infile=infile,
         compose_file=compose_file,
     )
+    all_stack_names = list(resolved.keys())
+    # the same for every stack, they're from the same config
+    config, nodes_settings, swarm_settings, plugins_settings, _ = resolved[
+        all_stack_names[0]
+    ]
     assert isinstance(config, Config)
     assert isinstance(nodes_settings, ConfigNodes)
     assert isinstance(swarm_settings, ConfigSwarm)
     assert isinstance(plugins_settings, ConfigPlugins)
 
-    stacks_settings = config.stacks
-    stack_settings = stacks_settings[stack_name]
+    stacks_settings = {stack_name: parts[4] for stack_name, parts in resolved.items()}
 
     # TODO: something was ignoring unsupported "restart" option
 
-    if as_remote_node:
-        node_settings = nodes_settings[as_remote_node]
-        assert node_settings, f"remote node {as_remote_node} could not be found"
-        assert node_settings.remote_docker_conf, (
-            f"remote node {as_remote_node} does not have a remote remote_docker_conf"
+    # shared with the commands invoked below, so they reuse its connections
+    local_client = get_client(
+        max_pool_size=max(
+            node_concurrency,
+            prepull_concurrency if prepull else 0,
+            min(stack_concurrency, len(all_stack_names)) * service_concurrency,
         )
-        remote_docker_conf_d = node_settings.remote_docker_conf.model_dump()
-        d_client = docker.DockerClient(
-            **{
-                key: value
-                for key, value in remote_docker_conf_d.items()
-                if value is not None
+    )
+    if as_remote_node:
+        d_client = node_client(as_remote_node, nodes_settings.get(as_remote_node))
+    else:
+        d_client = local_client
+
+    inventory: Optional[NodeInventory] = None
+    if diff:
+        with tracing.span("fetch live state"):
+            live = fetch_live_state(
+                local_client, ctx.meta.get(_use_cache_meta_key, True)
+            )
+        inventory = live.nodes
+        ctx.meta[_live_swarm_meta_key] = live.swarm
+        changes = _plan_changes(live, nodes_settings, swarm_settings, stacks_settings)
+        _echo_changes(changes)
+        changed_swarm = any(change.kind == "swarm" for change in changes)
+        changed_nodes = ConfigNodes(
+            {
+                change.name: nodes_settings[change.name]
+                for change in changes
+                if change.kind == "node"
             }
         )
     else:
-        d_client = docker.from_env()
+        changed_swarm = True
+        changed_nodes = nodes_settings
 
     if not skip_plugins:
-        for plugin_name, plugin_config in plugins_settings.items():
-            try:
-                d_plugin = d_client.plugins.get(plugin_name)
-                if plugin_config.remove:
-                    d_plugin.remove(force=plugin_config.remove == "force")
-                    continue
-            except docker.errors.NotFound:
-                d_plugin = d_client.plugins.install(
-                    remote_name=plugin_config.image,
-                    local_name=plugin_name,
-                )
-            plugin_config_d = plugin_config.model_dump()
-            plugin_config_d["name"] = plugin_name
-            d_plugin.configure(plugin_config)
+        with tracing.span("plugins"):
+            for change in plugins_update(d_client, plugins_settings, diff):
+                if diff:
+                    click.echo(change)
         # TODO: prune option
-    if not skip_swarm and swarm_settings:
-        ctx.invoke(swarm_update, stack_name=stack_name)
+    if not skip_swarm and swarm_settings and changed_swarm:
+        with tracing.span("swarm"):
+            ctx.invoke(swarm_update, stack_name=all_stack_names[0], infile=infile)
     if not skip_nodes:
-        for node_name in nodes_settings.keys():
-            ctx.invoke(node_update, node=node_name, stack_name=stack_name)
+        with tracing.span("nodes"):
+            update_nodes(
+                inventory or NodeInventory(local_client),
+                changed_nodes,
+                node_concurrency,
+            )
         # TODO prune
     if (not skip_propagate_config) and (not skip_plugins):
-        for node_name in nodes_settings.keys():
-            ctx.invoke(
-                deploy,
-                skip_plugins=False,
-                skip_nodes=True,
-                skip_swarm=True,
-                skip_propagate_config=True,
-                skip_stack_deploy=True,
-                as_remote_node=node_name,
-                stack_name=stack_name,
+        with tracing.span("propagate"):
+            propagate_plugins(
+                nodes_settings,
+                plugins_settings,
+                propagate_concurrency,
+                propagate_timeout,
+                diff,
             )
-    if not skip_stack_deploy:
-        # TODO prune
-
-        # stack_settings = stacks_settings[stack_name]
-        if as_remote_node:
-            # TODO: support ssh
-            raise NotImplementedError("Stack commands cannot be run on a remote node")
-        # NOTE: below doesn't do things the right way
-        #
-        # cmd = ["docker"]
-        #
-        # this instead adds behavior expected from docker stack,
-        #  alike that of docker compose
-        # TODO: this is python code, but they don't provide a python API
-        cmd = ["docker-sdp"]
-
-        cmd.extend(["stack", "deploy"])
-        cmd.append(stack_name)
-        cmd.extend(["--compose-file", compose_file.name])
-
-        run_cmd(cmd)
-    if force_service_update:
-        if as_remote_node:
-            # TODO: support ssh
-            raise NotImplementedError(
-                "forcing a service update cannot be run on a remote node"
+    if prepull and not skip_stack_deploy:
+        with tracing.span("prepull"):
+            prepull_images(
+                # NOTE: not the one from --diff, the nodes may have changed
+                NodeInventory(local_client),
+                nodes_settings,
+                stacks_settings,
+                prepull_concurrency,
             )
 
-        services_settings: ConfigServices = stack_settings.services
-        services_settings_d = services_settings.model_dump()
+    def deploy_one(stack_name: str, echo: Callable[[str], None]):
+        stack_settings = stacks_settings[stack_name]
+        stack_compose_file = _stack_compose_file(
+            compose_file, stack_name, all_stack_names
+        )
+        stack_plan = None
+        if stack_engine != "docker-sdp" and (
+            not skip_stack_deploy or force_service_update
+        ):
+            try:
+                with tracing.span("plan stack", stack=stack_name):
+                    stack_plan = plan_stack(
+                        stack_name,
+                        stack_settings,
+                        os.path.dirname(os.path.abspath(stack_compose_file.name)),
+                    )
+            except UnsupportedComposeError as e:
+                if stack_engine == "native":
+                    raise
+                echo(f"falling back to docker-sdp: {e}")
+            if stack_plan:
+                with tracing.span("resolve images", stack=stack_name):
+                    stack_plan = resolve_images(
+                        d_client, stack_plan, service_concurrency
+                    )
+        force_services = list(stack_settings.services.keys())
+        if force_service_update and force_only_changed:
+            if stack_plan:
+                # has to be checked before the stack deploy makes them match
+                with tracing.span("changed services", stack=stack_name):
+                    force_services = changed_services(d_client, stack_name, stack_plan)
+            else:
+                echo(
+                    "can't tell which services changed without the native stack"
+                    " engine, forcing all of them"
+                )
+        if not skip_stack_deploy:
+            # TODO prune
+            if stack_plan:
+                with tracing.span("stack deploy", stack=stack_name):
+                    updated = deploy_stack(d_client, stack_name, stack_plan, echo)
+                if force_only_changed:
+                    # they already rolled when they were updated
+                    force_services = [
+                        service_name
+                        for service_name in force_services
+                        if service_name not in updated
+                    ]
+            else:
+                # NOTE: below doesn't do things the right way
+                #
+                # cmd = ["docker"]
+                #
+                # this instead adds behavior expected from docker stack,
+                #  alike that of docker compose
+                # TODO: this is python code, but they don't provide a python API
+                cmd = ["docker-sdp"]
+
+                cmd.extend(["stack", "deploy"])
+                cmd.append(stack_name)
+                cmd.extend(["--compose-file", stack_compose_file.name])
+
+                env = None
+                if as_remote_node:
+                    env = dict(os.environ)
+                    env.update(_remote_docker_env(as_remote_node, nodes_settings))
+                with tracing.span("stack deploy", stack=stack_name):
+                    run_cmd_echoed(cmd, echo, env=env)
+        if force_service_update:
+            with tracing.span("force update", stack=stack_name):
+                force_update_services(
+                    d_client,
+                    stack_name,
+                    force_services,
+                    service_concurrency,
+                    echo,
+                    timeout=force_update_timeout,
+                )
 
-        for service_name in services_settings_d.keys():
-            cmd = ["docker", "service", "update"]
-            cmd.append("--force")
-            cmd.append(f"{stack_name}_{service_name}")
+    if len(all_stack_names) == 1:
+        deploy_one(all_stack_names[0], click.echo)
+        return
+
+    def deploy_buffered(stack_name: str) -> Tuple[List[str], bool]:
+        lines: List[str] = []
+        try:
+            deploy_one(stack_name, lines.append)
+        except Exception as e:
+            if debug:
+                lines.append(traceback.format_exc())
+            lines.append(f"stack {stack_name} failed: {type(e).__name__}: {e}")
+            return lines, False
+        return lines, True
+
+    # output is printed in config order, like update_nodes
+    failed = 0
+    with ThreadPoolExecutor(max_workers=stack_concurrency) as executor:
+        for stack_name, (lines, ok) in zip(
+            all_stack_names, executor.map(deploy_buffered, all_stack_names)
+        ):
+            click.echo(f"\nStack {stack_name}:")
+            for line in lines:
+                click.echo(line)
+            if not ok:
+                failed += 1
+    if failed:
+        raise click.ClickException(f"{failed} stack(s) failed to deploy")
 
-            run_cmd(cmd)
+
+@main.command()
+@_infile_option
+@_composefile_option
+@click.option(
+    "--debounce",
+    type=click.FloatRange(min=0),
+    default=1,
+    help="Seconds to wait for more changes before applying them together",
+)
+@click.option("--node-concurrency", type=click.IntRange(min=1), default=4)
+@click.option("--propagate-concurrency", type=click.IntRange(min=1), default=4)
+@click.option(
+    "--propagate-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    help="Seconds to wait on each node while propagating config",
+)
+@click.argument("stack_name", type=str)
+@click.pass_context
+def watch(
+    ctx,
+    infile: TextIO,
+    compose_file: TextIO,
+    debounce: float,
+    node_concurrency: int,
+    propagate_concurrency: int,
+    propagate_timeout: Optional[float],
+    stack_name: str,
+):
+    """
+    Keep the swarm matching the config file.
+
+    Applies what changed whenever the config file is saved, or the swarm's nodes
+    change, and puts back the stack's services if they're removed.
+    """
+    import queue
+    import threading
+    import time
+
+    from .clients import get_client
+    from .watch import Reconciler, watch_config_file, watch_docker_events
+
+    config_path = infile.name
+    infile.close()
+
+    def resolve():
+        # the file changed, so whatever's in the meta is stale
+        ctx.meta.get(_resolved_meta_key, {}).pop((config_path, stack_name), None)
+        ctx.meta.get(_injested_meta_key, {}).pop(config_path, None)
+        with open(config_path, "rb") as config_file:
+            # a new one each time, so it's truncated each time
+            compose = click.utils.LazyFile(compose_file.name, "w")
+            try:
+                return ctx.invoke(
+                    generate_compose,
+                    stack_names=(stack_name,),
+                    infile=config_file,
+                    compose_file=compose,
+                )[stack_name]
+            finally:
+                compose.close_intelligently()
+
+    def update_swarm():
+        with open(config_path, "rb") as config_file:
+            ctx.invoke(swarm_update, stack_name=stack_name, infile=config_file)
+
+    def fallback_deploy():
+        # NOTE: not run_cmd, exiting would stop watching
+        run_cmd_echoed(
+            ["docker-sdp", "stack", "deploy", stack_name]
+            + ["--compose-file", compose_file.name],
+            click.echo,
+        )
+
+    d_client = get_client(max_pool_size=max(node_concurrency, propagate_concurrency))
+    reconciler = Reconciler(
+        d_client,
+        stack_name,
+        os.path.dirname(os.path.abspath(compose_file.name)),
+        resolve,
+        update_swarm,
+        fallback_deploy,
+        node_concurrency,
+        propagate_concurrency,
+        propagate_timeout,
+    )
+    pending: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    for target, args in (
+        (watch_config_file, (config_path, pending.put, stop)),
+        (watch_docker_events, (d_client, pending.put, stop)),
+    ):
+        threading.Thread(target=target, args=args, daemon=True).start()
+
+    click.echo(f"Watching {config_path} and the swarm, ^C to stop")
+    try:
+        reconciler.reconcile_all()
+        while True:
+            events = [pending.get()]
+            deadline = time.monotonic() + debounce
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    events.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            reconciler.handle(events)
+    except KeyboardInterrupt:
+        click.echo("Stopped watching")
+    finally:
+        stop.set()
 
 
 # TODO: make these into commands
@@ -294,10 +882,11 @@ def swarm_init(
     force_new_cluster: bool,  # , node: str
 ):
     """wrapper for docker swarm init"""
-    config = injest_config(infile)
-    config, _, swarm_settings, _, _ = satisfy_config(config, stack_name)
+    from .clients import get_client
 
-    d_client = docker.from_env()
+    config, _, swarm_settings, _, _ = resolve_config(infile, stack_name)
+
+    d_client = get_client()
 
     kwargs = {}
 
@@ -323,10 +912,12 @@ main.add_command(swarm_init)
 @click.option("--token", type=str)
 def swarm_join(stack_name: str, infile: TextIO, node: str, token):
     """wrapper for docker swarm join"""
-    config = injest_config(infile)
-    config, nodes, _, _, _ = satisfy_config(config, stack_name)
+    from .clients import get_client
+    from .schemas import ConfigNode
+
+    config, nodes, _, _, _ = resolve_config(infile, stack_name)
 
-    d_client = docker.from_env()
+    d_client = get_client()
 
     the_node = nodes[node]
 
@@ -363,7 +954,9 @@ def swarm_join(stack_name: str, infile: TextIO, node: str, token):
 @click.option("--rotate-worker-token", is_flag=True)
 @click.option("--rotate-manager-token", is_flag=True)
 @click.option("--rotate-manager-unlock-key", is_flag=True)
+@click.pass_context
 def swarm_update(
+    ctx,
     stack_name: str,
     infile: TextIO,
     rotate_worker_token,
@@ -371,14 +964,16 @@ def swarm_update(
     rotate_manager_unlock_key,
 ):
     """wrapper for docker swarm update"""
-    config = injest_config(infile)
-    config, _, swarm_settings, _, _ = satisfy_config(config, stack_name)
+    from .clients import get_client
+    from .cluster import update_swarm
 
-    d_client = docker.from_env()
+    config, _, swarm_settings, _, _ = resolve_config(infile, stack_name)
 
-    assert d_client.swarm.attrs, (
-        "Not connected to a swarm! You need to either init or join!"
-    )
+    d_client = get_client()
+
+    # NOTE: its version is only good for one update
+    swarm_attrs = ctx.meta.pop(_live_swarm_meta_key, None) or d_client.swarm.attrs
+    assert swarm_attrs, "Not connected to a swarm! You need to either init or join!"
 
     kwargs = {}
 
@@ -388,7 +983,9 @@ def swarm_update(
         if key in swarm_settings_d:
             kwargs[key] = swarm_settings_d[key]
 
-    d_client.swarm.update(
+    update_swarm(
+        d_client,
+        swarm_attrs,
         rotate_worker_token=rotate_worker_token,
         rotate_manager_token=rotate_manager_token,
         rotate_manager_unlock_key=rotate_manager_unlock_key,
@@ -418,49 +1015,94 @@ def node():
 @click.argument("node", type=str)
 def node_update(stack_name: str, infile: TextIO, node):
     """wrapper for docker node update"""
-    config = injest_config(infile)
-    config, nodes, _, _, _ = satisfy_config(config, stack_name)
-
-    rm = node not in nodes
-    rm_force = False
+    from .clients import get_client
+    from .cluster import update_node
+    from .inventory import NodeInventory
 
-    d_client = docker.from_env()
-    try:
-        d_node = d_client.nodes.get(node)
-    except docker.errors.APIError as e:
-        if e.status_code == 404:
-            if rm:
-                click.echo(f"node {node} was already removed")
-                return
-            else:
-                click.echo(f"node {node} needs to join the swarm")
-                # TODO: do this automatically
-                raise NotImplementedError(f"can't yet auto-join node {node}") from e
-        else:
-            raise e
+    config, nodes, _, _, _ = resolve_config(infile, stack_name)
 
-    if not rm:
-        node_settings: ConfigNode = nodes[node]
+    update_node(NodeInventory(get_client()), nodes, node, click.echo)
 
-        spec = node_settings.Spec
 
-        if isinstance(spec, ConfigNodeRMSpec):
-            rm = True
-            rm_force = spec.Role == "rm-force"
-
-            node_settings.Spec = ConfigNodeSpec(Role="worker", Availability="drain")
+@node.command("maintain")
+@click.argument("stack_name", type=str)
+@_infile_option
+@click.option(
+    "--wave-size",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Most nodes drained at once, managers are also limited by raft quorum",
+)
+@click.option(
+    "--command",
+    "maintain_command",
+    help="Run for each drained node, {node} is replaced with its hostname,"
+    ' like "ssh {node} sudo apt-get upgrade -y"',
+)
+@click.option(
+    "--timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=300,
+    help="Seconds to wait for tasks to be rescheduled, and for nodes to be ready",
+)
+@click.argument("node_names", nargs=-1, type=str)
+def node_maintain(
+    stack_name: str,
+    infile: TextIO,
+    wave_size: int,
+    maintain_command: Optional[str],
+    timeout: float,
+    node_names: Tuple[str, ...],
+):
+    """
+    Drain, maintain and update nodes, a wave at a time.
 
-        if not rm_force:
-            # TODO: may need to actually promote or demote
-            assert d_node.update(node_settings.Spec.model_dump()), (
-                "failed to update node"
-            )
-            d_node.reload()
-    if rm:
-        assert d_node.remove(force=rm_force), "failed to remove node"
+    Each wave waits for its tasks to be running elsewhere before anything is
+    done to it. Without NODE_NAMES, every node in the config.
+    """
+    from .clients import get_client
+    from .inventory import NodeInventory
+    from .maintenance import maintain_nodes
+
+    config, nodes, _, _, _ = resolve_config(infile, stack_name)
+    unknown = [node_name for node_name in node_names if node_name not in nodes]
+    if unknown:
+        # update_node would remove them
+        raise click.ClickException(f"{', '.join(unknown)} aren't in the config")
+
+    maintain = None
+    if maintain_command:
+
+        def maintain(node_name: str):
+            # NOTE: not run_cmd, exiting would leave the wave drained
+            args = shlex.split(maintain_command.replace("{node}", node_name))
+            click.echo(f"\n$ {shlex.join(args)}\n")
+            try:
+                with tracing.span(shlex.join(args), "subprocess"):
+                    subprocess.run(args, check=True)
+            except subprocess.CalledProcessError as e:
+                raise click.ClickException(
+                    f"{shlex.join(args)} exited with {e.returncode}"
+                ) from e
+
+    maintain_nodes(
+        NodeInventory(get_client()),
+        nodes,
+        list(node_names or nodes.keys()),
+        wave_size,
+        maintain,
+        timeout,
+        click.echo,
+    )
 
 
 def handle_ecxeption(exc_type, exc_value, exc_traceback):
+    if "docker" not in sys.modules:
+        # docker can't have raised it if it was never imported
+        sys.__excepthook__(exc_type, exc_value, exc_traceback)
+        return
+    import docker.errors
+
     try:
         raise exc_value
     except docker.errors.APIError as e:
@@ -490,6 +1132,3 @@ def handle_ecxeption(exc_type, exc_value, exc_traceback):
         # TODO: put this to stderr
         click.echo("DockerException")
         click.echo(e)
-
-
-sys.excepthook = handle_ecxeption
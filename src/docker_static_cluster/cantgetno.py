@@ -3,16 +3,39 @@
 #
 # SPDX-License-Identifier: MIT
 
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.context
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import click
 import jq
 
+from . import tracing
+from .jqdeps import Path, program_deps
 from .schemas import (
     Config,
     ConfigJQPool,
     ConfigJQPools,
+    ConfigNetwork,
     ConfigNodes,
+    ConfigService,
     ConfigStack,
     ConfigSwarm,
     ConfigPlugins,
+    ConfigVolume,
 )
 
 
@@ -28,12 +51,240 @@ _categories = (
     "services",
 )
 
+_category_models = {
+    "volumes": ConfigVolume,
+    "networks": ConfigNetwork,
+    "services": ConfigService,
+}
+
+
+# Binds the named arguments from the input rather than from jq.compile's args, so
+#  the compiled program doesn't depend on the config and can be reused.
+_jq_prelude = ". as {$pool, $config, $stack} | $config | (\n"
+_jq_postlude = "\n)"
+
+
+@lru_cache(maxsize=None)
+def compile_jq(program: str):
+    """
+    Compile a jq_pools program, once per process for each program text.
+
+    The compiled program expects `{"pool": ..., "config": ..., "stack": ...}`
+    as its input, and runs the given program on the config.
+    """
+    with tracing.span("compile", "jq"):
+        return jq.compile(_jq_prelude + program + _jq_postlude)
+
+
+def _fragments(results: Iterable, where: str) -> Iterator[Tuple[str, object]]:
+    """
+    The (name, entity) pairs in a pool's results, as jq makes them.
+
+    A pool can give one object with everything in it, or a stream of smaller
+    `{name: entity}` objects or `[name, entity]` pairs, so a pool making
+    thousands of entities doesn't have to build them all up in jq first.
+    """
+    for result in results:
+        if not result:
+            continue
+        if isinstance(result, dict):
+            yield from result.items()
+        elif (
+            isinstance(result, list) and len(result) == 2 and isinstance(result[0], str)
+        ):
+            yield result[0], result[1]
+        else:
+            raise TypeError(
+                f"jq pool {where} gave {type(result).__name__} {result!r:.80},"
+                " expected an object or a [name, entity] pair"
+            )
+
+
+def _get_path(d: dict, path: Path) -> list:
+    """[value] at path in d, or [] if there's nothing there"""
+    for key in path:
+        if not isinstance(d, dict) or key not in d:
+            return []
+        d = d[key]
+    return [d]
+
+
+def _read(d: dict, paths: Optional[FrozenSet[Path]]) -> list:
+    if paths is None:
+        return [d]
+    return [[path, _get_path(d, path)] for path in sorted(paths)]
+
+
+def _pool_output_key(
+    program: str, pool_name: str, config_d: dict, stack_d: dict
+) -> Optional[str]:
+    """
+    Identifies a pool's output by its program and everything it can read, or
+    None if the output can't be reused.
+    """
+    deps = program_deps(program)
+    if deps is None:
+        return None
+    key = hashlib.sha256(
+        json.dumps(
+            [
+                program,
+                pool_name,
+                _read(config_d, deps.config),
+                _read(stack_d, deps.stack),
+            ],
+            sort_keys=True,
+            default=str,
+        ).encode()
+    )
+    return key.hexdigest()
+
+
+def _run_pool(program: str, pool_name: str, config_json: str, stack_json: str):
+    return compile_jq(program).input_text(
+        f'{{"pool":{json.dumps(pool_name)},"config":{config_json},"stack":{stack_json}}}'
+    )
+
+
+# set in each worker process once, rather than sent with every pool
+_worker_config_json = ""
+
+
+def _worker_context() -> multiprocessing.context.BaseContext:
+    """
+    Workers don't fork from this process, since watch has threads running, and
+    forking a process with threads can deadlock.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
 
-def satisfy_jq_pools(config: Config, stack_name: str) -> ConfigStack:
+def _init_worker(config_json: str):
+    global _worker_config_json
+    _worker_config_json = config_json
+
+
+def _run_pool_in_worker(
+    program: str, pool_name: str, where: str
+) -> List[Tuple[str, object]]:
+    return list(
+        _fragments(_run_pool(program, pool_name, _worker_config_json, "null"), where)
+    )
+
+
+def pools_are_deterministic(stack: ConfigStack) -> bool:
+    """
+    If the stack's jq_pools give the same results every time they're given the
+    same config, so what they made can be cached by the config alone.
+
+    Pools jqdeps can't make sense of are taken to not be.
+    """
+    for pool in (stack.jq_pools or {}).values():
+        pool_d = pool.model_dump()
+        for category_name in _categories:
+            program = pool_d.get(category_name)
+            if program and program_deps(program) is None:
+                return False
+    return True
+
+
+def satisfy_jq_pools(
+    config: Config,
+    stack_name: str,
+    pool_outputs: Optional[Dict[str, object]] = None,
+    jq_workers: int = 1,
+) -> ConfigStack:
+    """
+    Run the stack's jq_pools, adding their results to the stack.
+
+    pool_outputs holds the outputs of earlier runs. A pool whose program and
+    inputs (see jqdeps) are unchanged reuses its output instead of running
+    again. Afterwards it holds only the outputs of this run.
+
+    With more than one jq_worker, programs that don't use $stack run in that
+    many processes. The results are still added in the order the pools are
+    declared, so they're the same either way.
+    """
     assert isinstance(stack_name, str), type(stack_name)
     stack = config.stacks[stack_name]
-    if stack.jq_pools:
-        pools: ConfigJQPools = stack.jq_pools
+    if not stack.jq_pools:
+        return stack
+    pools: ConfigJQPools = stack.jq_pools
+    # NOTE: $config is the config as it was before any pool ran, while $stack
+    #  includes the results of the pools before it.
+    # Both are given to jq as JSON text, encoded once rather than for every
+    #  pool. The stack is only encoded again after a pool changed it.
+    config_json = config.model_dump_json()
+    stack_json: Optional[str] = stack.model_dump_json()
+    stack_d = json.loads(stack_json)
+    config_d: Optional[dict] = None
+    used_outputs: Dict[str, object] = {}
+    # where each name in the stack came from, to report pools replacing them
+    origins: Dict[Tuple[str, str], str] = {}
+
+    def merge(
+        where: str,
+        category_name: str,
+        output_key: Optional[str],
+        fragments: Iterable[Tuple[str, object]],
+    ):
+        nonlocal stack_json
+        model = _category_models.get(category_name)
+        # NOTE: jq has its own copy of the input, so adding to stack_d while
+        #  the pool is still running doesn't change its $stack
+        output: Dict[str, object] = {}
+        for v_name, volume in fragments:
+            output[v_name] = volume
+            if stack_d.get(category_name) is None:
+                stack_d[category_name] = {}
+            category_d = stack_d[category_name]
+            origin = origins.get((category_name, v_name))
+            if origin is None and v_name in category_d:
+                origin = "the stack"
+            if origin is not None and origin != where:
+                click.echo(
+                    f"jq pool {where} replaced {category_name} {v_name} from {origin}",
+                    err=True,
+                )
+            origins[(category_name, v_name)] = where
+            if model:
+                # only validate what's new, the whole stack is validated once
+                #  all the pools are done
+                volume = model.model_validate(volume).model_dump(mode="json")
+            category_d[v_name] = volume
+            stack_json = None
+        if output_key is not None:
+            used_outputs[output_key] = output
+
+    # run in workers, waiting to be merged
+    pending: List[
+        Tuple[str, str, Optional[str], Union[Future, List[Tuple[str, object]]]]
+    ] = []
+
+    def merge_pending():
+        for where, category_name, output_key, fragments in pending:
+            with tracing.span(where, "jq", worker=True):
+                if isinstance(fragments, Future):
+                    fragments = fragments.result()
+                merge(where, category_name, output_key, fragments)
+        pending.clear()
+
+    executor: Optional[ProcessPoolExecutor] = None
+
+    def get_executor() -> ProcessPoolExecutor:
+        # only once a program has to run in one
+        nonlocal executor
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=jq_workers,
+                mp_context=_worker_context(),
+                initializer=_init_worker,
+                initargs=(config_json,),
+            )
+        return executor
+
+    try:
         for pool_name, pool in pools.items():
             if not isinstance(pool, ConfigJQPool):
                 raise TypeError("pool wasn't right")
@@ -41,32 +292,75 @@ def satisfy_jq_pools(config: Config, stack_name: str) -> ConfigStack:
             for category_name in _categories:
                 if category_name not in pool_d or not pool_d[category_name]:
                     continue
-                stack_d = stack.model_dump()
-                if category_name not in stack_d:
-                    stack_d[category_name] = {}
-                config_d = config.model_dump()
-                program = jq.compile(
-                    pool_d[category_name],
-                    args={
-                        "pool": pool_name,
-                        "config": config_d,
-                        "stack": stack_d,
-                    },
-                )
-                results = program.input_value(config_d)
-                result = results.first()
-                for v_name, volume in result.items():
-                    stack_d[category_name][v_name] = volume
-                    stack = ConfigStack.model_validate(stack_d)
-    return stack
+                program = pool_d[category_name]
+                where = f"{pool_name}.{category_name}"
+                # it can't be read otherwise, see jqdeps
+                reads_stack = "$stack" in program
+                if reads_stack:
+                    # it has to see what the pools before it made
+                    merge_pending()
+                output_key = None
+                if pool_outputs is not None:
+                    if config_d is None:
+                        config_d = json.loads(config_json)
+                    output_key = _pool_output_key(program, pool_name, config_d, stack_d)
+                cached = output_key is not None and output_key in pool_outputs
+                if jq_workers > 1 and not reads_stack:
+                    pending.append(
+                        (
+                            where,
+                            category_name,
+                            output_key,
+                            list(_fragments([pool_outputs[output_key]], where))
+                            if cached
+                            else get_executor().submit(
+                                _run_pool_in_worker, program, pool_name, where
+                            ),
+                        )
+                    )
+                    continue
+                with tracing.span(where, "jq", cached=cached):
+                    if cached:
+                        fragments = _fragments([pool_outputs[output_key]], where)
+                    else:
+                        if not reads_stack:
+                            # so jq doesn't need to parse it
+                            pool_stack_json = "null"
+                        else:
+                            if stack_json is None:
+                                stack_json = json.dumps(stack_d)
+                            pool_stack_json = stack_json
+                        fragments = _fragments(
+                            _run_pool(program, pool_name, config_json, pool_stack_json),
+                            where,
+                        )
+                    merge(where, category_name, output_key, fragments)
+        merge_pending()
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    if pool_outputs is not None:
+        pool_outputs.clear()
+        pool_outputs.update(used_outputs)
+    return ConfigStack.model_validate(stack_d)
 
 
 def satisfy_config(
-    config: Config, stack_name: str
+    config: Config,
+    stack_name: str,
+    pool_outputs: Optional[Dict[str, object]] = None,
+    jq_workers: int = 1,
 ) -> tuple[Config, ConfigNodes, ConfigSwarm, ConfigPlugins, ConfigStack]:
-    stack = satisfy_jq_pools(config, stack_name)
+    stack = satisfy_jq_pools(config, stack_name, pool_outputs, jq_workers)
     config.stacks[stack_name] = stack
+    return split_config(config, stack_name)
+
 
+def split_config(
+    config: Config, stack_name: str
+) -> tuple[Config, ConfigNodes, ConfigSwarm, ConfigPlugins, ConfigStack]:
+    """Split an already satisfied config into its parts"""
+    stack = config.stacks[stack_name]
     nodes = config.nodes or ConfigNodes({})
     swarm = config.swarm
     plugins = config.plugins or ConfigPlugins({})
@@ -0,0 +1,121 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Docker clients shared by the whole process.
+
+Clients are keyed by their connection settings, so every phase of a deploy
+(and every command it invokes) talks to a daemon over the same connection pool.
+For ssh:// that means one SSH connection per node for the whole run, rather
+than a handshake per command and per node.
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import docker
+import docker.constants
+
+from .schemas import ConfigNode
+
+# so idle SSH connections aren't dropped during long phases, like force update
+_ssh_keepalive_seconds = 30
+
+_env_keys = ("DOCKER_HOST", "DOCKER_TLS_VERIFY", "DOCKER_CERT_PATH")
+
+_clients: Dict[Tuple, Tuple[docker.DockerClient, int]] = {}
+# clients replaced by one with a bigger pool, another thread may still use them
+_retired: List[docker.DockerClient] = []
+_key_locks: Dict[Tuple, threading.Lock] = {}
+_lock = threading.Lock()
+
+
+def _keep_ssh_alive(d_client: docker.DockerClient):
+    try:
+        from docker.transport import SSHHTTPAdapter
+    except ImportError:
+        # no paramiko, so no ssh:// either
+        return
+    adapter = d_client.api.get_adapter(d_client.api.base_url)
+    if not isinstance(adapter, SSHHTTPAdapter):
+        return
+    if adapter.ssh_client:
+        transport = adapter.ssh_client.get_transport()
+        if transport:
+            transport.set_keepalive(_ssh_keepalive_seconds)
+        return
+
+    # NOTE: with use_ssh_client, docker makes a new connection pool (and so a
+    #  new ssh process) for every request. Keep them like it does for paramiko.
+    get_connection = adapter.get_connection
+
+    def get_pooled_connection(url, proxies=None):
+        with adapter.pools.lock:
+            pool = adapter.pools.get(url)
+            if pool is None:
+                pool = adapter.pools[url] = get_connection(url, proxies)
+        return pool
+
+    adapter.get_connection = get_pooled_connection
+
+
+def get_client(
+    conf: Optional[Dict[str, object]] = None, max_pool_size: Optional[int] = None
+) -> docker.DockerClient:
+    """
+    The shared client for conf, the keyword arguments of docker.DockerClient.
+
+    Without conf, it's the client docker.from_env() would make. max_pool_size is
+    a minimum, if the existing client has a smaller pool it's replaced.
+    """
+    conf = {key: value for key, value in (conf or {}).items() if value is not None}
+    pool_size = max(
+        int(conf.pop("max_pool_size", None) or docker.constants.DEFAULT_MAX_POOL_SIZE),
+        max_pool_size or 0,
+    )
+    if conf:
+        key = tuple(sorted((key, repr(value)) for key, value in conf.items()))
+    else:
+        key = ("env",) + tuple(os.environ.get(env_key) for env_key in _env_keys)
+
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    # only one client per key is made, but different keys connect concurrently
+    with key_lock:
+        existing = _clients.get(key)
+        if existing and existing[1] >= pool_size:
+            return existing[0]
+        if conf:
+            d_client = docker.DockerClient(max_pool_size=pool_size, **conf)
+        else:
+            d_client = docker.from_env(max_pool_size=pool_size)
+        _keep_ssh_alive(d_client)
+        with _lock:
+            if existing:
+                _retired.append(existing[0])
+            _clients[key] = (d_client, pool_size)
+        return d_client
+
+
+def node_client(
+    node_name: str, node_settings: Optional[ConfigNode]
+) -> docker.DockerClient:
+    """The shared client for a node's remote_docker_conf"""
+    assert node_settings, f"remote node {node_name} could not be found"
+    assert node_settings.remote_docker_conf, (
+        f"remote node {node_name} does not have a remote remote_docker_conf"
+    )
+    return get_client(node_settings.remote_docker_conf.model_dump())
+
+
+def close_all():
+    with _lock:
+        d_clients = [d_client for d_client, _ in _clients.values()] + _retired
+        _clients.clear()
+        _retired.clear()
+        _key_locks.clear()
+    for d_client in d_clients:
+        d_client.close()
@@ -0,0 +1,274 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import threading
+import time
+import traceback
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+import click
+import docker
+import docker.errors
+from docker.models.nodes import Node
+
+from . import debug
+from .clients import node_client
+from .inventory import NodeInventory
+from .plan import Change, apply_plugin_changes, fetch_plugins, plan_plugins
+from .schemas import (
+    ConfigNode,
+    ConfigNodeRMSpec,
+    ConfigNodeSpec,
+    ConfigNodes,
+    ConfigPlugins,
+)
+from .state_cache import is_out_of_sequence
+
+T = TypeVar("T")
+
+
+def plugins_update(
+    d_client: docker.DockerClient, plugins_settings: ConfigPlugins, diff=False
+) -> List[Change]:
+    """
+    Install, configure and remove plugins.
+
+    Unless diff, every installed plugin gets configured, changed or not.
+    """
+    live_plugins = fetch_plugins(d_client)
+    changes = plan_plugins(live_plugins, plugins_settings, force=not diff)
+    apply_plugin_changes(d_client, live_plugins, plugins_settings, changes)
+    return changes
+
+
+def _call_with_timeout(fn: Callable[[], T], timeout: Optional[float]) -> T:
+    """
+    Call fn, giving up after timeout seconds.
+
+    fn runs on a daemon thread, so if it hangs it's abandoned rather than keeping
+    the process alive.
+    """
+    future: Future = Future()
+
+    def run():
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future.result(timeout=timeout)
+
+
+def propagate_plugins(
+    nodes_settings: ConfigNodes,
+    plugins_settings: ConfigPlugins,
+    concurrency: int,
+    timeout: Optional[float],
+    diff=False,
+):
+    """Install and configure the plugins on every node, several nodes at a time"""
+
+    def propagate_one(node_name: str) -> Tuple[float, str, bool]:
+        start = time.monotonic()
+        try:
+            changes = _call_with_timeout(
+                lambda: plugins_update(
+                    node_client(node_name, nodes_settings[node_name]),
+                    plugins_settings,
+                    diff,
+                ),
+                timeout,
+            )
+        except FutureTimeoutError:
+            return time.monotonic() - start, f"timed out after {timeout}s", False
+        except Exception as e:
+            if debug:
+                click.echo(traceback.format_exc())
+            return time.monotonic() - start, f"{type(e).__name__}: {e}", False
+        return time.monotonic() - start, f"ok, {len(changes)} change(s)", True
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(propagate_one, nodes_settings.keys()))
+
+    failed = echo_node_results(list(nodes_settings.keys()), results)
+    if failed:
+        raise click.ClickException(f"{failed} node(s) failed to propagate config")
+
+
+def echo_node_results(
+    node_names: List[str], results: List[Tuple[float, str, bool]]
+) -> int:
+    """Echo a table of how long each node took and how it went, return failures"""
+    width = max([len("node")] + [len(node_name) for node_name in node_names])
+    click.echo()
+    click.echo(f"{'node':<{width}}  {'duration':>9}  result")
+    for node_name, (duration, result, _) in zip(node_names, results):
+        click.echo(f"{node_name:<{width}}  {duration:8.2f}s  {result}")
+    return sum(1 for _, _, ok in results if not ok)
+
+
+def update_swarm(
+    d_client: docker.DockerClient,
+    swarm_attrs: Optional[dict] = None,
+    rotate_worker_token=False,
+    rotate_manager_token=False,
+    rotate_manager_unlock_key=False,
+    **kwargs,
+):
+    """
+    Like `d_client.swarm.update`, but against the version in swarm_attrs if it's
+    given, rather than inspecting the swarm again. If that version is out of
+    date the swarm is inspected and it's tried once more.
+    """
+    # NOTE: same as docker does, it seems to have to be set
+    if kwargs.get("node_cert_expiry") is None:
+        kwargs["node_cert_expiry"] = 7776000000000000
+    swarm_spec = d_client.api.create_swarm_spec(**kwargs)
+
+    def update(version: int):
+        d_client.api.update_swarm(
+            version=version,
+            swarm_spec=swarm_spec,
+            rotate_worker_token=rotate_worker_token,
+            rotate_manager_token=rotate_manager_token,
+            rotate_manager_unlock_key=rotate_manager_unlock_key,
+        )
+
+    if swarm_attrs:
+        try:
+            update(swarm_attrs["Version"]["Index"])
+            return
+        except docker.errors.APIError as e:
+            if not is_out_of_sequence(e):
+                raise
+    update(d_client.swarm.version)
+
+
+def _update_node_spec(d_node: Node, spec: dict) -> bool:
+    """
+    Update the node against the version it was inspected at. If that's out of
+    date, like from the state cache, it's inspected again and tried once more.
+    """
+    try:
+        return d_node.update(spec)
+    except docker.errors.APIError as e:
+        if not is_out_of_sequence(e):
+            raise
+    d_node.reload()
+    return d_node.update(spec)
+
+
+def update_node(
+    inventory: NodeInventory,
+    nodes: ConfigNodes,
+    node: str,
+    echo: Callable[[str], None],
+):
+    rm = node not in nodes
+    rm_force = False
+
+    d_node = inventory.get(node)
+    if not d_node:
+        if rm:
+            echo(f"node {node} was already removed")
+            return
+        else:
+            echo(f"node {node} needs to join the swarm")
+            # TODO: do this automatically
+            raise NotImplementedError(f"can't yet auto-join node {node}")
+
+    if not rm:
+        node_settings: ConfigNode = nodes[node]
+
+        spec = node_settings.Spec
+
+        if isinstance(spec, ConfigNodeRMSpec):
+            rm = True
+            rm_force = spec.Role == "rm-force"
+
+            # NOTE: don't write this back to node_settings, the resolved config
+            #  is shared with the rest of this process
+            spec = ConfigNodeSpec(Role="worker", Availability="drain")
+
+        if not rm_force:
+            # TODO: may need to actually promote or demote
+            assert _update_node_spec(d_node, spec.model_dump()), "failed to update node"
+    if rm:
+        assert d_node.remove(force=rm_force), "failed to remove node"
+
+
+def node_waves(
+    inventory: NodeInventory, nodes: ConfigNodes
+) -> List[Tuple[List[str], bool]]:
+    """
+    Split the nodes into waves that are safe for raft quorum.
+
+    Nodes that should be managers go first, one at a time, so quorum only grows.
+    Then workers all at once. Last are current managers that are being demoted
+    or removed, again one at a time.
+
+    Returns a list of (node names, may run concurrently).
+    """
+    live_managers = inventory.managers()
+
+    promote, workers, demote = [], [], []
+    for node_name, node_settings in nodes.items():
+        spec = node_settings.Spec
+        if isinstance(spec, ConfigNodeSpec) and spec.Role == "manager":
+            promote.append(node_name)
+        elif node_name in live_managers:
+            demote.append(node_name)
+        else:
+            workers.append(node_name)
+    return [(promote, False), (workers, True), (demote, False)]
+
+
+def update_nodes(inventory: NodeInventory, nodes: ConfigNodes, concurrency: int):
+    """
+    Run node update on every node in the config.
+
+    Output is printed in config order within each wave, no matter what order the
+    nodes finish in.
+    Errors are reported together at the end of each wave, and stop any later
+    waves.
+    """
+
+    def update_one(node: str) -> Tuple[List[str], bool]:
+        lines: List[str] = []
+        try:
+            update_node(inventory, nodes, node, lines.append)
+        except Exception as e:
+            if debug:
+                lines.append(traceback.format_exc())
+            lines.append(f"node {node} failed: {type(e).__name__}: {e}")
+            return lines, False
+        return lines, True
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for wave, concurrent in node_waves(inventory, nodes):
+            if concurrent:
+                results = list(executor.map(update_one, wave))
+            else:
+                results = []
+                for node in wave:
+                    results.append(update_one(node))
+                    if not results[-1][1]:
+                        # don't risk quorum on the managers after it
+                        break
+            failed = 0
+            for lines, ok in results:
+                for line in lines:
+                    click.echo(line)
+                if not ok:
+                    failed += 1
+            if failed:
+                inventory.refresh()
+                raise click.ClickException(f"{failed} node(s) failed to update")
+    if nodes:
+        # only the nodes that were actually changed get replaced
+        inventory.refresh()
@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+On-disk cache of resolved configs, keyed by the config file's content.
+
+Entries are JSON files in `$XDG_CACHE_HOME/docker_static_cluster`, holding the
+satisfied config and the compose file generated from it.
+
+When the config did change, the outputs of its jq_pools are kept too (keyed by
+the config file's path instead), so only the pools that read what changed are
+run again.
+"""
+
+import hashlib
+from importlib.metadata import PackageNotFoundError, version
+import json
+import os
+from typing import Dict, Optional, TypedDict
+
+
+# NOTE: bump when what's cached, or how it's made, changes. The version is the
+#  same all through development, so it can't be relied on alone.
+_cache_format = 2
+
+
+class CacheEntry(TypedDict):
+    # Config.model_dump_json() of the satisfied config
+    config: str
+    compose: str
+
+
+def _tool_version() -> str:
+    try:
+        return version("docker-static-cluster")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def cache_dir() -> str:
+    return os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "docker_static_cluster",
+    )
+
+
+def cache_key(config_data: bytes, stack_name: str) -> str:
+    key = hashlib.sha256()
+    for part in (
+        config_data,
+        stack_name.encode(),
+        _tool_version().encode(),
+        str(_cache_format).encode(),
+    ):
+        # length prefixed, so the parts can't run into each other
+        key.update(len(part).to_bytes(8, "big"))
+        key.update(part)
+    return key.hexdigest()
+
+
+def pool_outputs_key(config_name: str, stack_name: str) -> str:
+    return "pools-" + cache_key(os.path.abspath(config_name).encode(), stack_name)
+
+
+def load_json(key: str):
+    """What store_json cached under key, None if there isn't anything"""
+    try:
+        with open(os.path.join(cache_dir(), f"{key}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store_json(key: str, data):
+    """
+    Cache data as JSON under key, for load_json.
+
+    Only the user can read it, entries can have the swarm's CA key and plugin
+    settings in them.
+    """
+    directory = cache_dir()
+    path = os.path.join(directory, f"{key}.json")
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # it may have been made before it was private
+        os.chmod(directory, 0o700)
+        fd = os.open(
+            f"{path}.{os.getpid()}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        # atomic, so a concurrent run never sees half an entry
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+    except OSError:
+        # the cache is only an optimization
+        pass
+
+
+def load(key: str) -> Optional[CacheEntry]:
+    return load_json(key)
+
+
+def store(key: str, entry: CacheEntry):
+    store_json(key, entry)
+
+
+def load_pool_outputs(key: str) -> Dict[str, object]:
+    """See cantgetno.satisfy_jq_pools"""
+    outputs = load_json(key)
+    return outputs if isinstance(outputs, dict) else {}
+
+
+def store_pool_outputs(key: str, outputs: Dict[str, object]):
+    store_json(key, outputs)
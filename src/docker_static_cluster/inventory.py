@@ -0,0 +1,113 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+from typing import Dict, Iterator, List, Optional, Set
+
+import click
+import docker
+from docker.models.nodes import Node
+
+
+def _node_version(d_node: Node) -> Optional[int]:
+    return d_node.attrs.get("Version", {}).get("Index")
+
+
+class NodeInventory:
+    """
+    Every node in the swarm, from a single `nodes.list()`.
+
+    Nodes can be looked up by hostname or by ID. If nodes_attrs is given, like
+    from the state cache, they're used instead of listing the nodes.
+
+    A node that left and joined again leaves a down node with its hostname
+    behind, so hostnames can be shared.
+    """
+
+    def __init__(
+        self, d_client: docker.DockerClient, nodes_attrs: Optional[List[dict]] = None
+    ):
+        self.d_client = d_client
+        self._by_id: Dict[str, Node] = {}
+        # by ID, under each hostname
+        self._by_hostname: Dict[str, Dict[str, Node]] = {}
+        if nodes_attrs is None:
+            self.refresh()
+        else:
+            for attrs in nodes_attrs:
+                self._index(d_client.nodes.prepare_model(attrs))
+
+    def _index(self, d_node: Node):
+        self._by_id[d_node.id] = d_node
+        hostname = d_node.attrs["Description"]["Hostname"]
+        self._by_hostname.setdefault(hostname, {})[d_node.id] = d_node
+
+    def _unindex(self, d_node: Node):
+        self._by_id.pop(d_node.id, None)
+        hostname = d_node.attrs["Description"]["Hostname"]
+        same_hostname = self._by_hostname.get(hostname, {})
+        same_hostname.pop(d_node.id, None)
+        if not same_hostname:
+            self._by_hostname.pop(hostname, None)
+
+    def refresh(self) -> Set[str]:
+        """
+        List the nodes again.
+
+        Only nodes whose `Version.Index` changed are replaced. Returns the IDs
+        of the nodes that were replaced, added or removed.
+        """
+        changed = set()
+        seen = set()
+        for d_node in self.d_client.nodes.list():
+            seen.add(d_node.id)
+            old = self._by_id.get(d_node.id)
+            if old and _node_version(old) == _node_version(d_node):
+                continue
+            changed.add(d_node.id)
+            if old:
+                self._unindex(old)
+            self._index(d_node)
+        for node_id in self._by_id.keys() - seen:
+            changed.add(node_id)
+            self._unindex(self._by_id[node_id])
+        return changed
+
+    def get(self, node: str) -> Optional[Node]:
+        """
+        Look up a node by hostname, falling back to ID.
+
+        Of the nodes sharing a hostname, the one that isn't down is used. If
+        that doesn't settle it, it raises a ClickException rather than guess.
+        """
+        d_nodes = list(self._by_hostname.get(node, {}).values())
+        if not d_nodes:
+            return self._by_id.get(node)
+        if len(d_nodes) > 1:
+            d_nodes = [
+                d_node
+                for d_node in d_nodes
+                if d_node.attrs.get("Status", {}).get("State") != "down"
+            ]
+            if len(d_nodes) != 1:
+                raise click.ClickException(
+                    f"{len(self._by_hostname[node])} nodes are named {node}, give"
+                    " its ID or remove the others with `docker node rm`"
+                )
+        return d_nodes[0]
+
+    def __contains__(self, node: str) -> bool:
+        return self.get(node) is not None
+
+    def __iter__(self) -> Iterator[Node]:
+        return iter(list(self._by_id.values()))
+
+    def managers(self) -> Set[str]:
+        """Hostnames and IDs of every node that's currently a manager"""
+        managers = set()
+        for d_node in self:
+            if d_node.attrs.get("Spec", {}).get("Role") == "manager":
+                managers.add(d_node.id)
+                managers.add(d_node.attrs["Description"]["Hostname"])
+        return managers
@@ -0,0 +1,518 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Which parts of `$config` and `$stack` a jq_pools program can read.
+
+jq can't tell us what a program actually read, so this reads the program. It
+only has to be conservative, not complete: anything it doesn't follow (like
+`def`, or a builtin applied to the whole config) means the program depends on
+everything. jq has already checked the syntax by the time this runs.
+"""
+
+from functools import lru_cache
+import json
+import re
+from typing import FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+Path = Tuple[str, ...]
+
+# jq programs are run on $config, see cantgetno
+_root_var = "$config"
+
+_token = re.compile(
+    r"""
+    (?P<space>\s+|\#[^\n]*)
+    | (?P<field>\.[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<recurse>\.\.)
+    | (?P<dot>\.)
+    | (?P<var>\$(?:__loc__|[A-Za-z_][A-Za-z0-9_]*(?:::[A-Za-z_][A-Za-z0-9_]*)*))
+    | (?P<format>@[A-Za-z0-9_]+)
+    | (?P<ident>[A-Za-z_][A-Za-z0-9_]*(?:::[A-Za-z_][A-Za-z0-9_]*)*)
+    | (?P<num>(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?)
+    | (?P<op>\?//|//=|\|=|\+=|-=|\*=|/=|%=|==|!=|<=|>=|//|[|,+\-*/%=<>()\[\]{}:;?])
+    """,
+    re.VERBOSE,
+)
+
+# builtins whose result isn't only a function of the program and its input
+_nondeterministic = {
+    "now",
+    "env",
+    "$ENV",
+    "input",
+    "inputs",
+    "input_filename",
+    "input_line_number",
+    "$__prog_args",
+    "get_search_list",
+}
+# builtins that don't look at their input
+_no_input = {"true", "false", "null", "empty", "range", "infinite", "nan"}
+_assignments = {"=", "|=", "+=", "-=", "*=", "/=", "%=", "//="}
+_binary = {"//", "==", "!=", "<=", ">=", "<", ">", "+", "-", "*", "/", "%", ","}
+_binary_words = {"and", "or"}
+_untrackable_words = {"def", "label", "import", "include"}
+
+
+class PoolDeps(NamedTuple):
+    """Paths read from $config and $stack, or None for all of it"""
+
+    config: Optional[FrozenSet[Path]]
+    stack: Optional[FrozenSet[Path]]
+
+
+class _Untrackable(Exception):
+    pass
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+class _Token(NamedTuple):
+    kind: str
+    text: str
+    # for strings, the source of each \(...)
+    interpolations: Tuple[str, ...] = ()
+    # for strings without interpolations
+    value: Optional[str] = None
+
+
+def _string(program: str, start: int) -> Tuple[_Token, int]:
+    """The string starting at program[start], and where it ends"""
+    i = start + 1
+    interpolations = []
+    while i < len(program):
+        char = program[i]
+        if char == '"':
+            text = program[start : i + 1]
+            value = None
+            if not interpolations:
+                try:
+                    value = json.loads(text)
+                except ValueError:
+                    pass
+            return _Token("str", text, tuple(interpolations), value), i + 1
+        if char == "\\" and program[i + 1 : i + 2] == "(":
+            depth = 1
+            j = i + 2
+            while depth:
+                if j >= len(program):
+                    raise _Untrackable()
+                if program[j] == '"':
+                    _, j = _string(program, j)
+                    continue
+                depth += {"(": 1, ")": -1}.get(program[j], 0)
+                j += 1
+            interpolations.append(program[i + 2 : j - 1])
+            i = j
+            continue
+        i += 2 if char == "\\" else 1
+    raise _Untrackable()
+
+
+def _tokenize(program: str) -> List[_Token]:
+    tokens = []
+    i = 0
+    while i < len(program):
+        if program[i] == '"':
+            token, i = _string(program, i)
+            tokens.append(token)
+            continue
+        match = _token.match(program, i)
+        if not match:
+            raise _Untrackable()
+        i = match.end()
+        if match.lastgroup != "space":
+            tokens.append(_Token(match.lastgroup, match.group()))
+    return tokens
+
+
+class _Reader:
+    """
+    Walks the program, recording the paths of $config it reads.
+
+    root says whether the expression being read gets $config as its input.
+    Anything that reads all of its input while root is True records the empty
+    path, meaning everything.
+    """
+
+    def __init__(self, tokens: List[_Token]):
+        self.tokens = tokens
+        self.i = 0
+        self.paths: Set[Path] = set()
+
+    def peek(self, offset: int = 0) -> Optional[_Token]:
+        if self.i + offset < len(self.tokens):
+            return self.tokens[self.i + offset]
+        return None
+
+    def at(self, kind: str, *texts: str) -> bool:
+        token = self.peek()
+        return bool(token and token.kind == kind and (not texts or token.text in texts))
+
+    def next(self) -> _Token:
+        token = self.peek()
+        if token is None:
+            raise _Untrackable()
+        self.i += 1
+        return token
+
+    def expect(self, kind: str, text: str):
+        if not self.at(kind, text):
+            raise _Untrackable()
+        self.i += 1
+
+    def read_all(self, root: bool):
+        if root:
+            self.paths.add(())
+
+    def program(self):
+        self.pipe(True)
+        if self.peek() is not None:
+            raise _Untrackable()
+
+    def pipe(self, root: bool):
+        if self.at("ident", *_untrackable_words):
+            raise _Untrackable()
+        self.binary(root)
+        if self.at("ident", "as"):
+            self.next()
+            self.pattern()
+            self.expect("op", "|")
+            # the body gets the same input as the binding
+            self.pipe(root)
+        elif self.at("op", "|"):
+            self.next()
+            self.pipe(False)
+
+    def binary(self, root: bool):
+        self.postfix(root)
+        while self.at("op", *_binary, *_assignments) or self.at(
+            "ident", *_binary_words
+        ):
+            operator = self.next().text
+            if operator in _assignments:
+                # the result is the whole input, with the change
+                self.read_all(root)
+            self.postfix(False if operator == "|=" else root)
+
+    def pattern(self):
+        if self.at("var"):
+            self.next()
+            return
+        if not (self.at("op", "[") or self.at("op", "{")):
+            raise _Untrackable()
+        depth = 0
+        while True:
+            token = self.next()
+            if token.interpolations:
+                # a key like "\(.x)" is evaluated on the input, not what's bound
+                raise _Untrackable()
+            if token.kind == "op" and token.text in "[{":
+                depth += 1
+            elif token.kind == "op" and token.text in "]}":
+                depth -= 1
+            elif token.kind == "op" and token.text in ("(", "?//"):
+                raise _Untrackable()
+            if depth == 0:
+                break
+        if self.at("op", "?//"):
+            raise _Untrackable()
+
+    def postfix(self, root: bool):
+        path = self.term(root)
+        while True:
+            if self.at("field"):
+                token = self.next()
+                if path is not None:
+                    path = path + (token.text[1:],)
+            elif self.at("dot") and self.peek(1) and self.peek(1).kind == "str":
+                self.next()
+                path = self.string_index(root, path)
+            elif self.at("dot") and self.peek(1) and self.peek(1).text == "[":
+                self.next()
+            elif self.at("op", "["):
+                self.next()
+                if self.at("str") and self.peek(1) and self.peek(1).text == "]":
+                    path = self.string_index(root, path)
+                    self.next()
+                    continue
+                # anything else reads all of what's being indexed
+                if path is not None and root:
+                    self.paths.add(path)
+                path = None
+                if not self.at("op", "]"):
+                    # the index is evaluated on the original input
+                    self.pipe(root)
+                    if self.at("op", ":"):
+                        self.next()
+                        self.pipe(root)
+                self.expect("op", "]")
+            elif self.at("op", "?"):
+                self.next()
+            else:
+                break
+        if path is not None and root:
+            self.paths.add(path)
+
+    def string_index(self, root: bool, path: Optional[Path]) -> Optional[Path]:
+        token = self.next()
+        for interpolation in token.interpolations:
+            self.sub_program(interpolation, root)
+        if path is None:
+            return None
+        if token.value is None:
+            if root:
+                self.paths.add(path)
+            return None
+        return path + (token.value,)
+
+    def sub_program(self, program: str, root: bool):
+        reader = _Reader(_tokenize(program))
+        reader.pipe(root)
+        if reader.peek() is not None:
+            raise _Untrackable()
+        self.paths |= reader.paths
+
+    def term(self, root: bool) -> Optional[Path]:
+        """Returns the path read so far, if the term is a path into the input"""
+        token = self.next()
+        if token.kind == "field":
+            return (token.text[1:],)
+        if token.kind == "dot":
+            if self.at("str"):
+                return self.string_index(root, ())
+            if self.at("op", "["):
+                # .[...] is handled as a postfix
+                return ()
+            self.read_all(root)
+            return None
+        if token.kind == "recurse":
+            self.read_all(root)
+            return None
+        if token.kind == "var":
+            if token.text in _nondeterministic:
+                raise _Uncacheable()
+            return None
+        if token.kind == "num":
+            return None
+        if token.kind == "str":
+            for interpolation in token.interpolations:
+                self.sub_program(interpolation, root)
+            return None
+        if token.kind == "format":
+            if self.at("str"):
+                self.term(root)
+            else:
+                self.read_all(root)
+            return None
+        if token.kind == "op":
+            if token.text == "(":
+                self.pipe(root)
+                self.expect("op", ")")
+            elif token.text == "[":
+                if not self.at("op", "]"):
+                    self.pipe(root)
+                self.expect("op", "]")
+            elif token.text == "{":
+                self.object(root)
+            elif token.text == "-":
+                self.postfix(root)
+            else:
+                raise _Untrackable()
+            return None
+        if token.kind == "ident":
+            return self.word(token.text, root)
+        raise _Untrackable()
+
+    def word(self, word: str, root: bool) -> Optional[Path]:
+        if word in _untrackable_words:
+            raise _Untrackable()
+        if word in _nondeterministic:
+            raise _Uncacheable()
+        if word == "if":
+            self.pipe(root)
+            self.expect("ident", "then")
+            self.pipe(root)
+            while self.at("ident", "elif"):
+                self.next()
+                self.pipe(root)
+                self.expect("ident", "then")
+                self.pipe(root)
+            if self.at("ident", "else"):
+                self.next()
+                self.pipe(root)
+            self.expect("ident", "end")
+            return None
+        if word == "try":
+            self.postfix(root)
+            if self.at("ident", "catch"):
+                self.next()
+                self.postfix(False)
+            return None
+        if word in ("reduce", "foreach"):
+            self.postfix(root)
+            self.expect("ident", "as")
+            self.pattern()
+            self.expect("op", "(")
+            self.pipe(root)
+            self.expect("op", ";")
+            self.pipe(False)
+            if word == "foreach" and self.at("op", ";"):
+                self.next()
+                self.pipe(False)
+            self.expect("op", ")")
+            return None
+        if word in ("then", "elif", "else", "end", "as", "catch", "and", "or"):
+            raise _Untrackable()
+        if word not in _no_input:
+            self.read_all(root)
+        if self.at("op", "("):
+            self.next()
+            # arguments get the same input, or things taken from it
+            self.pipe(root)
+            while self.at("op", ";"):
+                self.next()
+                self.pipe(root)
+            self.expect("op", ")")
+        return None
+
+    def object(self, root: bool):
+        while not self.at("op", "}"):
+            token = self.next()
+            if token.kind == "var":
+                if token.text in _nondeterministic:
+                    raise _Uncacheable()
+            elif token.kind in ("ident", "str", "format") or (
+                token.kind == "op" and token.text == "("
+            ):
+                key: Optional[str] = None
+                if token.kind == "ident":
+                    key = token.text
+                elif token.kind == "str":
+                    for interpolation in token.interpolations:
+                        self.sub_program(interpolation, root)
+                    key = token.value
+                elif token.kind == "format":
+                    if self.at("str"):
+                        self.term(root)
+                else:
+                    self.pipe(root)
+                    self.expect("op", ")")
+                if self.at("op", ":"):
+                    self.next()
+                    self.object_value(root)
+                elif token.kind == "op" or token.kind == "format":
+                    raise _Untrackable()
+                elif root:
+                    # {name} is {name: .name}
+                    self.paths.add((key,) if key is not None else ())
+            else:
+                raise _Untrackable()
+            if not self.at("op", ","):
+                break
+            self.next()
+        self.expect("op", "}")
+
+    def object_value(self, root: bool):
+        if self.at("op", "-"):
+            self.next()
+        self.postfix(root)
+        while self.at("op", "|"):
+            self.next()
+            self.postfix(False)
+            root = False
+
+
+def _variable_paths(tokens: List[_Token], variable: str) -> Set[Path]:
+    """
+    Paths read through a variable, wherever it's used.
+
+    Variables are in scope everywhere, so this doesn't need to follow the
+    program at all.
+    """
+    paths: Set[Path] = set()
+    for i, token in enumerate(tokens):
+        if token.kind == "str":
+            for interpolation in token.interpolations:
+                paths |= _variable_paths(_tokenize(interpolation), variable)
+        if token.kind != "var" or token.text != variable:
+            continue
+        path: Path = ()
+        j = i + 1
+        while j < len(tokens):
+            if tokens[j].kind == "field":
+                path += (tokens[j].text[1:],)
+                j += 1
+            elif (
+                tokens[j].kind == "dot"
+                and j + 1 < len(tokens)
+                and tokens[j + 1].value is not None
+            ):
+                path += (tokens[j + 1].value,)
+                j += 2
+            elif (
+                tokens[j].text == "["
+                and j + 2 < len(tokens)
+                and tokens[j + 1].value is not None
+                and tokens[j + 2].text == "]"
+            ):
+                path += (tokens[j + 1].value,)
+                j += 3
+            else:
+                break
+        paths.add(path)
+    return paths
+
+
+def _is_nondeterministic(tokens: List[_Token]) -> bool:
+    """If any of the tokens is a nondeterministic builtin, even in a string"""
+    for token in tokens:
+        if token.text in _nondeterministic:
+            return True
+        for interpolation in token.interpolations:
+            if _is_nondeterministic(_tokenize(interpolation)):
+                return True
+    return False
+
+
+def _minimal(paths: Set[Path]) -> Optional[FrozenSet[Path]]:
+    """Drop paths under another path, None if everything is read"""
+    if () in paths:
+        return None
+    return frozenset(
+        path
+        for path in paths
+        if not any(path[:i] in paths for i in range(1, len(path)))
+    )
+
+
+@lru_cache(maxsize=None)
+def program_deps(program: str) -> Optional[PoolDeps]:
+    """
+    What the program reads, or None if its result can't be cached at all (like
+    if it uses `now` or `env`).
+    """
+    try:
+        tokens = _tokenize(program)
+        # NOTE: before reading it, giving up on reading it doesn't make it safe
+        #  to cache
+        if _is_nondeterministic(tokens):
+            return None
+        stack_paths = _variable_paths(tokens, "$stack")
+        config_paths = _variable_paths(tokens, _root_var)
+    except _Untrackable:
+        # it couldn't even be checked for `now`
+        return None
+    reader = _Reader(tokens)
+    try:
+        reader.program()
+    except _Untrackable:
+        return PoolDeps(None, _minimal(stack_paths))
+    except _Uncacheable:
+        return None
+    return PoolDeps(_minimal(config_paths | reader.paths), _minimal(stack_paths))
@@ -0,0 +1,258 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Rolling node maintenance, a wave of nodes at a time.
+
+Each wave is drained, and only once its tasks are running elsewhere is the
+maintenance done and the nodes put back as the config says. A wave never has
+more managers in it than raft can lose and keep quorum.
+"""
+
+from collections import Counter
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+import click
+import docker
+import docker.errors
+
+from . import tracing
+from .cluster import node_waves, update_node
+from .inventory import NodeInventory
+from .schemas import ConfigNodes
+
+
+def manager_allowance(inventory: NodeInventory) -> int:
+    """How many more managers can go down before raft loses quorum"""
+    managers = [
+        d_node
+        for d_node in inventory
+        if d_node.attrs.get("Spec", {}).get("Role") == "manager"
+    ]
+    reachable = sum(
+        1
+        for d_node in managers
+        # NOTE: missing on a manager that just got promoted, which can't be
+        #  counted on yet
+        if (d_node.attrs.get("ManagerStatus") or {}).get("Reachability") == "reachable"
+    )
+    return reachable - (len(managers) // 2 + 1)
+
+
+def plan_wave(
+    inventory: NodeInventory, remaining: List[str], wave_size: int
+) -> List[str]:
+    """The next nodes to take down, in order, within the manager allowance"""
+    managers = inventory.managers()
+    allowance = manager_allowance(inventory)
+    wave: List[str] = []
+    for node_name in remaining:
+        if len(wave) == wave_size:
+            break
+        if node_name in managers:
+            if allowance <= 0:
+                continue
+            allowance -= 1
+        wave.append(node_name)
+    if not wave:
+        raise click.ClickException(
+            f"taking down {', '.join(remaining)} would lose raft quorum,"
+            " add or fix managers first"
+        )
+    return wave
+
+
+def _replicas(service: dict) -> Optional[int]:
+    """Replicas a service should have running, None if they can't move"""
+    mode = service.get("Spec", {}).get("Mode", {})
+    if "Replicated" in mode:
+        return mode["Replicated"].get("Replicas", 1)
+    return None
+
+
+def _running_tasks(d_client: docker.DockerClient) -> List[dict]:
+    return d_client.api.tasks(filters={"desired-state": "running"})
+
+
+def wait_for_reschedule(
+    d_client: docker.DockerClient,
+    node_ids: Set[str],
+    wanted: Dict[str, int],
+    timeout: float,
+    poll_interval: float,
+):
+    """
+    Wait until no task wants to run on the nodes, and every service in wanted
+    (IDs to replicas) has that many running again.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        tasks = _running_tasks(d_client)
+        left = [task for task in tasks if task.get("NodeID") in node_ids]
+        running = Counter(
+            task["ServiceID"]
+            for task in tasks
+            if task.get("Status", {}).get("State") == "running"
+        )
+        short = [
+            service_id
+            for service_id, replicas in wanted.items()
+            if running[service_id] < replicas
+        ]
+        if not left and not short:
+            return
+        if time.monotonic() >= deadline:
+            raise click.ClickException(
+                f"tasks weren't rescheduled within {timeout}s: {len(left)} left on"
+                f" the drained nodes, {len(short)} service(s) short of replicas"
+            )
+        time.sleep(poll_interval)
+
+
+def wait_for_ready(
+    inventory: NodeInventory,
+    node_names: List[str],
+    timeout: float,
+    poll_interval: float,
+):
+    deadline = time.monotonic() + timeout
+    while True:
+        inventory.refresh()
+        not_ready = [
+            node_name
+            for node_name in node_names
+            if (inventory.get(node_name) is None)
+            or inventory.get(node_name).attrs.get("Status", {}).get("State") != "ready"
+        ]
+        if not not_ready:
+            return
+        if time.monotonic() >= deadline:
+            raise click.ClickException(
+                f"{', '.join(not_ready)} weren't ready within {timeout}s"
+            )
+        time.sleep(poll_interval)
+
+
+def _put_back(
+    inventory: NodeInventory,
+    previous_specs: Dict[str, dict],
+    echo: Callable[[str], None],
+):
+    """Put the nodes back to their specs from before the wave"""
+    if not previous_specs:
+        return
+    inventory.refresh()
+    failed = []
+    for node_name, spec in previous_specs.items():
+        d_node = inventory.get(node_name)
+        try:
+            if d_node:
+                d_node.update(spec)
+        except docker.errors.APIError as e:
+            # the others should still be put back
+            failed.append(node_name)
+            echo(f"couldn't put {node_name} back: {e}")
+    put_back = [node_name for node_name in previous_specs if node_name not in failed]
+    if put_back:
+        echo(f"put {', '.join(put_back)} back how they were")
+
+
+def maintain_nodes(
+    inventory: NodeInventory,
+    nodes: ConfigNodes,
+    node_names: List[str],
+    wave_size: int,
+    maintain: Optional[Callable[[str], None]],
+    timeout: float,
+    echo: Callable[[str], None],
+    poll_interval: float = 1,
+):
+    """
+    Drain, maintain and update the nodes, a wave at a time.
+
+    maintain is called with each node's hostname once it's drained, like to
+    upgrade it. Then the node is updated to match the config, which makes it
+    active again unless the config says otherwise.
+
+    If anything goes wrong with a wave, like its tasks not being rescheduled
+    in time or maintain failing, the nodes in it that weren't updated yet are
+    put back how they were, and nothing after it is touched.
+    """
+    d_client = inventory.d_client
+    # promotions first, so quorum only grows, and demotions last
+    remaining = [
+        node_name
+        for wave, _ in node_waves(inventory, nodes)
+        for node_name in wave
+        if node_name in node_names
+    ]
+    wave_number = 0
+    while remaining:
+        wave_number += 1
+        inventory.refresh()
+        wave = plan_wave(inventory, remaining, wave_size)
+        remaining = [node_name for node_name in remaining if node_name not in wave]
+        echo(f"wave {wave_number}: {', '.join(wave)}")
+        with tracing.span(f"wave {wave_number}", "maintenance", nodes=wave):
+            d_nodes = {node_name: inventory.get(node_name) for node_name in wave}
+            missing = [name for name, d_node in d_nodes.items() if d_node is None]
+            if missing:
+                raise click.ClickException(
+                    f"{', '.join(missing)} aren't in the swarm, try deploy first"
+                )
+            node_ids = {d_node.id for d_node in d_nodes.values()}
+            # only services that lose tasks need to be waited on
+            moving = {
+                task["ServiceID"]
+                for task in _running_tasks(d_client)
+                if task.get("NodeID") in node_ids
+            }
+            wanted = {}
+            for service in d_client.api.services():
+                replicas = _replicas(service)
+                if service["ID"] in moving and replicas is not None:
+                    wanted[service["ID"]] = replicas
+
+            previous_specs = {}
+            updated: Set[str] = set()
+            try:
+                with tracing.span("drain", "maintenance"):
+                    for node_name, d_node in d_nodes.items():
+                        previous_specs[node_name] = dict(d_node.attrs["Spec"])
+                        assert d_node.update(
+                            {**d_node.attrs["Spec"], "Availability": "drain"}
+                        ), f"failed to drain {node_name}"
+                with tracing.span("wait for tasks", "maintenance"):
+                    wait_for_reschedule(
+                        d_client, node_ids, wanted, timeout, poll_interval
+                    )
+                echo(f"drained {', '.join(wave)}, {len(wanted)} service(s) rescheduled")
+
+                if maintain:
+                    with tracing.span("maintain", "maintenance"):
+                        for node_name in wave:
+                            maintain(node_name)
+                    with tracing.span("wait for ready", "maintenance"):
+                        wait_for_ready(inventory, wave, timeout, poll_interval)
+
+                inventory.refresh()
+                with tracing.span("update", "maintenance"):
+                    for node_name in wave:
+                        update_node(inventory, nodes, node_name, echo)
+                        updated.add(node_name)
+            except Exception:
+                _put_back(
+                    inventory,
+                    {
+                        node_name: spec
+                        for node_name, spec in previous_specs.items()
+                        if node_name not in updated
+                    },
+                    echo,
+                )
+                raise
+            echo(f"updated {', '.join(wave)}")
+    inventory.refresh()
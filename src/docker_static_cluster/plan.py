@@ -0,0 +1,233 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+from typing import Dict, List, Literal, NamedTuple, Optional, Tuple
+
+import docker
+from docker.models.plugins import Plugin
+from docker.models.services import Service
+
+from . import state_cache
+from .inventory import NodeInventory
+from .schemas import (
+    ConfigNodeRMSpec,
+    ConfigNodes,
+    ConfigPlugins,
+    ConfigStack,
+    ConfigSwarm,
+)
+
+# where each of the swarm settings ends up in the swarm spec
+_swarm_spec_paths: Dict[str, Optional[Tuple[str, str]]] = {
+    "task_history_retention_limit": ("Orchestration", "TaskHistoryRetentionLimit"),
+    "snapshot_interval": ("Raft", "SnapshotInterval"),
+    "keep_old_snapshots": ("Raft", "KeepOldSnapshots"),
+    "log_entries_for_slow_followers": ("Raft", "LogEntriesForSlowFollowers"),
+    "heartbeat_tick": ("Raft", "HeartbeatTick"),
+    "dispatcher_heartbeat_period": ("Dispatcher", "HeartbeatPeriod"),
+    "signing_ca_cert": ("CAConfig", "SigningCACert"),
+    # the API never sends the key back, so it can't be compared
+    "signing_ca_key": None,
+}
+
+_change_symbols = {
+    "install": "+",
+    "create": "+",
+    "join": "!",
+    "update": "~",
+    "configure": "~",
+    "remove": "-",
+    "orphan": "?",
+}
+
+
+class Change(NamedTuple):
+    kind: Literal["swarm", "node", "plugin", "service"]
+    name: str
+    action: Literal[
+        "install", "create", "join", "update", "configure", "remove", "orphan"
+    ]
+    detail: str = ""
+
+    def __str__(self) -> str:
+        line = f"{_change_symbols[self.action]} {self.kind} {self.name}: {self.action}"
+        if self.detail:
+            line += f" ({self.detail})"
+        return line
+
+
+class LiveState(NamedTuple):
+    """What the swarm looks like right now, fetched with one call per kind"""
+
+    swarm: dict
+    nodes: NodeInventory
+    plugins: Dict[str, Plugin]
+    services: Dict[str, Service]
+
+
+def fetch_plugins(
+    d_client: docker.DockerClient, plugins_attrs: Optional[List[dict]] = None
+) -> Dict[str, Plugin]:
+    if plugins_attrs is None:
+        d_plugins = d_client.plugins.list()
+    else:
+        d_plugins = [d_client.plugins.prepare_model(attrs) for attrs in plugins_attrs]
+    plugins = {}
+    for d_plugin in d_plugins:
+        plugins[d_plugin.name] = d_plugin
+        # plugins installed without a tag get :latest
+        if d_plugin.name.endswith(":latest"):
+            plugins[d_plugin.name[: -len(":latest")]] = d_plugin
+    return plugins
+
+
+def fetch_live_state(d_client: docker.DockerClient, use_cache=False) -> LiveState:
+    """
+    Fetch the live state. With use_cache, only what changed since the last run
+    is fetched, see state_cache.
+    """
+    # NOTE: every `d_client.swarm` inspects it again
+    swarm_attrs = d_client.swarm.attrs
+    if use_cache and swarm_attrs.get("ID"):
+        synced = state_cache.sync(d_client, swarm_attrs["ID"])
+        d_services = [
+            d_client.services.prepare_model(attrs) for attrs in synced.services
+        ]
+        return LiveState(
+            swarm=swarm_attrs,
+            nodes=NodeInventory(d_client, synced.nodes),
+            plugins=fetch_plugins(d_client, synced.plugins),
+            services={d_service.name: d_service for d_service in d_services},
+        )
+    services = {d_service.name: d_service for d_service in d_client.services.list()}
+    return LiveState(
+        swarm=swarm_attrs,
+        nodes=NodeInventory(d_client),
+        plugins=fetch_plugins(d_client),
+        services=services,
+    )
+
+
+def _diff_detail(differences: Dict[str, Tuple[object, object]]) -> str:
+    return ", ".join(
+        f"{key} {old!r} -> {new!r}" for key, (old, new) in differences.items()
+    )
+
+
+def plan_swarm(live: LiveState, swarm_settings: ConfigSwarm) -> List[Change]:
+    live_spec = live.swarm.get("Spec", {})
+    differences = {}
+    for key, value in swarm_settings.model_dump().items():
+        path = _swarm_spec_paths.get(key)
+        if value is None or path is None:
+            continue
+        section, field = path
+        live_value = (live_spec.get(section) or {}).get(field)
+        if live_value != value:
+            differences[key] = (live_value, value)
+    if not differences:
+        return []
+    return [Change("swarm", "swarm", "update", _diff_detail(differences))]
+
+
+def plan_nodes(live: LiveState, nodes_settings: ConfigNodes) -> List[Change]:
+    changes = []
+    for node_name, node_settings in nodes_settings.items():
+        d_node = live.nodes.get(node_name)
+        spec = node_settings.Spec
+        if isinstance(spec, ConfigNodeRMSpec):
+            if d_node:
+                changes.append(Change("node", node_name, "remove", spec.Role))
+            continue
+        if not d_node:
+            changes.append(Change("node", node_name, "join"))
+            continue
+        live_spec = d_node.attrs.get("Spec", {})
+        differences = {
+            key: (live_spec.get(key), value)
+            for key, value in spec.model_dump(exclude_none=True).items()
+            if live_spec.get(key) != value
+        }
+        if differences:
+            changes.append(
+                Change("node", node_name, "update", _diff_detail(differences))
+            )
+    return changes
+
+
+def plan_plugins(
+    live_plugins: Dict[str, Plugin], plugins_settings: ConfigPlugins, force=False
+) -> List[Change]:
+    """
+    Plan the plugin changes.
+
+    If force, plugins that are already installed get configured even if their
+    settings look the same.
+    """
+    changes = []
+    for plugin_name, plugin_config in plugins_settings.items():
+        d_plugin = live_plugins.get(plugin_name)
+        if plugin_config.remove:
+            if d_plugin:
+                changes.append(Change("plugin", plugin_name, "remove"))
+            continue
+        if not d_plugin:
+            changes.append(Change("plugin", plugin_name, "install"))
+            changes.append(Change("plugin", plugin_name, "configure"))
+            continue
+        live_env = dict(
+            env.split("=", 1) if "=" in env else (env, None)
+            for env in (d_plugin.settings or {}).get("Env") or []
+        )
+        differences = {
+            key: (live_env.get(key), str(value))
+            for key, value in plugin_config.settings.items()
+            if live_env.get(key) != str(value)
+        }
+        if differences or force:
+            changes.append(
+                Change("plugin", plugin_name, "configure", _diff_detail(differences))
+            )
+    return changes
+
+
+def plan_services(live: LiveState, stack_name: str, stack: ConfigStack) -> List[Change]:
+    """
+    Plan the service changes.
+
+    This only knows about services being added or left behind, updates to
+    existing services are up to the stack deploy.
+    """
+    changes = []
+    wanted = {f"{stack_name}_{service_name}" for service_name in stack.services}
+    for service_name in sorted(wanted - live.services.keys()):
+        changes.append(Change("service", service_name, "create"))
+    for service_name, d_service in sorted(live.services.items()):
+        labels = d_service.attrs.get("Spec", {}).get("Labels") or {}
+        namespace = labels.get("com.docker.stack.namespace")
+        if namespace == stack_name and service_name not in wanted:
+            changes.append(Change("service", service_name, "orphan"))
+    return changes
+
+
+def apply_plugin_changes(
+    d_client: docker.DockerClient,
+    live_plugins: Dict[str, Plugin],
+    plugins_settings: ConfigPlugins,
+    changes: List[Change],
+):
+    for change in changes:
+        if change.kind != "plugin":
+            continue
+        plugin_config = plugins_settings[change.name]
+        if change.action == "remove":
+            live_plugins[change.name].remove(force=plugin_config.remove == "force")
+        elif change.action == "install":
+            live_plugins[change.name] = d_client.plugins.install(
+                remote_name=plugin_config.image,
+                local_name=change.name,
+            )
+        elif change.action == "configure":
+            live_plugins[change.name].configure(plugin_config.settings)
@@ -0,0 +1,218 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Pull the stacks' images on the nodes that will run them, before deploying.
+
+Otherwise each node pulls an image only once a task lands on it, which is most
+of how long a rollout takes. Which nodes need which images comes from the
+services' placement constraints, and nodes that already have an image at the
+registry's digest are left alone.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import re
+import time
+import traceback
+from typing import Dict, List, Optional, Set, Tuple
+
+import click
+import docker
+import docker.errors
+import docker.utils
+from docker.models.nodes import Node
+
+from . import debug, tracing
+from .clients import node_client
+from .cluster import echo_node_results
+from .inventory import NodeInventory
+from .schemas import ConfigNodes, ConfigStack
+
+_constraint = re.compile(r"^\s*([\w.-]+)\s*(==|!=)\s*(.*?)\s*$")
+
+
+def _node_value(d_node: Node, key: str) -> Tuple[bool, Optional[str]]:
+    """If the key is one swarm knows, and the node's value for it"""
+    description = d_node.attrs.get("Description") or {}
+    spec = d_node.attrs.get("Spec") or {}
+    platform = description.get("Platform") or {}
+    values = {
+        "node.id": d_node.id,
+        "node.hostname": description.get("Hostname"),
+        "node.role": spec.get("Role"),
+        "node.platform.os": platform.get("OS"),
+        "node.platform.arch": platform.get("Architecture"),
+    }
+    if key in values:
+        return True, values[key]
+    for prefix, labels in (
+        ("node.labels.", spec.get("Labels")),
+        ("engine.labels.", (description.get("Engine") or {}).get("Labels")),
+    ):
+        if key.startswith(prefix):
+            return True, (labels or {}).get(key[len(prefix) :])
+    return False, None
+
+
+def matches_constraints(d_node: Node, constraints: List[str]) -> bool:
+    """
+    If swarm could schedule a task with these constraints on the node.
+
+    Constraints it can't make sense of are taken to match, pulling an image
+    that isn't needed is better than not pulling one that is.
+    """
+    for constraint in constraints:
+        match = _constraint.match(constraint)
+        if not match:
+            continue
+        key, operator, wanted = match.groups()
+        known, value = _node_value(d_node, key)
+        if not known:
+            continue
+        # NOTE: swarm compares these case insensitively too
+        equal = value is not None and value.casefold() == wanted.casefold()
+        if equal != (operator == "=="):
+            return False
+    return True
+
+
+def images_by_node(
+    inventory: NodeInventory, stacks: Dict[str, ConfigStack]
+) -> Dict[str, Set[str]]:
+    """
+    The images each node may run tasks of, by hostname.
+
+    A replicated service could be scheduled on any node its constraints allow,
+    so every one of them gets its image.
+    """
+    d_nodes = [
+        d_node
+        for d_node in inventory
+        if d_node.attrs.get("Spec", {}).get("Availability") == "active"
+        and d_node.attrs.get("Status", {}).get("State") == "ready"
+    ]
+    images: Dict[str, Set[str]] = {}
+    for stack in stacks.values():
+        for service in stack.services.values():
+            service_d = service.model_dump()
+            image = service_d.get("image")
+            deploy_d = service_d.get("deploy") or {}
+            if not image or (
+                deploy_d.get("mode", "replicated") != "global"
+                and deploy_d.get("replicas", 1) == 0
+            ):
+                continue
+            constraints = (deploy_d.get("placement") or {}).get("constraints") or []
+            for d_node in d_nodes:
+                if matches_constraints(d_node, constraints):
+                    hostname = d_node.attrs["Description"]["Hostname"]
+                    images.setdefault(hostname, set()).add(image)
+    return images
+
+
+def registry_digest(d_client: docker.DockerClient, image: str) -> Optional[str]:
+    """The digest the registry has for image, None if it can't be asked"""
+    if "@" in image:
+        # pinned, so the registry doesn't matter
+        return image.rsplit("@", 1)[-1]
+    try:
+        return d_client.api.inspect_distribution(image)["Descriptor"]["digest"]
+    except docker.errors.APIError:
+        # like no credentials for it, the pull will still tell
+        return None
+
+
+def _local_digests(d_client: docker.DockerClient) -> Set[str]:
+    """The digests of every image the daemon has, from a single list"""
+    return {
+        repo_digest.rsplit("@", 1)[-1]
+        for image in d_client.api.images()
+        for repo_digest in image.get("RepoDigests") or []
+    }
+
+
+def _pull(d_client: docker.DockerClient, image: str):
+    repository, tag = docker.utils.parse_repository_tag(image)
+    # NOTE: a failed pull is still a 200, the error is in the stream
+    for line in d_client.api.pull(
+        repository, tag or "latest", stream=True, decode=True
+    ):
+        if "error" in line:
+            raise docker.errors.APIError(line["error"])
+
+
+def prepull_images(
+    inventory: NodeInventory,
+    nodes_settings: ConfigNodes,
+    stacks: Dict[str, ConfigStack],
+    concurrency: int,
+):
+    """
+    Pull the stacks' images on every node that may run them, several nodes at a
+    time, through their remote_docker_conf.
+
+    Each image's digest is looked up once, from the swarm's registry access,
+    and each node lists its images once to see which it already has.
+    Nodes that fail to pull are reported, but don't stop the deploy, they'll
+    pull when their tasks start like they would have anyway.
+    """
+    needed = images_by_node(inventory, stacks)
+    unreachable = sorted(
+        node_name
+        for node_name in needed
+        if not (
+            nodes_settings.get(node_name)
+            and nodes_settings[node_name].remote_docker_conf
+        )
+    )
+    if unreachable:
+        click.echo(
+            f"can't pre-pull on {', '.join(unreachable)}, they have no"
+            " remote_docker_conf"
+        )
+    node_names = sorted(needed.keys() - set(unreachable))
+    if not node_names:
+        return
+    all_images = sorted(set().union(*(needed[node_name] for node_name in node_names)))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        with tracing.span("registry digests", images=len(all_images)):
+            digests = dict(
+                zip(
+                    all_images,
+                    executor.map(
+                        lambda image: registry_digest(inventory.d_client, image),
+                        all_images,
+                    ),
+                )
+            )
+
+        def prepull_one(node_name: str) -> Tuple[float, str, bool]:
+            start = time.monotonic()
+            pulled = 0
+            try:
+                d_client = node_client(node_name, nodes_settings[node_name])
+                local_digests = _local_digests(d_client)
+                for image in sorted(needed[node_name]):
+                    # NOTE: without a digest it can't be told, so it's pulled
+                    if digests[image] in local_digests:
+                        continue
+                    with tracing.span("pull", node=node_name, image=image):
+                        _pull(d_client, image)
+                    pulled += 1
+            except Exception as e:
+                if debug:
+                    click.echo(traceback.format_exc())
+                return time.monotonic() - start, f"{type(e).__name__}: {e}", False
+            images = len(needed[node_name])
+            return time.monotonic() - start, f"ok, pulled {pulled} of {images}", True
+
+        results = list(executor.map(prepull_one, node_names))
+
+    failed = echo_node_results(node_names, results)
+    if failed:
+        click.echo(
+            f"{failed} node(s) failed to pre-pull, they'll pull as their tasks start"
+        )
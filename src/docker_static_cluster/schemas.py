@@ -7,6 +7,7 @@ import sys
 from typing import (
     ItemsView,
     Iterator,
+    TextIO,
     KeysView,
     Literal,
     Union,
@@ -29,6 +30,10 @@ from pydantic import BaseModel, ConfigDict, RootModel, ValidationError
 
 jqlang_schema = str
 
+# libyaml is much faster, but isn't always available
+_yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_yaml_dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 
 # TODO: ensure added fields get removed before compose file dump
 # TODO: default values (which must be unique instances for each container instance)
@@ -267,7 +272,7 @@ def injest_config(config_file) -> Config:
             sys.exit(1)
     elif config_file.name[-5:] == ".yaml":
         # TODO: error handling
-        parsed_config = yaml.load(config_file, yaml.Loader)
+        parsed_config = yaml.load(config_file, _yaml_loader)
     else:
         raise NotImplementedError(f"File format not supported for {config_file.name}")
     try:
@@ -277,3 +282,17 @@ def injest_config(config_file) -> Config:
         sys.exit(1)
 
     return config
+
+
+def dump_compose(stack: ConfigStack, stream: TextIO):
+    """
+    Write the compose file for the stack.
+
+    Each top-level section (services, volumes, networks...) is dumped and written
+    on its own, so the whole stack never has to be a dict at once.
+    """
+    keys = set(ConfigStack.model_fields) | set(stack.model_extra or {})
+    keys.discard("jq_pools")
+    # sorted like yaml.dump would
+    for key in sorted(keys):
+        yaml.dump(stack.model_dump(include={key}), stream, Dumper=_yaml_dumper)
@@ -0,0 +1,788 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Deploy a stack with the docker SDK, without going through `docker-sdp`.
+
+Only the compose features below are supported. Anything else raises
+UnsupportedComposeError before anything is written, so the caller can fall back
+to `docker-sdp`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import shlex
+import time
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import click
+import docker
+import docker.errors
+import docker.types
+from docker.models.services import Service
+
+from .prepull import registry_digest
+from .schemas import ConfigStack
+
+stack_namespace_label = "com.docker.stack.namespace"
+spec_hash_label = "docker_static_cluster.spec_hash"
+
+_top_level_keys = {"version", "name", "services", "volumes", "networks"}
+_top_level_keys |= {"configs", "secrets", "jq_pools"}
+_service_keys = {
+    "image",
+    "command",
+    "entrypoint",
+    "environment",
+    "labels",
+    "deploy",
+    "ports",
+    "volumes",
+    "networks",
+    "configs",
+    "secrets",
+    "hostname",
+    "user",
+    "working_dir",
+    "stop_signal",
+    "tty",
+    "read_only",
+    "cap_add",
+    "cap_drop",
+    "init",
+}
+# docker stack deploy ignores these too
+_ignored_service_keys = {
+    "build",
+    "container_name",
+    "depends_on",
+    "links",
+    "external_links",
+    "restart",
+}
+_deploy_keys = {"mode", "replicas", "labels", "placement", "endpoint_mode"}
+_placement_keys = {"constraints", "preferences", "max_replicas_per_node"}
+_volume_keys = {"driver", "driver_opts", "external", "labels", "name"}
+_network_keys = {"driver", "driver_opts", "attachable", "external", "internal"}
+_network_keys |= {"labels", "name"}
+_file_object_keys = {"file", "external", "labels", "name"}
+_file_reference_keys = {"source", "target", "uid", "gid", "mode"}
+_mount_keys = {"type", "source", "target", "read_only"}
+_port_keys = {"target", "published", "protocol", "mode"}
+
+
+class UnsupportedComposeError(click.ClickException):
+    """The stack uses something the native stack deploy can't do"""
+
+
+def _check_keys(where: str, d: dict, allowed: Iterable[str]):
+    for key in d:
+        if key not in allowed and not key.startswith("x-"):
+            raise UnsupportedComposeError(f"{where}.{key} is not supported")
+
+
+def _command(value) -> List[str]:
+    if isinstance(value, str):
+        return shlex.split(value)
+    return list(value)
+
+
+def _key_values(where: str, value) -> Dict[str, str]:
+    """Labels or environment, in either the dict or list form"""
+    if isinstance(value, dict):
+        for key, v in value.items():
+            if v is None:
+                raise UnsupportedComposeError(f"{where}.{key} has no value")
+        return {key: str(v) for key, v in value.items()}
+    pairs = {}
+    for item in value:
+        if "=" not in item:
+            raise UnsupportedComposeError(f"{where} entry {item!r} has no value")
+        key, v = item.split("=", 1)
+        pairs[key] = v
+    return pairs
+
+
+def _object_name(stack_name: str, name: str, d: dict) -> str:
+    if d.get("external"):
+        return d.get("name", name)
+    return d.get("name", f"{stack_name}_{name}")
+
+
+class FileObject(NamedTuple):
+    """A config or secret, named after a hash of its content"""
+
+    name: str
+    data: Optional[bytes]
+    labels: Dict[str, str]
+    external: bool
+
+
+class StackPlan(NamedTuple):
+    networks: Dict[str, dict]
+    configs: Dict[str, FileObject]
+    secrets: Dict[str, FileObject]
+    # service name to (create kwargs, config references, secret references)
+    services: Dict[str, Tuple[dict, List[dict], List[dict]]]
+
+
+def _file_objects(
+    stack_name: str, kind: str, objects: dict, base_dir: str
+) -> Dict[str, FileObject]:
+    planned = {}
+    for name, d in objects.items():
+        _check_keys(f"{kind}.{name}", d, _file_object_keys)
+        labels = {stack_namespace_label: stack_name}
+        labels.update(_key_values(f"{kind}.{name}.labels", d.get("labels") or {}))
+        if d.get("external"):
+            planned[name] = FileObject(d.get("name", name), None, labels, True)
+            continue
+        if "file" not in d:
+            raise UnsupportedComposeError(f"{kind}.{name} needs a file")
+        path = os.path.join(base_dir, os.path.expanduser(d["file"]))
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        full_name = f"{_object_name(stack_name, name, d)}-{digest}"
+        planned[name] = FileObject(full_name, data, labels, False)
+    return planned
+
+
+def _file_mode(mode) -> int:
+    # YAML and TOML both already parse 0444 as octal, strings are left as-is
+    if isinstance(mode, str):
+        return int(mode, 8)
+    return mode
+
+
+def _file_references(
+    where: str, references: list, objects: Dict[str, FileObject]
+) -> List[dict]:
+    planned = []
+    for reference in references:
+        if isinstance(reference, str):
+            reference = {"source": reference}
+        _check_keys(where, reference, _file_reference_keys)
+        if reference["source"] not in objects:
+            raise UnsupportedComposeError(
+                f"{where} uses undefined {reference['source']}"
+            )
+        planned.append(
+            {
+                "name": objects[reference["source"]].name,
+                "filename": reference.get("target", reference["source"]),
+                "uid": reference.get("uid"),
+                "gid": reference.get("gid"),
+                "mode": _file_mode(reference.get("mode", 0o444)),
+            }
+        )
+    return planned
+
+
+def _ports(where: str, ports: list) -> Dict[int, Tuple[int, str, str]]:
+    endpoint_ports: Dict[int, Tuple[int, str, str]] = {}
+    for port in ports:
+        if isinstance(port, dict):
+            _check_keys(where, port, _port_keys)
+            published = port.get("published")
+            target = port["target"]
+            protocol = port.get("protocol", "tcp")
+            mode = port.get("mode", "ingress")
+        else:
+            spec, _, protocol = str(port).partition("/")
+            published, _, target = spec.rpartition(":")
+            protocol = protocol or "tcp"
+            mode = "ingress"
+        try:
+            published = int(published)
+            target = int(target)
+        except (TypeError, ValueError) as e:
+            raise UnsupportedComposeError(f"{where} {port!r} is not supported") from e
+        if published in endpoint_ports:
+            raise UnsupportedComposeError(f"{where} publishes {published} twice")
+        endpoint_ports[published] = (target, protocol, mode)
+    return endpoint_ports
+
+
+def _mounts(
+    stack_name: str, where: str, volumes: list, stack_volumes: dict, base_dir: str
+) -> List[docker.types.Mount]:
+    mounts = []
+    for volume in volumes:
+        if isinstance(volume, dict):
+            _check_keys(where, volume, _mount_keys)
+            type_ = volume.get("type", "volume")
+            source = volume.get("source")
+            target = volume["target"]
+            read_only = volume.get("read_only", False)
+        else:
+            parts = volume.split(":")
+            if len(parts) == 1:
+                source, target, mode = None, parts[0], "rw"
+            elif len(parts) in (2, 3):
+                source, target, mode = parts[0], parts[1], (parts[2:] or ["rw"])[0]
+            else:
+                raise UnsupportedComposeError(f"{where} {volume!r} is not supported")
+            if mode not in ("ro", "rw"):
+                raise UnsupportedComposeError(f"{where} mode {mode!r} is not supported")
+            read_only = mode == "ro"
+            type_ = "bind" if source and source[0] in "./~" else "volume"
+
+        kwargs: dict = {}
+        if type_ == "volume" and source:
+            if source not in stack_volumes:
+                raise UnsupportedComposeError(f"{where} uses undefined volume {source}")
+            volume_d = stack_volumes[source] or {}
+            kwargs["labels"] = {stack_namespace_label: stack_name}
+            kwargs["labels"].update(
+                _key_values(f"volumes.{source}.labels", volume_d.get("labels") or {})
+            )
+            if volume_d.get("driver") or volume_d.get("driver_opts"):
+                kwargs["driver_config"] = docker.types.DriverConfig(
+                    volume_d.get("driver") or "local", volume_d.get("driver_opts")
+                )
+            source = _object_name(stack_name, source, volume_d)
+        elif type_ == "bind":
+            source = os.path.normpath(
+                os.path.join(base_dir, os.path.expanduser(source))
+            )
+        elif type_ != "tmpfs" and type_ != "volume":
+            raise UnsupportedComposeError(f"{where} type {type_} is not supported")
+        mounts.append(
+            docker.types.Mount(
+                target, source, type=type_, read_only=read_only, **kwargs
+            )
+        )
+    return mounts
+
+
+def _service_networks(
+    stack_name: str, service_name: str, networks, stack_networks: dict
+) -> List[docker.types.NetworkAttachmentConfig]:
+    if not networks:
+        networks = {"default": None}
+    elif not isinstance(networks, dict):
+        networks = {network: None for network in networks}
+    attachments = []
+    for network, attachment_d in networks.items():
+        attachment_d = attachment_d or {}
+        _check_keys(
+            f"services.{service_name}.networks.{network}", attachment_d, {"aliases"}
+        )
+        attachments.append(
+            docker.types.NetworkAttachmentConfig(
+                _object_name(stack_name, network, stack_networks.get(network) or {}),
+                # like docker stack deploy, so services can find each other by
+                #  their name in the compose file
+                aliases=[service_name] + list(attachment_d.get("aliases") or []),
+            )
+        )
+    return attachments
+
+
+def _service(
+    stack_name: str,
+    service_name: str,
+    service_d: dict,
+    stack_d: dict,
+    configs: Dict[str, FileObject],
+    secrets: Dict[str, FileObject],
+    base_dir: str,
+) -> Tuple[dict, List[dict], List[dict]]:
+    where = f"services.{service_name}"
+    _check_keys(where, service_d, _service_keys | _ignored_service_keys)
+    if "image" not in service_d:
+        raise UnsupportedComposeError(f"{where} needs an image")
+    labels = {stack_namespace_label: stack_name}
+    kwargs: dict = {
+        "name": f"{stack_name}_{service_name}",
+        "image": service_d["image"],
+        "labels": labels,
+        "container_labels": {stack_namespace_label: stack_name},
+    }
+    if "entrypoint" in service_d:
+        kwargs["command"] = _command(service_d["entrypoint"])
+    if "command" in service_d:
+        kwargs["args"] = _command(service_d["command"])
+    if "environment" in service_d:
+        kwargs["env"] = [
+            f"{key}={value}"
+            for key, value in _key_values(
+                f"{where}.environment", service_d["environment"]
+            ).items()
+        ]
+    if "labels" in service_d:
+        kwargs["container_labels"].update(
+            _key_values(f"{where}.labels", service_d["labels"])
+        )
+    for key, kwarg in (
+        ("hostname", "hostname"),
+        ("user", "user"),
+        ("working_dir", "workdir"),
+        ("stop_signal", "stop_signal"),
+        ("tty", "tty"),
+        ("read_only", "read_only"),
+        ("cap_add", "cap_add"),
+        ("cap_drop", "cap_drop"),
+        ("init", "init"),
+    ):
+        if key in service_d:
+            kwargs[kwarg] = service_d[key]
+
+    deploy_d = service_d.get("deploy") or {}
+    _check_keys(f"{where}.deploy", deploy_d, _deploy_keys)
+    if deploy_d.get("mode", "replicated") == "global":
+        kwargs["mode"] = docker.types.ServiceMode("global")
+    else:
+        kwargs["mode"] = docker.types.ServiceMode(
+            "replicated", replicas=deploy_d.get("replicas", 1)
+        )
+    labels.update(_key_values(f"{where}.deploy.labels", deploy_d.get("labels") or {}))
+    placement_d = deploy_d.get("placement") or {}
+    _check_keys(f"{where}.deploy.placement", placement_d, _placement_keys)
+    if "constraints" in placement_d:
+        kwargs["constraints"] = list(placement_d["constraints"])
+    if "preferences" in placement_d:
+        kwargs["preferences"] = [
+            (strategy, descriptor)
+            for preference in placement_d["preferences"]
+            for strategy, descriptor in preference.items()
+        ]
+    if "max_replicas_per_node" in placement_d:
+        kwargs["maxreplicas"] = placement_d["max_replicas_per_node"]
+
+    endpoint_ports = _ports(f"{where}.ports", service_d.get("ports") or [])
+    if endpoint_ports or "endpoint_mode" in deploy_d:
+        kwargs["endpoint_spec"] = docker.types.EndpointSpec(
+            mode=deploy_d.get("endpoint_mode"), ports=endpoint_ports or None
+        )
+    if "volumes" in service_d:
+        kwargs["mounts"] = _mounts(
+            stack_name,
+            f"{where}.volumes",
+            service_d["volumes"],
+            stack_d.get("volumes") or {},
+            base_dir,
+        )
+    kwargs["networks"] = _service_networks(
+        stack_name,
+        service_name,
+        service_d.get("networks"),
+        stack_d.get("networks") or {},
+    )
+    config_references = _file_references(
+        f"{where}.configs", service_d.get("configs") or [], configs
+    )
+    secret_references = _file_references(
+        f"{where}.secrets", service_d.get("secrets") or [], secrets
+    )
+
+    labels[spec_hash_label] = _spec_hash(kwargs, config_references, secret_references)
+    return kwargs, config_references, secret_references
+
+
+def _spec_hash(
+    kwargs: dict, config_references: List[dict], secret_references: List[dict]
+) -> str:
+    # hashed before any IDs are known, the config and secret names already
+    #  change with their content
+    labels = {
+        key: value for key, value in kwargs["labels"].items() if key != spec_hash_label
+    }
+    return hashlib.sha256(
+        json.dumps(
+            [dict(kwargs, labels=labels), config_references, secret_references],
+            sort_keys=True,
+            default=str,
+        ).encode()
+    ).hexdigest()
+
+
+def _is_unchanged(kwargs: dict, live_labels: dict) -> bool:
+    # NOTE: an image that isn't pinned to a digest could have been pushed
+    #  since, so like docker stack deploy, its service is always updated
+    return (
+        "@" in kwargs["image"]
+        and live_labels.get(spec_hash_label) == kwargs["labels"][spec_hash_label]
+    )
+
+
+def plan_stack(stack_name: str, stack: ConfigStack, base_dir: str) -> StackPlan:
+    """
+    Translate the stack into what has to exist in the swarm.
+
+    This doesn't talk to docker, so it's safe to fall back to `docker-sdp` when
+    it raises UnsupportedComposeError.
+    """
+    stack_d = stack.model_dump()
+    _check_keys("stack", stack_d, _top_level_keys)
+
+    networks = {}
+    for network, network_d in (stack_d.get("networks") or {}).items():
+        network_d = network_d or {}
+        _check_keys(f"networks.{network}", network_d, _network_keys)
+        networks[network] = network_d
+    services = stack_d.get("services") or {}
+    if any(not service_d.get("networks") for service_d in services.values()):
+        networks.setdefault("default", {})
+    for volume, volume_d in (stack_d.get("volumes") or {}).items():
+        _check_keys(f"volumes.{volume}", volume_d or {}, _volume_keys)
+
+    configs = _file_objects(
+        stack_name, "configs", stack_d.get("configs") or {}, base_dir
+    )
+    secrets = _file_objects(
+        stack_name, "secrets", stack_d.get("secrets") or {}, base_dir
+    )
+    return StackPlan(
+        networks=networks,
+        configs=configs,
+        secrets=secrets,
+        services={
+            service_name: _service(
+                stack_name, service_name, service_d, stack_d, configs, secrets, base_dir
+            )
+            for service_name, service_d in services.items()
+        },
+    )
+
+
+def resolve_images(
+    d_client: docker.DockerClient, plan: StackPlan, concurrency: int = 4
+) -> StackPlan:
+    """
+    Pin the services' images to the digests the registry has for them, like
+    `docker stack deploy` does, so pushing to a tag rolls the services using it.
+
+    Images the registry can't be asked about are left as they are.
+    """
+    images = sorted(
+        {
+            kwargs["image"]
+            for kwargs, _, _ in plan.services.values()
+            if "@" not in kwargs["image"]
+        }
+    )
+    if not images:
+        return plan
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        digests = dict(
+            zip(
+                images,
+                executor.map(lambda image: registry_digest(d_client, image), images),
+            )
+        )
+    services = {}
+    for service_name, service in plan.services.items():
+        kwargs, config_references, secret_references = service
+        digest = digests.get(kwargs["image"])
+        if digest:
+            kwargs = dict(
+                kwargs,
+                image=f"{kwargs['image']}@{digest}",
+                labels=dict(kwargs["labels"]),
+            )
+            kwargs["labels"][spec_hash_label] = _spec_hash(
+                kwargs, config_references, secret_references
+            )
+            service = kwargs, config_references, secret_references
+        services[service_name] = service
+    return plan._replace(services=services)
+
+
+def _ensure_file_objects(
+    collection, stack_name: str, objects: Dict[str, FileObject], kind: str, echo
+) -> Dict[str, str]:
+    """Create any missing configs or secrets, returning their IDs by name"""
+    existing = {
+        d_object.name: d_object.id
+        for d_object in collection.list(
+            filters={"label": f"{stack_namespace_label}={stack_name}"}
+        )
+    }
+    ids = {}
+    for file_object in objects.values():
+        if file_object.external:
+            ids[file_object.name] = collection.get(file_object.name).id
+        elif file_object.name in existing:
+            ids[file_object.name] = existing[file_object.name]
+        else:
+            echo(f"Creating {kind} {file_object.name}")
+            ids[file_object.name] = collection.create(
+                name=file_object.name, data=file_object.data, labels=file_object.labels
+            ).id
+    return ids
+
+
+def _used_file_object_ids(d_client: docker.DockerClient) -> Set[str]:
+    """The configs and secrets any service uses, or would roll back to"""
+    used = set()
+    for attrs in d_client.api.services():
+        for spec in (attrs.get("Spec"), attrs.get("PreviousSpec")):
+            container_spec = ((spec or {}).get("TaskTemplate") or {}).get(
+                "ContainerSpec"
+            ) or {}
+            for reference in container_spec.get("Configs") or []:
+                used.add(reference.get("ConfigID"))
+            for reference in container_spec.get("Secrets") or []:
+                used.add(reference.get("SecretID"))
+    return used
+
+
+def _prune_file_objects(collection, stack_name: str, keep: Set[str], kind: str, echo):
+    """
+    Remove the stack's configs or secrets that aren't in keep.
+
+    Their names change with their content, so each change leaves the old one
+    behind otherwise.
+    """
+    for d_object in collection.list(
+        filters={"label": f"{stack_namespace_label}={stack_name}"}
+    ):
+        if d_object.id in keep:
+            continue
+        echo(f"Removing {kind} {d_object.name}")
+        try:
+            d_object.remove()
+        except docker.errors.APIError as e:
+            # like still being used by a service outside the stack
+            echo(f"Couldn't remove {kind} {d_object.name}: {e}")
+
+
+def _references(reference_type, ids: Dict[str, str], references: List[dict]):
+    return [
+        reference_type(
+            ids[reference["name"]],
+            reference["name"],
+            reference["filename"],
+            reference["uid"],
+            reference["gid"],
+            reference["mode"],
+        )
+        for reference in references
+    ]
+
+
+def deploy_stack(
+    d_client: docker.DockerClient,
+    stack_name: str,
+    plan: StackPlan,
+    echo: Callable[[str], None],
+) -> List[str]:
+    """
+    Make the swarm match the plan.
+
+    Services whose spec hash label already matches are left alone, as long as
+    their image is pinned to a digest (see resolve_images). Returns the
+    names of the services that were created or updated.
+    """
+    existing_networks = {
+        d_network.name
+        for d_network in d_client.networks.list(filters={"scope": "swarm"})
+    }
+    for network, network_d in plan.networks.items():
+        name = _object_name(stack_name, network, network_d)
+        if network_d.get("external") or name in existing_networks:
+            continue
+        echo(f"Creating network {name}")
+        labels = {stack_namespace_label: stack_name}
+        labels.update(
+            _key_values(f"networks.{network}.labels", network_d.get("labels") or {})
+        )
+        d_client.networks.create(
+            name,
+            driver=network_d.get("driver", "overlay"),
+            options=network_d.get("driver_opts"),
+            attachable=network_d.get("attachable"),
+            internal=network_d.get("internal", False),
+            labels=labels,
+            scope="swarm",
+        )
+
+    config_ids = _ensure_file_objects(
+        d_client.configs, stack_name, plan.configs, "config", echo
+    )
+    secret_ids = _ensure_file_objects(
+        d_client.secrets, stack_name, plan.secrets, "secret", echo
+    )
+
+    live_services = {
+        d_service.name: d_service
+        for d_service in d_client.services.list(
+            filters={"label": f"{stack_namespace_label}={stack_name}"}
+        )
+    }
+    changed = []
+    for service_name, (
+        kwargs,
+        config_references,
+        secret_references,
+    ) in plan.services.items():
+        d_service = live_services.get(kwargs["name"])
+        if d_service and _is_unchanged(
+            kwargs, d_service.attrs["Spec"].get("Labels") or {}
+        ):
+            echo(f"Service {kwargs['name']} is unchanged")
+            continue
+        kwargs = dict(kwargs)
+        kwargs["configs"] = _references(
+            docker.types.ConfigReference, config_ids, config_references
+        )
+        kwargs["secrets"] = _references(
+            docker.types.SecretReference, secret_ids, secret_references
+        )
+        if d_service:
+            echo(f"Updating service {kwargs['name']}")
+            d_service.update(**kwargs)
+        else:
+            echo(f"Creating service {kwargs['name']}")
+            d_client.services.create(**kwargs)
+        changed.append(service_name)
+
+    # NOTE: after the services switched over, and an old one is kept while
+    #  anything could still roll back to it
+    used = _used_file_object_ids(d_client)
+    _prune_file_objects(
+        d_client.configs,
+        stack_name,
+        used | set(config_ids.values()),
+        "config",
+        echo,
+    )
+    _prune_file_objects(
+        d_client.secrets,
+        stack_name,
+        used | set(secret_ids.values()),
+        "secret",
+        echo,
+    )
+    return changed
+
+
+def changed_services(
+    d_client: docker.DockerClient, stack_name: str, plan: StackPlan
+) -> List[str]:
+    """Services deploy_stack would create or update"""
+    live_labels = {
+        d_service.name: d_service.attrs["Spec"].get("Labels") or {}
+        for d_service in d_client.services.list(
+            filters={"label": f"{stack_namespace_label}={stack_name}"}
+        )
+    }
+    return [
+        service_name
+        for service_name, (kwargs, _, _) in plan.services.items()
+        if kwargs["name"] not in live_labels
+        or not _is_unchanged(kwargs, live_labels[kwargs["name"]])
+    ]
+
+
+# update states where the service is done converging
+_update_done_states = {"completed", "paused", "rollback_completed", "rollback_paused"}
+# results of _force_update where the service didn't converge on its new spec
+_update_failed_results = {
+    "paused",
+    "rollback_completed",
+    "rollback_paused",
+    "timed out",
+    "not deployed",
+}
+_max_polls_not_started = 5
+
+
+def _force_update(
+    d_service: Service, poll_interval: float, timeout: Optional[float] = None
+) -> str:
+    """
+    Bump ForceUpdate like `docker service update --force`, and wait on it, for
+    up to timeout seconds.
+    """
+    spec = d_service.attrs["Spec"]
+    task_template = dict(spec["TaskTemplate"])
+    task_template["ForceUpdate"] = int(task_template.get("ForceUpdate", 0)) + 1
+    d_service.client.api.update_service(
+        d_service.id,
+        d_service.version,
+        task_template=task_template,
+        name=spec["Name"],
+        labels=spec.get("Labels"),
+        mode=spec.get("Mode"),
+        update_config=spec.get("UpdateConfig"),
+        rollback_config=spec.get("RollbackConfig"),
+        endpoint_spec=spec.get("EndpointSpec"),
+    )
+    previous_start = (d_service.attrs.get("UpdateStatus") or {}).get("StartedAt")
+    polls_not_started = 0
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            return "timed out"
+        time.sleep(poll_interval)
+        d_service.reload()
+        update_status = d_service.attrs.get("UpdateStatus") or {}
+        if update_status.get("StartedAt") == previous_start:
+            # either it hasn't started yet, or there's nothing to roll (like a
+            #  service scaled to 0)
+            polls_not_started += 1
+            if polls_not_started >= _max_polls_not_started:
+                return "converged"
+            continue
+        if update_status.get("State") in _update_done_states:
+            return update_status["State"]
+
+
+def force_update_services(
+    d_client: docker.DockerClient,
+    stack_name: str,
+    service_names: List[str],
+    concurrency: int,
+    echo: Callable[[str], None],
+    poll_interval: float = 1,
+    timeout: Optional[float] = None,
+):
+    """
+    Force update the services, with up to concurrency of them rolling at once,
+    waiting up to timeout seconds on each.
+
+    Results are echoed in the order given. If any of the updates didn't
+    complete, like `docker service update --force` this fails once they're all
+    done.
+    """
+    live_services = {
+        d_service.name: d_service
+        for d_service in d_client.services.list(
+            filters={"label": f"{stack_namespace_label}={stack_name}"}
+        )
+    }
+
+    def force_one(service_name: str) -> str:
+        d_service = live_services.get(f"{stack_name}_{service_name}")
+        if not d_service:
+            return "not deployed"
+        return _force_update(d_service, poll_interval, timeout)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for service_name, result in zip(
+            service_names, executor.map(force_one, service_names)
+        ):
+            echo(f"Force updated service {stack_name}_{service_name}: {result}")
+            if result in _update_failed_results:
+                failed.append(f"{stack_name}_{service_name}")
+    if failed:
+        raise click.ClickException(
+            f"{len(failed)} service(s) failed to update: {', '.join(failed)}"
+        )
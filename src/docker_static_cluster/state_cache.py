@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+On-disk cache of the swarm's nodes, services and plugins, so repeat runs only
+inspect what changed.
+
+Objects are kept as inspected, with their `Version.Index` and `UpdatedAt`. On
+the next run the engine's event log since the last sync says which of them
+changed, and only those are inspected again. When the log might not cover the
+whole time since (the cache is old, there were more events than the engine
+keeps, or the daemon restarted and started a new log) everything is fetched
+again.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+import hashlib
+import re
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, TypedDict
+
+import docker
+import docker.errors
+
+from . import tracing
+from .compose_cache import load_json, store_json
+
+# past this, a daemon restart may well have cleared its event log
+_max_age = 3600
+# how many events the engine keeps in memory
+_event_log_size = 256
+_event_types = ["node", "service", "plugin"]
+
+
+class CachedState(TypedDict):
+    swarm_id: str
+    # see _engine_state
+    daemon: dict
+    # engine time the objects were last brought up to date
+    synced_at: float
+    nodes: Dict[str, dict]
+    services: Dict[str, dict]
+    plugins: List[dict]
+
+
+class SyncedState(NamedTuple):
+    nodes: List[dict]
+    services: List[dict]
+    plugins: List[dict]
+
+
+def _cache_key(d_client: docker.DockerClient, swarm_id: str) -> str:
+    key = hashlib.sha256(f"{d_client.api.base_url}\0{swarm_id}".encode())
+    return f"state-{key.hexdigest()}"
+
+
+def _parse_time(value: str) -> float:
+    """An engine timestamp, to the second"""
+    # NOTE: it has nanoseconds, and a Z, fromisoformat takes neither before 3.11
+    value = re.sub(r"\.\d+", "", value.replace("Z", "+00:00"))
+    return datetime.fromisoformat(value).timestamp()
+
+
+def _engine_state(d_client: docker.DockerClient) -> Tuple[float, dict]:
+    """
+    Now, by the engine's clock, so the event log can be asked about it, and
+    what tells this run of the daemon apart.
+
+    The time is rounded down to the second, so anything since is left for next
+    time. The daemon's own node is updated whenever it rejoins the swarm, like
+    after a restart, which also empties the event log.
+    """
+    info = d_client.api.info()
+    node_id = (info.get("Swarm") or {}).get("NodeID")
+    node_version = None
+    if node_id:
+        node_version = d_client.api.inspect_node(node_id)["Version"]["Index"]
+    daemon = {"id": info["ID"], "node_id": node_id, "node_version": node_version}
+    return _parse_time(info["SystemTime"]), daemon
+
+
+def _changed_since(
+    d_client: docker.DockerClient, since: float, until: float
+) -> Optional[Dict[str, Set[str]]]:
+    """IDs of the objects changed, by type, or None if the log can't say"""
+    changed: Dict[str, Set[str]] = defaultdict(set)
+    count = 0
+    # NOTE: every type shares the one log, so all of them are fetched to tell
+    #  if it filled up, like with healthcheck exec events. With until, the
+    #  stream ends instead of waiting for more.
+    for event in d_client.events(since=since, until=until, decode=True):
+        count += 1
+        if event.get("Type") in _event_types:
+            changed[event["Type"]].add(event.get("Actor", {}).get("ID", ""))
+    if count >= _event_log_size:
+        # older events may have been dropped
+        return None
+    return changed
+
+
+def _fetch_all(
+    d_client: docker.DockerClient, swarm_id: str, daemon: dict, now: float
+) -> CachedState:
+    return {
+        "swarm_id": swarm_id,
+        "daemon": daemon,
+        "synced_at": now,
+        "nodes": {attrs["ID"]: attrs for attrs in d_client.api.nodes()},
+        "services": {attrs["ID"]: attrs for attrs in d_client.api.services()},
+        "plugins": d_client.api.plugins(),
+    }
+
+
+def _update(
+    d_client: docker.DockerClient,
+    state: CachedState,
+    changed: Dict[str, Set[str]],
+    now: float,
+):
+    """Inspect just the changed objects, or forget them if they're gone"""
+    for kind, inspect in (
+        ("nodes", d_client.api.inspect_node),
+        ("services", d_client.api.inspect_service),
+    ):
+        for object_id in changed.get(kind[:-1], ()):
+            try:
+                state[kind][object_id] = inspect(object_id)
+            except docker.errors.NotFound:
+                state[kind].pop(object_id, None)
+    if changed.get("plugin"):
+        # a single list, rather than looking up names from IDs
+        state["plugins"] = d_client.api.plugins()
+    state["synced_at"] = now
+
+
+def sync(d_client: docker.DockerClient, swarm_id: str) -> SyncedState:
+    """The nodes, services and plugins, from the cache where they're unchanged"""
+    key = _cache_key(d_client, swarm_id)
+    state: Optional[CachedState] = load_json(key)
+    now, daemon = _engine_state(d_client)
+    changed = None
+    if (
+        isinstance(state, dict)
+        and state.get("swarm_id") == swarm_id
+        # another daemon's log, or a new one, doesn't say what happened since.
+        #  Its node being updated otherwise looks the same, but fetching
+        #  everything again then is harmless.
+        and state.get("daemon") == daemon
+        and 0 <= now - state.get("synced_at", 0) < _max_age
+    ):
+        with tracing.span("events since last sync"):
+            # overlapping the last sync a little, inspecting something again
+            #  is cheap and missing a change isn't
+            changed = _changed_since(d_client, state["synced_at"] - 1, now)
+    if state is None or changed is None:
+        with tracing.span("fetch everything"):
+            state = _fetch_all(d_client, swarm_id, daemon, now)
+    else:
+        with tracing.span("fetch changes", changed=sum(map(len, changed.values()))):
+            _update(d_client, state, changed, now)
+
+    store_json(key, state)
+    return SyncedState(
+        list(state["nodes"].values()),
+        list(state["services"].values()),
+        state["plugins"],
+    )
+
+
+def is_out_of_sequence(e: docker.errors.APIError) -> bool:
+    """If an update failed because the version it was given is out of date"""
+    return "update out of sequence" in str(e.explanation or e)
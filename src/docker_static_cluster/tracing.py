@@ -0,0 +1,129 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Spans for `--trace`, written in the Chrome trace event format.
+
+The trace can be opened in https://ui.perfetto.dev or chrome://tracing. Until
+enable() is called, span() does nothing.
+"""
+
+from collections import defaultdict
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, TextIO
+from urllib.parse import urlsplit
+
+_events: Optional[List[dict]] = None
+_thread_names: Dict[int, str] = {}
+_lock = threading.Lock()
+_start = time.perf_counter()
+
+# swarm object IDs are 25 characters, everything else is a sha256
+_api_id = re.compile(r"/(?:[0-9a-z]{25}|[0-9a-f]{64})(?=/|$)")
+_api_version = re.compile(r"^.*?/v[0-9.]+(?=/)")
+
+
+def enabled() -> bool:
+    return _events is not None
+
+
+def enable():
+    """Start recording spans, including every docker API request"""
+    global _events
+    if _events is None:
+        _events = []
+    _instrument_docker()
+
+
+def _microseconds(seconds: float) -> float:
+    return round(seconds * 1e6, 3)
+
+
+@contextlib.contextmanager
+def span(name: str, category: str = "deploy", **args) -> Iterator[None]:
+    if _events is None:
+        yield
+        return
+    thread = threading.current_thread()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": _microseconds(start - _start),
+            "dur": _microseconds(time.perf_counter() - start),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = args
+        with _lock:
+            _events.append(event)
+            _thread_names[thread.ident] = thread.name
+
+
+def _api_span_name(method: str, url: str) -> str:
+    path = _api_version.sub("", urlsplit(url).path)
+    return f"{method} {_api_id.sub('/{id}', path)}"
+
+
+def _instrument_docker():
+    from docker.api.client import APIClient
+
+    send = APIClient.send
+    if getattr(send, "_traced", False):
+        return
+
+    def traced_send(self, request, **kwargs):
+        with span(
+            _api_span_name(request.method, request.url), "docker", url=request.url
+        ):
+            return send(self, request, **kwargs)
+
+    traced_send._traced = True
+    APIClient.send = traced_send
+
+
+def write(stream: TextIO):
+    assert _events is not None, "tracing was never enabled"
+    with _lock:
+        events = list(_events)
+        thread_names = dict(_thread_names)
+    metadata = [
+        {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": os.getpid(),
+            "tid": tid,
+            "args": {"name": thread_name},
+        }
+        for tid, thread_name in thread_names.items()
+    ]
+    json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, stream)
+
+
+def summary(top: int = 15) -> List[str]:
+    """The spans that took the longest in total, grouped by name"""
+    assert _events is not None, "tracing was never enabled"
+    totals: Dict[tuple, List[float]] = defaultdict(list)
+    with _lock:
+        for event in _events:
+            totals[(event["cat"], event["name"])].append(event["dur"] / 1e6)
+    rows = sorted(totals.items(), key=lambda item: sum(item[1]), reverse=True)
+    lines = [f"{'total':>9} {'count':>6} {'max':>9}  span"]
+    for (category, name), durations in rows[:top]:
+        lines.append(
+            f"{sum(durations):8.3f}s {len(durations):>6} {max(durations):8.3f}s"
+            f"  {category}: {name}"
+        )
+    return lines
@@ -0,0 +1,351 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+The pieces of `watch`: what it listens to, and what it does about it.
+
+Config file changes come from inotify (or polling, where there's no inotify),
+and cluster changes from a single docker events stream. Both are put on one
+queue, and the Reconciler applies only what changed.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+import traceback
+from typing import Callable, List, NamedTuple, Optional, Set, Tuple
+
+import click
+import docker
+
+from . import debug, tracing
+from .cluster import plugins_update, propagate_plugins, update_nodes
+from .plan import fetch_live_state, plan_nodes, plan_swarm
+from .schemas import (
+    Config,
+    ConfigNodes,
+    ConfigPlugins,
+    ConfigStack,
+    ConfigSwarm,
+)
+from .stackdeploy import (
+    UnsupportedComposeError,
+    deploy_stack,
+    plan_stack,
+    resolve_images,
+)
+
+Parts = Tuple[Config, ConfigNodes, ConfigSwarm, ConfigPlugins, ConfigStack]
+
+# from linux/inotify.h
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_inotify_event = struct.Struct("iIII")
+
+_poll_interval = 1
+_max_reconnect_delay = 30
+
+
+class WatchEvent(NamedTuple):
+    source: str  # "config", "docker" or "resync"
+    event: Optional[dict] = None
+
+
+class _Inotify:
+    """Just enough of inotify to watch one directory, without a dependency"""
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # editors often write a new file and rename it over the old one, so
+        #  watch the directory rather than the file
+        if (
+            libc.inotify_add_watch(
+                self.fd,
+                os.fsencode(directory),
+                _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE,
+            )
+            < 0
+        ):
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed on {directory}")
+
+    def read(self, timeout: float) -> Set[str]:
+        """Names of the files changed, waiting up to timeout for any"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _inotify_event.unpack_from(data, offset)
+            offset += _inotify_event.size
+            names.add(os.fsdecode(data[offset : offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        # mid-rename, most likely
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def watch_config_file(
+    path: str, notify: Callable[[WatchEvent], None], stop: threading.Event
+):
+    """Notify whenever the file at path is written, until stop is set"""
+    directory, name = os.path.split(os.path.abspath(path))
+    inotify: Optional[_Inotify]
+    try:
+        inotify = _Inotify(directory)
+    except (OSError, AttributeError, TypeError):
+        # not linux
+        inotify = None
+    last = _file_signature(path)
+    while not stop.is_set():
+        if inotify:
+            if name not in inotify.read(_poll_interval):
+                continue
+        else:
+            time.sleep(_poll_interval)
+        signature = _file_signature(path)
+        if signature and signature != last:
+            last = signature
+            notify(WatchEvent("config"))
+
+
+def watch_docker_events(
+    d_client: docker.DockerClient,
+    notify: Callable[[WatchEvent], None],
+    stop: threading.Event,
+):
+    """
+    Notify about node and service events, on one streaming connection.
+
+    If the stream breaks it's reconnected, with a resync since events may have
+    been missed in between.
+    """
+    delay = 1
+    connected_before = False
+    while not stop.is_set():
+        try:
+            events = d_client.events(decode=True, filters={"type": ["node", "service"]})
+            if connected_before:
+                notify(WatchEvent("resync"))
+            connected_before = True
+            delay = 1
+            for event in events:
+                notify(WatchEvent("docker", event))
+                if stop.is_set():
+                    events.close()
+                    return
+        except Exception as e:
+            click.echo(f"docker events stream failed: {type(e).__name__}: {e}")
+        stop.wait(delay)
+        delay = min(delay * 2, _max_reconnect_delay)
+
+
+class Reconciler:
+    """
+    Keeps the resolved config and the live state, and applies changes to either.
+
+    resolve re-reads the config file. update_swarm and fallback_deploy stand in
+    for `swarm update` and a docker-sdp stack deploy.
+    """
+
+    def __init__(
+        self,
+        d_client: docker.DockerClient,
+        stack_name: str,
+        base_dir: str,
+        resolve: Callable[[], Parts],
+        update_swarm: Callable[[], None],
+        fallback_deploy: Callable[[], None],
+        node_concurrency: int,
+        propagate_concurrency: int,
+        propagate_timeout: Optional[float],
+    ):
+        self.d_client = d_client
+        self.stack_name = stack_name
+        self.base_dir = base_dir
+        self.resolve = resolve
+        self.update_swarm = update_swarm
+        self.fallback_deploy = fallback_deploy
+        self.node_concurrency = node_concurrency
+        self.propagate_concurrency = propagate_concurrency
+        self.propagate_timeout = propagate_timeout
+        self.parts = resolve()
+        self.live = fetch_live_state(d_client)
+
+    def handle(self, events: List[WatchEvent]):
+        """Apply everything the events call for, as one batch"""
+        start = time.monotonic()
+        sources = sorted({event.source for event in events})
+        with tracing.span(f"reconcile {', '.join(sources)}", "watch"):
+            try:
+                if "resync" in sources:
+                    self.live = fetch_live_state(self.d_client)
+                    self.reconcile_all()
+                else:
+                    if "config" in sources:
+                        self.config_changed()
+                    docker_events = [
+                        event.event for event in events if event.source == "docker"
+                    ]
+                    if docker_events:
+                        self.docker_events(docker_events)
+            except click.ClickException as e:
+                click.echo(f"Error: {e.format_message()}")
+            except Exception as e:
+                # keep watching, the next change may well fix it
+                if debug:
+                    click.echo(traceback.format_exc())
+                click.echo(f"reconcile failed: {type(e).__name__}: {e}")
+        click.echo(
+            f"Reconciled {', '.join(sources)} in {time.monotonic() - start:.2f}s"
+        )
+
+    def reconcile_all(self):
+        """Like deploy --diff, against the live state"""
+        _, nodes, swarm, plugins, _ = self.parts
+        if swarm and plan_swarm(self.live, swarm):
+            self.update_swarm()
+        changed_nodes = {
+            change.name for change in plan_nodes(self.live, nodes)
+        } & nodes.keys()
+        self._update_nodes(nodes, changed_nodes)
+        plugins_update(self.d_client, plugins, diff=True)
+        self._propagate(nodes, plugins)
+        self.deploy_stack()
+
+    def config_changed(self):
+        old_config, old_nodes, old_swarm, old_plugins, old_stack = self.parts
+        try:
+            self.parts = self.resolve()
+        except SystemExit:
+            # the error was already echoed, it's most likely a half-done edit
+            click.echo("Keeping the last config that worked")
+            return
+        _, nodes, swarm, plugins, stack = self.parts
+        if swarm != old_swarm:
+            self.update_swarm()
+        changed_nodes = {
+            node_name
+            for node_name, node_settings in nodes.items()
+            if old_nodes.get(node_name) != node_settings
+        }
+        self._update_nodes(nodes, changed_nodes)
+        if plugins != old_plugins:
+            plugins_update(self.d_client, plugins, diff=True)
+            self._propagate(nodes, plugins)
+        else:
+            # new nodes still need the plugins
+            self._propagate(
+                ConfigNodes(
+                    {
+                        node_name: nodes[node_name]
+                        for node_name in changed_nodes - old_nodes.keys()
+                    }
+                ),
+                plugins,
+            )
+        if stack != old_stack:
+            self.deploy_stack()
+
+    def docker_events(self, events: List[dict]):
+        _, nodes, _, plugins, _ = self.parts
+        if any(event.get("Type") == "node" for event in events):
+            states = {
+                d_node.id: d_node.attrs.get("Status", {}).get("State")
+                for d_node in self.live.nodes
+            }
+            changed_ids = self.live.nodes.refresh()
+            changed_names = set()
+            recovered = set()
+            for node_name in nodes.keys():
+                d_node = self.live.nodes.get(node_name)
+                if not d_node or d_node.id not in changed_ids:
+                    continue
+                changed_names.add(node_name)
+                state = d_node.attrs.get("Status", {}).get("State")
+                if state == "ready" and states.get(d_node.id) != "ready":
+                    recovered.add(node_name)
+            # someone may have changed them by hand
+            drifted = {
+                change.name
+                for change in plan_nodes(
+                    self.live,
+                    ConfigNodes({name: nodes[name] for name in changed_names}),
+                )
+            }
+            self._update_nodes(nodes, drifted)
+            # it may have missed plugin changes while it was down
+            self._propagate(
+                ConfigNodes({name: nodes[name] for name in recovered}), plugins
+            )
+        prefix = f"{self.stack_name}_"
+        if any(
+            event.get("Type") == "service"
+            and event.get("Action") == "remove"
+            and (
+                event.get("Actor", {}).get("Attributes", {}).get("name") or ""
+            ).startswith(prefix)
+            for event in events
+        ):
+            # NOTE: only removals. Updates are mostly deploy's own, and a
+            #  service edited by hand keeps its spec hash, so deploy_stack
+            #  would skip it anyway.
+            self.deploy_stack(fallback=False)
+
+    def _update_nodes(self, nodes: ConfigNodes, node_names: Set[str]):
+        if node_names:
+            update_nodes(
+                self.live.nodes,
+                ConfigNodes({name: nodes[name] for name in sorted(node_names)}),
+                self.node_concurrency,
+            )
+
+    def _propagate(self, nodes: ConfigNodes, plugins: ConfigPlugins):
+        if nodes and plugins:
+            propagate_plugins(
+                nodes,
+                plugins,
+                self.propagate_concurrency,
+                self.propagate_timeout,
+                diff=True,
+            )
+
+    def deploy_stack(self, fallback=True):
+        """
+        Deploy the stack natively. Unless fallback, a stack that needs docker-sdp
+        is left alone, since its deploy updates every service, and so sends the
+        events that would call for another.
+        """
+        try:
+            stack_plan = plan_stack(self.stack_name, self.parts[4], self.base_dir)
+        except UnsupportedComposeError as e:
+            if not fallback:
+                click.echo(
+                    f"not redeploying for docker events, it needs docker-sdp: {e}"
+                )
+                return
+            click.echo(f"falling back to docker-sdp: {e}")
+            self.fallback_deploy()
+            return
+        stack_plan = resolve_images(self.d_client, stack_plan)
+        deploy_stack(self.d_client, self.stack_name, stack_plan, click.echo)
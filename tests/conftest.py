@@ -0,0 +1,29 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+import os
+import sys
+
+import docker
+import pytest
+
+# the fake engine lives with the benchmarks, which were its first users
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks")
+)
+
+from fake_engine import FakeEngine  # noqa: E402
+
+
+@pytest.fixture
+def d_client() -> docker.DockerClient:
+    """For making models from attrs, with a version it doesn't connect"""
+    return docker.DockerClient(base_url="unix:///nonexistent", version="1.45")
+
+
+@pytest.fixture
+def engine() -> FakeEngine:
+    """A swarm of 3 managers and 2 workers, only its state is used"""
+    return FakeEngine([f"node{i}" for i in range(5)], managers=3)
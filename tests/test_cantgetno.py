@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+However the pools run (in order, in worker processes, or from earlier outputs)
+the stack they make has to be the same.
+"""
+
+import pytest
+
+from docker_static_cluster import cantgetno
+from docker_static_cluster.cantgetno import satisfy_jq_pools
+from docker_static_cluster.schemas import Config
+
+_jq_pools = {
+    # one object with everything in it
+    "volumes": {
+        "volumes": '.nodes | with_entries({key: ("data-" + .key), value: {}})',
+    },
+    # a stream of [name, entity] pairs
+    "pairs": {
+        "services": '.nodes | keys[] | ["agent-" + ., {image: "agent"}]',
+    },
+    # a stream of smaller objects
+    "objects": {
+        "networks": '.nodes | keys[] | {("net-" + .): {driver: "overlay"}}',
+    },
+    # has to see what the pools before it made
+    "listing": {
+        "services": (
+            '{listing: {image: "busybox",'
+            ' command: ($stack.services | keys | join(","))}}'
+        ),
+    },
+    "after": {
+        "services": '{late: {image: ("busybox:" + $pool)}}',
+    },
+}
+
+
+def _config(jq_pools: dict = _jq_pools) -> Config:
+    return Config.model_validate(
+        {
+            "swarm": {},
+            "nodes": {f"node{i}": {"Spec": {"Role": "worker"}} for i in range(3)},
+            "stacks": {
+                "web": {
+                    "services": {"web": {"image": "nginx"}},
+                    "jq_pools": jq_pools,
+                }
+            },
+        }
+    )
+
+
+def _satisfied(**kwargs) -> dict:
+    return satisfy_jq_pools(_config(), "web", **kwargs).model_dump(mode="json")
+
+
+def test_fragment_forms():
+    stack = _satisfied()
+    assert set(stack["volumes"]) == {"data-node0", "data-node1", "data-node2"}
+    assert set(stack["networks"]) == {"net-node0", "net-node1", "net-node2"}
+    assert set(stack["services"]) == {
+        "web",
+        "agent-node0",
+        "agent-node1",
+        "agent-node2",
+        "listing",
+        "late",
+    }
+    assert stack["services"]["late"]["image"] == "busybox:after"
+
+
+def test_stack_has_earlier_pools():
+    stack = _satisfied()
+    assert (
+        stack["services"]["listing"]["command"]
+        == "agent-node0,agent-node1,agent-node2,web"
+    )
+
+
+def test_workers_match_serial():
+    assert _satisfied(jq_workers=2) == _satisfied()
+
+
+def test_cached_outputs_match(monkeypatch):
+    pool_outputs: dict = {}
+    serial = _satisfied(pool_outputs=pool_outputs)
+    assert pool_outputs
+
+    def run_pool(*args):
+        raise AssertionError("should have reused the output")
+
+    monkeypatch.setattr(cantgetno, "_run_pool", run_pool)
+    assert _satisfied(pool_outputs=pool_outputs) == serial
+    assert _satisfied(pool_outputs=pool_outputs, jq_workers=2) == serial
+
+
+def test_replacing_is_reported(capsys):
+    jq_pools = {
+        "first": {"services": '{shared: {image: "a"}}'},
+        "second": {"services": '{shared: {image: "b"}, web: {image: "c"}}'},
+    }
+    stack = satisfy_jq_pools(_config(jq_pools), "web")
+    assert stack.services["shared"].image == "b"
+    err = capsys.readouterr().err
+    assert "jq pool second.services replaced services shared from first" in err
+    assert "jq pool second.services replaced services web from the stack" in err
+
+
+def test_bad_output():
+    with pytest.raises(TypeError, match="bad.services"):
+        satisfy_jq_pools(_config({"bad": {"services": '"nope"'}}), "web")
@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+A cached config is reused for as long as the file doesn't change, so anything
+else that changes what it resolves to mustn't be cached.
+"""
+
+import os
+
+from click.testing import CliRunner
+
+import docker_static_cluster
+from docker_static_cluster import compose_cache
+
+_config = """
+[swarm]
+
+[stacks.web.jq_pools.tagged]
+services = '{web: {image: ("nginx:" + env.TAG)}}'
+"""
+
+
+def _image(tmp_path, monkeypatch, tag: str) -> str:
+    monkeypatch.setenv("TAG", tag)
+    result = CliRunner().invoke(
+        docker_static_cluster.main,
+        [
+            "generate-compose",
+            "-f",
+            str(tmp_path / "config.toml"),
+            "-c",
+            str(tmp_path / "compose.yaml"),
+            "web",
+        ],
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0, result.output
+    for line in (tmp_path / "compose.yaml").read_text().splitlines():
+        if line.strip().startswith("image:"):
+            return line.split(":", 1)[1].strip()
+    raise AssertionError("no image in the compose file")
+
+
+def test_pools_using_env_arent_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    (tmp_path / "config.toml").write_text(_config)
+    assert _image(tmp_path, monkeypatch, "1") == "nginx:1"
+    assert _image(tmp_path, monkeypatch, "2") == "nginx:2"
+
+
+def test_entries_are_private(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    compose_cache.store_json("key", {"signing_ca_key": "secret"})
+    assert os.stat(compose_cache.cache_dir()).st_mode & 0o777 == 0o700
+    path = os.path.join(compose_cache.cache_dir(), "key.json")
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert compose_cache.load_json("key") == {"signing_ca_key": "secret"}
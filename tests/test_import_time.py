@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+The CLI is run from scripts and shell completion, so starting it has to stay
+cheap. Heavy dependencies are only imported by the commands that need them.
+"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+
+# seconds, it's about 0.05 now, the docker SDK alone is over 0.15
+import_budget = 0.15
+heavy_modules = ["docker", "yaml", "jq", "pydantic", "requests"]
+
+_src = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+
+
+def _python(*args: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [_src] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else [])
+    )
+    return subprocess.run(
+        [sys.executable, *args], env=env, capture_output=True, text=True, check=True
+    )
+
+
+def test_help_skips_heavy_modules():
+    result = _python(
+        "-c",
+        "import json, sys\n"
+        "import docker_static_cluster\n"
+        "try:\n"
+        "    docker_static_cluster.main(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print(json.dumps([m for m in {heavy_modules!r} if m in sys.modules]))",
+    )
+    assert json.loads(result.stdout.splitlines()[-1]) == []
+
+
+def test_import_time_budget():
+    # the fastest of a few runs, so a busy machine doesn't fail it
+    cumulative = []
+    for _ in range(3):
+        result = _python("-X", "importtime", "-c", "import docker_static_cluster")
+        match = re.search(
+            r"^import time:\s+\d+ \|\s+(\d+) \| docker_static_cluster$",
+            result.stderr,
+            re.MULTILINE,
+        )
+        assert match, result.stderr
+        cumulative.append(int(match.group(1)) / 1e6)
+    assert min(cumulative) < import_budget
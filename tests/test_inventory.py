@@ -0,0 +1,37 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+import click
+import pytest
+
+from docker_static_cluster.inventory import NodeInventory
+
+
+def _node(node_id: str, hostname: str, state: str = "ready") -> dict:
+    return {
+        "ID": node_id,
+        "Version": {"Index": 1},
+        "Description": {"Hostname": hostname},
+        "Spec": {"Role": "worker", "Availability": "active"},
+        "Status": {"State": state},
+    }
+
+
+def test_rejoined_node_is_preferred_over_stale_one(d_client):
+    inventory = NodeInventory(
+        d_client, [_node("old", "web1", "down"), _node("new", "web1")]
+    )
+    assert inventory.get("web1").id == "new"
+    # the stale one can still be told apart by its ID
+    assert inventory.get("old").id == "old"
+
+
+@pytest.mark.parametrize("state", ["ready", "down"])
+def test_ambiguous_hostname_raises(d_client, state):
+    inventory = NodeInventory(
+        d_client, [_node("a", "web1", state), _node("b", "web1", state)]
+    )
+    with pytest.raises(click.ClickException):
+        inventory.get("web1")
@@ -0,0 +1,77 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+"""
+A mistake in jqdeps means a jq pool's stale output gets reused, so it has to err
+on the side of reading everything, or of not caching at all.
+"""
+
+import pytest
+
+from docker_static_cluster.jqdeps import PoolDeps, program_deps
+
+
+def _config(*paths):
+    return PoolDeps(frozenset(paths), frozenset())
+
+
+@pytest.mark.parametrize(
+    "program, deps",
+    [
+        (".nodes | keys", _config(("nodes",))),
+        (".nodes.a, .nodes", _config(("nodes",))),
+        (".nodes | to_entries | map(.key)", _config(("nodes",))),
+        (".nodes[.swarm.name]", _config(("nodes",), ("swarm", "name"))),
+        ('.swarm["name"]', _config(("swarm", "name"))),
+        ("{swarm}", _config(("swarm",))),
+        ('"\\(.swarm.name)"', _config(("swarm", "name"))),
+        ("$config.swarm.name", _config(("swarm", "name"))),
+        ('.nodes as {"a": $v} | $v', _config(("nodes",))),
+        ('.nodes as [$a, {"b": $c}] | $c', _config(("nodes",))),
+        (
+            "$stack.services | keys",
+            PoolDeps(frozenset(), frozenset({("services",)})),
+        ),
+    ],
+)
+def test_paths(program, deps):
+    assert program_deps(program) == deps
+
+
+@pytest.mark.parametrize(
+    "program",
+    [
+        ".",
+        "..",
+        ".nodes = 1",
+        "keys",
+        "def f: .; f",
+        # keys in a pattern are evaluated on the input, not what's bound
+        '.nodes as {"\\(.swarm.x)": $v} | $v',
+        'reduce .nodes[] as {"\\(.x)": $v} (0; . + 1)',
+    ],
+)
+def test_reads_everything(program):
+    deps = program_deps(program)
+    assert deps is not None
+    assert deps.config is None
+
+
+@pytest.mark.parametrize(
+    "program",
+    [
+        "now",
+        "env.USER",
+        "$ENV.HOME",
+        "{a: input}",
+        '"\\(env.USER)"',
+        '"\\("\\(now)")"',
+        # giving up on reading the program mustn't make it cacheable
+        'def f: .; {"x\\(now)": {}}',
+        'def f: .; "\\($ENV.HOME)"',
+    ],
+)
+def test_uncacheable(program):
+    assert program_deps(program) is None
@@ -0,0 +1,42 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+import click
+import pytest
+
+from docker_static_cluster.inventory import NodeInventory
+from docker_static_cluster.maintenance import manager_allowance, plan_wave
+
+
+def _inventory(d_client, engine, unreachable=()) -> NodeInventory:
+    for d_node in engine.nodes.values():
+        if d_node["Description"]["Hostname"] in unreachable:
+            d_node["ManagerStatus"]["Reachability"] = "unreachable"
+    return NodeInventory(d_client, list(engine.nodes.values()))
+
+
+def test_manager_allowance(d_client, engine):
+    # 3 managers keep quorum with 2
+    assert manager_allowance(_inventory(d_client, engine)) == 1
+    assert manager_allowance(_inventory(d_client, engine, ["node0"])) == 0
+
+
+def test_manager_without_status_is_unreachable(d_client, engine):
+    del engine.nodes[next(iter(engine.nodes))]["ManagerStatus"]
+    assert manager_allowance(_inventory(d_client, engine)) == 0
+
+
+def test_wave_has_one_manager_at_most(d_client, engine):
+    inventory = _inventory(d_client, engine)
+    remaining = [f"node{i}" for i in range(5)]
+    assert plan_wave(inventory, remaining, 3) == ["node0", "node3", "node4"]
+    assert plan_wave(inventory, remaining, 1) == ["node0"]
+
+
+def test_wave_skips_managers_without_quorum(d_client, engine):
+    inventory = _inventory(d_client, engine, ["node2"])
+    assert plan_wave(inventory, ["node0", "node3"], 2) == ["node3"]
+    with pytest.raises(click.ClickException):
+        plan_wave(inventory, ["node0", "node1"], 2)
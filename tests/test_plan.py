@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+from docker_static_cluster.inventory import NodeInventory
+from docker_static_cluster.plan import (
+    Change,
+    LiveState,
+    plan_nodes,
+    plan_plugins,
+    plan_services,
+    plan_swarm,
+)
+from docker_static_cluster.schemas import (
+    ConfigNodes,
+    ConfigPlugins,
+    ConfigStack,
+    ConfigSwarm,
+)
+from docker_static_cluster.stackdeploy import stack_namespace_label
+
+
+def _live(d_client, engine, services=()) -> LiveState:
+    d_services = [
+        d_client.services.prepare_model(
+            {
+                "ID": name,
+                "Spec": {"Name": name, "Labels": {stack_namespace_label: "web"}},
+            }
+        )
+        for name in services
+    ]
+    return LiveState(
+        swarm=engine.swarm,
+        nodes=NodeInventory(d_client, list(engine.nodes.values())),
+        plugins={},
+        services={d_service.name: d_service for d_service in d_services},
+    )
+
+
+def _nodes(**specs) -> ConfigNodes:
+    nodes = {
+        f"node{i}": {"Spec": {"Role": "manager" if i < 3 else "worker"}}
+        for i in range(5)
+    }
+    for node_name, spec in specs.items():
+        nodes[node_name] = {"Spec": spec}
+    return ConfigNodes.model_validate(nodes)
+
+
+def test_nothing_to_do(d_client, engine):
+    live = _live(d_client, engine, ["web_web"])
+    swarm = ConfigSwarm(task_history_retention_limit=5, snapshot_interval=10000)
+    stack = ConfigStack.model_validate({"services": {"web": {"image": "nginx"}}})
+    assert plan_swarm(live, swarm) == []
+    assert plan_nodes(live, _nodes()) == []
+    assert plan_plugins({}, ConfigPlugins({})) == []
+    assert plan_services(live, "web", stack) == []
+
+
+def test_swarm_changed(d_client, engine):
+    live = _live(d_client, engine)
+    # the key is never sent back, so it can't be told apart
+    swarm = ConfigSwarm(task_history_retention_limit=10, signing_ca_key="key")
+    assert plan_swarm(live, swarm) == [
+        Change("swarm", "swarm", "update", "task_history_retention_limit 5 -> 10")
+    ]
+
+
+def test_nodes_changed(d_client, engine):
+    live = _live(d_client, engine)
+    nodes = _nodes(
+        node3={"Role": "worker", "Availability": "drain"},
+        node4={"Role": "rm"},
+        node5={"Role": "worker"},
+    )
+    assert plan_nodes(live, nodes) == [
+        Change("node", "node3", "update", "Availability 'active' -> 'drain'"),
+        Change("node", "node4", "remove", "rm"),
+        Change("node", "node5", "join"),
+    ]
+
+
+def test_plugins_changed(d_client):
+    d_plugin = d_client.plugins.prepare_model(
+        {"Name": "logs:latest", "Settings": {"Env": ["DEBUG=0", "LEVEL=info"]}}
+    )
+    plugins = ConfigPlugins.model_validate(
+        {
+            "logs:latest": {"image": "logs", "settings": {"DEBUG": 1}},
+            "new": {"image": "new", "settings": {}},
+            "old:latest": {"image": "old", "settings": {}, "remove": True},
+        }
+    )
+    assert plan_plugins({"logs:latest": d_plugin}, plugins) == [
+        Change("plugin", "logs:latest", "configure", "DEBUG '0' -> '1'"),
+        Change("plugin", "new", "install"),
+        Change("plugin", "new", "configure"),
+    ]
+
+
+def test_services_added_and_left_behind(d_client, engine):
+    live = _live(d_client, engine, ["web_old"])
+    stack = ConfigStack.model_validate({"services": {"web": {"image": "nginx"}}})
+    assert plan_services(live, "web", stack) == [
+        Change("service", "web_web", "create"),
+        Change("service", "web_old", "orphan"),
+    ]
@@ -0,0 +1,47 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+from docker_static_cluster.prepull import matches_constraints
+
+
+@pytest.fixture
+def d_node(d_client):
+    return d_client.nodes.prepare_model(
+        {
+            "ID": "abc",
+            "Description": {
+                "Hostname": "gpu1",
+                "Platform": {"OS": "linux", "Architecture": "x86_64"},
+                "Engine": {"Labels": {"storage": "ssd"}},
+            },
+            "Spec": {"Role": "worker", "Labels": {"zone": "a", "gpu": "true"}},
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "constraints, matches",
+    [
+        ([], True),
+        (["node.role == worker"], True),
+        (["node.role==manager"], False),
+        (["node.role != manager", "node.labels.zone == a"], True),
+        (["node.labels.zone == a", "node.labels.gpu != true"], False),
+        # swarm compares case insensitively
+        (["node.hostname == GPU1"], True),
+        (["node.platform.os == linux", "node.platform.arch == x86_64"], True),
+        (["engine.labels.storage == hdd"], False),
+        # a label the node doesn't have can't be equal
+        (["node.labels.missing == x"], False),
+        (["node.labels.missing != x"], True),
+        # what can't be made sense of is taken to match
+        (["node.unknown == x"], True),
+        (["not a constraint"], True),
+    ],
+)
+def test_matches_constraints(d_node, constraints, matches):
+    assert matches_constraints(d_node, constraints) == matches
@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: 2025 2025
+# SPDX-FileContributor: Nathan Fritzler
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+from docker_static_cluster.schemas import ConfigStack
+from docker_static_cluster.stackdeploy import (
+    UnsupportedComposeError,
+    plan_stack,
+    spec_hash_label,
+)
+
+
+def _hashes(stack_d: dict, base_dir) -> dict:
+    plan = plan_stack("web", ConfigStack.model_validate(stack_d), str(base_dir))
+    return {
+        service_name: kwargs["labels"][spec_hash_label]
+        for service_name, (kwargs, _, _) in plan.services.items()
+    }
+
+
+def _stack(**web) -> dict:
+    return {
+        "configs": {"site": {"file": "site.conf"}},
+        "services": {
+            "web": {"image": "nginx", "configs": ["site"], **web},
+            "db": {"image": "postgres"},
+        },
+    }
+
+
+def test_same_stack_same_plan(tmp_path):
+    (tmp_path / "site.conf").write_text("a")
+    assert _hashes(_stack(), tmp_path) == _hashes(_stack(), tmp_path)
+
+
+def test_changed_spec(tmp_path):
+    (tmp_path / "site.conf").write_text("a")
+    before = _hashes(_stack(), tmp_path)
+    after = _hashes(_stack(environment={"DEBUG": "1"}), tmp_path)
+    assert after["web"] != before["web"]
+    assert after["db"] == before["db"]
+
+
+def test_changed_config(tmp_path):
+    (tmp_path / "site.conf").write_text("a")
+    before = _hashes(_stack(), tmp_path)
+    (tmp_path / "site.conf").write_text("b")
+    after = _hashes(_stack(), tmp_path)
+    assert after["web"] != before["web"]
+    assert after["db"] == before["db"]
+
+
+@pytest.mark.parametrize(
+    "web",
+    [
+        {"healthcheck": {"test": ["CMD", "true"]}},
+        {"volumes": ["undefined:/data"]},
+        {"ports": ["80:80", "80:8080"]},
+    ],
+)
+def test_unsupported(tmp_path, web):
+    (tmp_path / "site.conf").write_text("a")
+    with pytest.raises(UnsupportedComposeError):
+        _hashes(_stack(**web), tmp_path)